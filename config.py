@@ -23,3 +23,39 @@ PIKPAK_OFFLINE_PATH = "None"
 
 # Web UI 端口
 WEB_PORT = 5000
+
+# 離線列表輪詢間隔（秒），每個帳號共用一個輪詢線程
+OFFLINE_POLL_INTERVAL = 10
+# 是否通過WebSocket訂閱aria2下載完成通知（需安裝websocket-client），關閉時使用輪詢
+ARIA2_WS_NOTIFY = False
+# 處理下載任務的工作線程數量，與積壓的磁力數量無關
+SCHEDULER_WORKERS = 4
+# 任務狀態資料庫路徑，留空則使用程式目錄下的jobs.db，重啟後從中恢復未完成的任務
+JOB_DB_PATH = ""
+# 每個PikPak帳號的API請求速率（次/秒）和允許的突發請求數，被限流時會自動降速
+PIKPAK_RATE_LIMIT = 2
+PIKPAK_RATE_BURST = 5
+# 每個HTTP連線池（每個PikPak帳號一個、aria2共用一個）保持的長連線數量
+HTTP_POOL_SIZE = 10
+# access token 過期前多少秒在背景用 refresh token 刷新登入憑證
+TOKEN_REFRESH_MARGIN = 300
+# Web UI 任務列表由背景線程定時刷新，這裡是刷新間隔（秒）
+STATS_REFRESH_INTERVAL = 5
+# Web UI 統計和卡住任務檢查時同時查詢的帳號數量
+ACCOUNT_QUERY_WORKERS = 4
+# Web UI 保留的日誌條數（環形緩衝，超出後丟棄最舊的）
+LOG_BUFFER_SIZE = 5000
+# 提取資料夾內檔案時同時列目錄和獲取下載連結的請求數
+FOLDER_RESOLVE_WORKERS = 4
+# 資料夾中的檔案每多少個合併成一個請求推送到aria2
+ARIA2_ADD_BATCH = 50
+# 下載直鏈過期前多少秒重新獲取（包括aria2佇列中還在排隊的檔案）
+LINK_REFRESH_MARGIN = 600
+# 對沖提交：首選帳號多少秒內沒有接受磁力，就同時提交給下一個帳號，先接受的保留，另一個刪除（0為關閉）
+HEDGE_DELAY = 0
+# 是否略過之前已完整下載過的磁力（按info-hash判斷，可用 /p -f 強制重新下載）
+SKIP_DOWNLOADED = True
+# Web 批量提交的磁力每隔多少秒放出一個到下載隊列（/api/add 立即返回批次id，可用 /api/batch/<id> 查詢進度）
+WEB_RELEASE_INTERVAL = 2
+# 大量匯入時調度器中未結束的任務達到此數量就暫停讀取清單，等有任務結束再繼續
+IMPORT_MAX_ACTIVE = 20
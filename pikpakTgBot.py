@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import json
 import logging
 import os
@@ -5,37 +7,113 @@ import re
 import sys
 import threading
 import uuid
+import heapq
+import shutil
+import sqlite3
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
 from time import sleep, time
+from urllib.parse import parse_qs, quote, urlparse
 from pikpakapi import PikPakApi
 import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import telegram
 from telegram import Update
 from telegram.ext import Updater, CallbackContext, CommandHandler, Handler, MessageHandler, Filters
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, request, render_template, jsonify
+try:
+    import websocket  # websocket-client，可選依賴，用於訂閱aria2完成通知
+except ImportError:
+    websocket = None
 
 from config import *
 
 # 配置 Flask
 app = Flask(__name__)
-# 用來存儲最新的日誌訊息，供 Web UI 顯示
-log_buffer = []
+# Web UI 保留的日誌條數
+LOG_BUFFER_SIZE = int(globals().get('LOG_BUFFER_SIZE', 5000))
+# Web UI 第一次打開時顯示的日誌條數
 MAX_LOG_SIZE = 100
+# 有新日誌或任務快照更新時通知 /api/events 的連線
+events_cond = threading.Condition()
+# 記錄當前線程正在處理的任務 id，寫入日誌供 Web UI 按任務篩選
+log_context = threading.local()
 
-class ListBuffer(logging.Handler):
+
+@contextmanager
+def job_log_context(job_id):
+    previous = getattr(log_context, 'job_id', None)
+    log_context.job_id = job_id
+    try:
+        yield
+    finally:
+        log_context.job_id = previous
+
+
+def submit_with_log_context(pool, func, *args):
+    """提交到線程池，任務在池裡的線程中沿用提交時的任務 id 記錄日誌"""
+    job_id = getattr(log_context, 'job_id', None)
+
+    def run():
+        with job_log_context(job_id):
+            return func(*args)
+
+    return pool.submit(run)
+
+
+# 日誌環形緩衝區
+class LogRing:
+    """
+    固定容量的日誌緩衝，滿了自動丟棄最舊的一條。每條日誌有遞增的序號 seq，
+    Web UI 帶上已收到的最大序號就只取新日誌。
+    """
+
+    def __init__(self, capacity):
+        self.entries = deque(maxlen=capacity)  # (seq, levelno, job_id, text)
+        self.seq = 0  # 最新一條日誌的序號
+
+    def append(self, levelno, job_id, text):
+        self.seq += 1
+        self.entries.append((self.seq, levelno, job_id, text))
+
+    def since(self, seq=None, level=None, job_id=None, limit=None):
+        """返回序號大於 seq 的日誌 [(seq, text), ...]，level 為最低等級，seq 為 None 時只取最後 limit 條"""
+        result = []
+        for entry_seq, levelno, entry_job_id, text in reversed(self.entries):  # 從新往舊找，只走過新日誌
+            if seq is not None and entry_seq <= seq:
+                break
+            if level is not None and levelno < level:
+                continue
+            if job_id is not None and entry_job_id != job_id:
+                continue
+            result.append((entry_seq, text))
+            if limit is not None and len(result) >= limit:
+                break
+        result.reverse()
+        return result
+
+
+log_ring = LogRing(LOG_BUFFER_SIZE)
+
+
+class RingBufferHandler(logging.Handler):
     def emit(self, record):
         log_entry = self.format(record)
-        log_buffer.append(log_entry)
-        if len(log_buffer) > MAX_LOG_SIZE:
-            log_buffer.pop(0)
+        with events_cond:
+            log_ring.append(record.levelno, getattr(log_context, 'job_id', None), log_entry)
+            events_cond.notify_all()
 
 # 設置日誌
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-# 添加自定義 Handler 到 log_buffer
-buffer_handler = ListBuffer()
+# 添加自定義 Handler 到 log_ring
+buffer_handler = RingBufferHandler()
 buffer_handler.setFormatter(formatter)
 logger.addHandler(buffer_handler)
 
@@ -55,16 +133,73 @@ pikpak_headers = [None] * len(USER)
 pikpak_clients = [None] * len(USER)
 # 命令运行标志，防止下载与删除命令同时运行
 running = False
-# 记录下载线程
-thread_list = []
 # 记录待下载的磁力链接
 mag_urls = []
-# 登录锁
-login_lock = threading.Lock()
+# 登入鎖，每個帳號一個，同一帳號同時只有一個線程在登入，{account: RLock}
+login_locks = {}
+login_locks_lock = threading.Lock()
 # 批量任務鎖
 batch_lock = threading.Lock()
 # 批量任務狀態
 batch_results = {}
+# 最近完成的批量任務，供 /api/batch 查詢，只保留在記憶體中，{batch_id: 批次記錄}
+finished_batches = {}
+FINISHED_BATCHES_SIZE = 100
+# 批量匯總通知最多列出的項目數
+BATCH_SUMMARY_ITEMS = 20
+# PikPak API 連線池，每個帳號一個 requests.Session，{account: Session}
+pikpak_sessions = {}
+pikpak_sessions_lock = threading.Lock()
+# PikPak API 限流器，每個帳號一個，{account: TokenBucket}
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+# 離線下載路徑對應的資料夾 id，{account: {path: folder_id}}
+folder_id_cache = {}
+folder_id_cache_lock = threading.Lock()
+# 離線任務輪詢器，每個帳號一個，{account: OfflineTaskPoller}
+offline_pollers = {}
+offline_pollers_lock = threading.Lock()
+# 離線列表輪詢間隔（秒）
+OFFLINE_POLL_INTERVAL = int(globals().get('OFFLINE_POLL_INTERVAL', 10))
+# 是否通過 WebSocket 訂閱 aria2 下載完成通知（關閉或連線失敗時使用輪詢）
+ARIA2_WS_NOTIFY = bool(globals().get('ARIA2_WS_NOTIFY', False))
+# aria2 下載狀態輪詢間隔（秒）
+ARIA2_POLL_INTERVAL = 20
+# 每個帳號的 PikPak API 請求速率（次/秒）和允許的突發請求數
+PIKPAK_RATE_LIMIT = float(globals().get('PIKPAK_RATE_LIMIT', 2))
+PIKPAK_RATE_BURST = int(globals().get('PIKPAK_RATE_BURST', 5))
+# 每個 HTTP 連線池保持的長連線數量
+HTTP_POOL_SIZE = int(globals().get('HTTP_POOL_SIZE', 10))
+# 處理下載任務的工作線程數量
+SCHEDULER_WORKERS = int(globals().get('SCHEDULER_WORKERS', 4))
+ARIA2_RPC_URL = f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc'
+# 任務狀態資料庫路徑，重啟後從這裡恢復未完成的任務和批量匯總
+JOB_DB_PATH = globals().get('JOB_DB_PATH') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'jobs.db')
+# access token 過期前多少秒在背景刷新
+TOKEN_REFRESH_MARGIN = int(globals().get('TOKEN_REFRESH_MARGIN', 300))
+# 同時查詢多少個帳號（Web UI 統計、卡住任務檢查）
+ACCOUNT_QUERY_WORKERS = int(globals().get('ACCOUNT_QUERY_WORKERS', 4))
+# 下載直鏈過期前多少秒視為即將過期，需要重新獲取
+LINK_REFRESH_MARGIN = int(globals().get('LINK_REFRESH_MARGIN', 600))
+# Web 批量提交的磁力每隔多少秒放出一個到下載隊列
+WEB_RELEASE_INTERVAL = float(globals().get('WEB_RELEASE_INTERVAL', 2))
+# 大量匯入時調度器中未結束的任務達到此數量就暫停解析，等有任務結束再繼續
+IMPORT_MAX_ACTIVE = int(globals().get('IMPORT_MAX_ACTIVE', 20))
+# 大量匯入上傳檔案的暫存目錄，讀完後刪除
+IMPORT_DIR = globals().get('IMPORT_DIR') or os.path.join(os.path.dirname(JOB_DB_PATH), 'imports')
+# 是否略過下載歷史中已完整下載過的磁力（可用 /p -f 強制重新下載）
+SKIP_DOWNLOADED = bool(globals().get('SKIP_DOWNLOADED', True))
+# 對沖提交：首選帳號多少秒內沒有接受磁力，就同時提交給下一個帳號，0 表示關閉
+HEDGE_DELAY = float(globals().get('HEDGE_DELAY', 0))
+# 資料夾中的檔案每多少個合併成一個請求推送到aria2
+ARIA2_ADD_BATCH = int(globals().get('ARIA2_ADD_BATCH', 50))
+# 提取資料夾內檔案時，同時列目錄和獲取下載連結的請求數
+FOLDER_RESOLVE_WORKERS = int(globals().get('FOLDER_RESOLVE_WORKERS', 4))
+# Web UI 任務列表快照的刷新間隔（秒）
+STATS_REFRESH_INTERVAL = float(globals().get('STATS_REFRESH_INTERVAL', 5))
+# 偶尔会出现aria2下载失败，报ssl i/o error错误，试试加上headers
+ARIA2_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:50.0) Gecko/20100101 Firefox/50.0'}
 
 # PTB所需
 if TG_API_URL[-1] == '/':
@@ -74,138 +209,476 @@ else:
 
 dispatcher = updater.dispatcher
 
+
+# 建立帶連線池的 HTTP Session，複用 TCP/TLS 長連線
+def new_http_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    # 只對建立連線失敗（如 frp 斷線）自動重試，讀取超時仍交給調用方處理，避免重複提交
+    retry = Retry(total=2, connect=2, read=False, backoff_factor=0.5)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# aria2 RPC 共用一個 Session，所有任務複用連線
+aria2_session = new_http_session()
+# 查詢多個帳號時使用的線程池，限制同時查詢的帳號數
+account_query_pool = ThreadPoolExecutor(max_workers=max(1, ACCOUNT_QUERY_WORKERS), thread_name_prefix='account-query')
+
+
+# 並行對每個帳號調用 func(account)，總耗時接近最慢的帳號，返回 {account: 結果}，出錯的帳號不在結果中
+def query_accounts(func, accounts=None):
+    futures = {account_query_pool.submit(func, account): account for account in (USER if accounts is None else list(accounts))}
+    results = {}
+    for future in as_completed(futures):
+        account = futures[future]
+        try:
+            results[account] = future.result()
+        except Exception as e:
+            logging.error(f"帳號{account}查詢失敗：{e}")
+    return results
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def notify_web_add(magnets, batch_id):
+    try:
+        msg = f"📥 收到來自 Web UI 的 {len(magnets)} 個下載任務（批次 {batch_id}）：\n\n"
+        for i, mag in enumerate(magnets[:BATCH_SUMMARY_ITEMS], 1):
+            # 簡化連結顯示，只取 xt 部分
+            mag_url_part = re.search(r'xt=.+?(&|$)', mag)
+            mag_simple = mag_url_part.group(0).rstrip('&') if mag_url_part else mag[:40] + "..."
+            msg += f"{i}. <code>{mag_simple}</code>\n"
+        if len(magnets) > BATCH_SUMMARY_ITEMS:
+            msg += f"……其餘 {len(magnets) - BATCH_SUMMARY_ITEMS} 個未列出\n"
+
+        updater.bot.send_message(chat_id=ADMIN_IDS[0], text=msg, parse_mode='HTML')
+    except Exception as e:
+        logging.error(f"Web UI 通知發送失敗: {e}")
+
 @app.route('/api/add', methods=['POST'])
 def api_add():
     data = request.json
     content = data.get('magnets', '')
     
     # 簡單的正則提取磁力鏈接
-    magnets = re.findall(r'magnet:\?xt=urn:btih:[0-9a-fA-F]{40,}.*', content)
+    magnets = re.findall(r'magnet:\?xt=urn:btih:(?:[0-9a-fA-F]{40,}|[a-zA-Z2-7]{32}).*', content)
     
     if not magnets:
         return jsonify({'status': 'error', 'message': '未找到有效的磁力連結'}), 400
 
-    # 模擬 TG update 對象，讓 main 函數可以運作
-    # 注意：這裡我們使用一個假的 update 對象，只為了兼容 main 函數的參數
-    # 因為 main 函數會用到 update.effective_chat.id 來發送通知
-    # 我們這裡取 ADMIN_IDS[0] 作為通知對象
-    
-    class MockChat:
-        id = ADMIN_IDS[0]
-        
-    class MockUpdate:
-        effective_chat = MockChat()
-        
-    mock_update = MockUpdate()
-    
-    # 初始化批量任務追蹤
+    # 自定義下載路徑
+    global PIKPAK_OFFLINE_PATH
+    offline_path = None
+    if str(PIKPAK_OFFLINE_PATH) not in ["None", "/My Pack"]:
+        offline_path = PIKPAK_OFFLINE_PATH
+
+    # 初始化批量任務追蹤（Web 請求不發送匯總通知），磁力登記後由 batch_releaser 在背景逐個放出
+    # 任務的通知對象為 ADMIN_IDS[0]
     batch_id = str(uuid.uuid4())[:8]
+    create_batch(batch_id, len(magnets))
     with batch_lock:
-            batch_results[batch_id] = {
-                'total': len(magnets),
-                'processed': 0,
-                'results': []
-            }
-            
-    logging.info(f"Web UI 收到 {len(magnets)} 個磁力下載請求")
+        batch_results[batch_id].update({
+            'notify_chat_id': ADMIN_IDS[0],
+            'offline_path': offline_path,
+            'force': bool(data.get('force')),
+            'items': [{'magnet': magnet, 'mag_url_simple': magnet_simple(magnet),
+                       'info_hash': magnet_info_hash(magnet), 'status': 'queued', 'job_id': None}
+                      for magnet in magnets]
+        })
+        job_store.save_batch(batch_id, batch_results[batch_id])
+    batch_releaser.add(batch_id)
 
-    # 通知 Telegram
-    try:
-        msg = f"📥 收到來自 Web UI 的 {len(magnets)} 個下載任務：\n\n"
-        for i, mag in enumerate(magnets, 1):
-            # 簡化連結顯示，只取 xt 部分
-            mag_url_part = re.search(r'xt=.+?(&|$)', mag)
-            mag_simple = mag_url_part.group(0).rstrip('&') if mag_url_part else mag[:40] + "..."
-            msg += f"{i}. <code>{mag_simple}</code>\n"
-        
-        updater.bot.send_message(chat_id=ADMIN_IDS[0], text=msg, parse_mode='HTML')
-    except Exception as e:
-        logging.error(f"Web UI 通知發送失敗: {e}")
+    logging.info(f"Web UI 收到 {len(magnets)} 個磁力下載請求（批次 {batch_id}）")
+
+    # 通知 Telegram，在背景發送不阻塞請求
+    threading.Thread(target=notify_web_add, args=(magnets, batch_id), daemon=True).start()
+
+    return jsonify({'status': 'ok', 'count': len(magnets), 'batch_id': batch_id})
+
+
+@app.route('/api/import', methods=['POST'])
+def api_import():
+    """
+    大量匯入：multipart 上傳一個或多個磁力清單文字檔/種子檔（欄位 files），或直接以請求體上傳磁力清單文字。
+    上傳內容邊接收邊寫入 IMPORT_DIR，立即返回批次id，由 bulk_importer 在背景解析，進度見 /api/batch/<id>
+    """
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    files = []
+    if request.mimetype == 'multipart/form-data':
+        for upload in request.files.getlist('files'):
+            path = os.path.join(IMPORT_DIR, uuid.uuid4().hex)
+            upload.save(path, IMPORT_CHUNK_SIZE)
+            files.append((path, os.path.basename(upload.filename or 'upload.txt')))
+        force = request.form.get('force', '')
+    else:
+        path = os.path.join(IMPORT_DIR, uuid.uuid4().hex)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(request.stream, f, IMPORT_CHUNK_SIZE)
+        files.append((path, 'upload.txt'))
+        force = request.args.get('force', '')
+
+    if not files:
+        return jsonify({'status': 'error', 'message': '未上傳任何檔案'}), 400
 
-    # 啟動下載線程
-    global PIKPAK_OFFLINE_PATH
     offline_path = None
     if str(PIKPAK_OFFLINE_PATH) not in ["None", "/My Pack"]:
         offline_path = PIKPAK_OFFLINE_PATH
+    batch_id = bulk_importer.create(files, chat_id=ADMIN_IDS[0], offline_path=offline_path,
+                                    force=force.lower() in ['1', 'true', 'on'])
+
+    names = '、'.join(name for _, name in files[:5]) + ('等' if len(files) > 5 else '')
+    threading.Thread(target=updater.bot.send_message, daemon=True, kwargs={
+        'chat_id': ADMIN_IDS[0],
+        'text': f"📥 收到來自 Web UI 的匯入：{names}，共{len(files)}個檔案（批次 {batch_id}），全部結束後發送匯總通知"
+    }).start()
+    return jsonify({'status': 'ok', 'files': len(files), 'batch_id': batch_id})
 
-    for magnet in magnets:
-        thread_list.append(threading.Thread(target=main, args=[mock_update, None, magnet, offline_path, batch_id]))
-        thread_list[-1].start()
-        # 增加延遲，避免同時發起過多請求導致 PikPak 報錯 (HTTP 400 operation too frequent)
-        sleep(2)
 
-    return jsonify({'status': 'ok', 'count': len(magnets)})
+@app.route('/api/batch/<batch_id>')
+def api_batch(batch_id):
+    progress = batch_progress(batch_id)
+    if progress is None:
+        return jsonify({'status': 'error', 'message': f'找不到批次 {batch_id}'}), 404
+    return jsonify({'status': 'ok', 'batch_id': batch_id, **progress})
 
 @app.route('/api/logs')
 def api_logs():
-    return jsonify({'logs': log_buffer})
+    """
+    ?since=<seq> 只返回序號大於 seq 的日誌，不帶則返回最後 limit 條（預設 100）；
+    ?level=WARNING 只返回該等級及以上，?job=<任務id> 只返回該任務的日誌。
+    """
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', None if since is not None else MAX_LOG_SIZE, type=int)
+    level = request.args.get('level')
+    if level:
+        level = logging.getLevelName(level.upper()) if not level.isdigit() else int(level)
+        if not isinstance(level, int):
+            return jsonify({'status': 'error', 'message': f'未知的日誌等級: {request.args["level"]}'}), 400
+    with events_cond:
+        entries = log_ring.since(since, level or None, request.args.get('job') or None, limit)
+        seq = log_ring.seq
+    return jsonify({'logs': [text for _, text in entries], 'seq': seq})
+
 
-def call_aria2(method, params=None):
+# SSE 心跳間隔（秒），同時也是連線斷開後最晚多久發現
+EVENTS_HEARTBEAT = 15
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/events')
+def api_events():
+    """
+    Server-Sent Events：連上時先推送目前的日誌和任務列表，之後只推送新日誌和有變化的任務，
+    沒有變化時只發心跳，Web UI 不用再定時拉取完整數據。
+    連線期間訂閱 stats_cache 讓它保持刷新，循環中只讀取現有的快照；頁面隱藏時前端會關閉連線，刷新隨之暫停。
+    """
+
+    def stream():
+        with events_cond:
+            sent_logs = log_ring.seq
+            logs = [text for _, text in log_ring.since(limit=MAX_LOG_SIZE)]
+        stats_cache.subscribe()
+        try:
+            yield from push(sent_logs, logs)
+        finally:
+            stats_cache.unsubscribe()
+
+    def push(sent_logs, logs):
+        snapshot = stats_cache.peek()
+        sent_tasks = {task_key(task): task for task in snapshot['tasks']}
+        sent_updated = snapshot['updated_at']
+        yield 'retry: 3000\n\n'
+        yield sse_event('logs', {'logs': logs, 'seq': sent_logs, 'reset': True})
+        yield sse_event('tasks', {'tasks': snapshot['tasks'], 'removed': [], 'reset': True})
+        last_write = time()
+
+        while True:
+            with events_cond:
+                events_cond.wait_for(lambda: log_ring.seq != sent_logs or stats_cache.updated_at != sent_updated,
+                                     EVENTS_HEARTBEAT)
+                logs = [text for _, text in log_ring.since(sent_logs)]
+                sent_logs = log_ring.seq
+            if logs:
+                yield sse_event('logs', {'logs': logs, 'seq': sent_logs})
+                last_write = time()
+
+            snapshot = stats_cache.peek()
+            if snapshot['updated_at'] != sent_updated:
+                sent_updated = snapshot['updated_at']
+                tasks = {task_key(task): task for task in snapshot['tasks']}
+                changed = [task for key, task in tasks.items() if sent_tasks.get(key) != task]
+                removed = [key for key in sent_tasks if key not in tasks]
+                sent_tasks = tasks
+                if changed or removed:
+                    yield sse_event('tasks', {'tasks': changed, 'removed': removed})
+                    last_write = time()
+            # 一段時間沒有推送就發心跳，瀏覽器已關閉時寫入失敗，連線隨之結束
+            if time() - last_write >= EVENTS_HEARTBEAT:
+                yield ': ping\n\n'
+                last_write = time()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def task_key(task):
+    return f"{task['type']}:{task.get('account', '')}:{task['gid']}"
+
+def call_aria2(method, params=None, timeout=2):
     """Helper to call Aria2 JSON-RPC"""
     if params is None:
         params = []
+    # system.* 方法（如 system.multicall）不需要密鑰，密鑰放在每個子調用的參數中
+    if not method.startswith('system.'):
+        params = [f"token:{ARIA2_SECRET}"] + params
     
     payload = {
         'jsonrpc': '2.0',
         'id': 'webui',
         'method': method,
-        'params': [f"token:{ARIA2_SECRET}"] + params
+        'params': params
     }
     try:
-        response = requests.post(f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc', 
-                               json=payload, timeout=2).json()
+        response = aria2_session.post(ARIA2_RPC_URL, json=payload, timeout=timeout).json()
         return response.get('result', [])
     except Exception as e:
         return []
 
+def aria2_multicall(calls, timeout=10):
+    """
+    使用 system.multicall 在一個請求中執行多個 aria2 方法
+    calls: [(method, params), ...]
+    返回: 與 calls 一一對應的列表，成功的項為該方法的 result，失敗的項為 {'code': ..., 'message': ...}；
+    整個請求失敗時返回 []
+    """
+    if not calls:
+        return []
+    methods = [{'methodName': method, 'params': [f"token:{ARIA2_SECRET}"] + list(params or [])}
+               for method, params in calls]
+    results = call_aria2('system.multicall', [methods], timeout=timeout)
+    if not isinstance(results, list) or len(results) != len(calls):
+        return []
+    # 成功的結果會被包在只有一個元素的列表裡，失敗則是錯誤結構體
+    return [r[0] if isinstance(r, list) and r else r for r in results]
+
+def aria2_tell_status_batch(gids, keys=None):
+    """
+    批量查詢多個 gid 的狀態
+    返回: {gid: status}，單個 gid 查詢失敗（如任務已被刪除）時值為錯誤結構體；整個請求失敗返回 None
+    """
+    gids = list(gids)
+    if not gids:
+        return {}
+    if keys is None:
+        keys = ["gid", "status", "errorMessage", "dir"]
+    results = aria2_multicall([('aria2.tellStatus', [each_gid, keys]) for each_gid in gids])
+    if not results:
+        return None
+    return dict(zip(gids, results))
+
+# aria2 WebSocket 通知訂閱
+class Aria2Notifier:
+    """
+    通過 aria2 的 WebSocket RPC 訂閱 onDownloadComplete/onDownloadError 等通知，
+    收到後喚醒正在等待這些 gid 的任務，讓它們立刻檢查狀態，而不是睡滿輪詢間隔。
+    連線斷開時自動重連，期間等待方退化為定時輪詢。
+    """
+
+    NOTIFY_METHODS = ('aria2.onDownloadComplete', 'aria2.onBtDownloadComplete',
+                      'aria2.onDownloadError', 'aria2.onDownloadStop')
+    RECONNECT_DELAY = 10  # 連線斷開後多少秒重連
+
+    def __init__(self, url):
+        self.url = url
+        self.cond = threading.Condition()
+        self.watched = set()  # 有任務在等待的gid
+        self.events = {}  # {gid: 收到的通知方法名}，只記錄被等待的gid
+        self.connected = False
+        self.thread = None
+
+    def start(self):
+        if websocket is None:
+            logging.warning("未安裝 websocket-client，無法訂閱aria2通知，將使用輪詢查詢下載狀態")
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                ws = websocket.create_connection(self.url, timeout=10)
+                ws.settimeout(60)
+                self.connected = True
+                logging.info(f"已連上aria2 WebSocket通知：{self.url}")
+                while True:
+                    try:
+                        message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        ws.ping()  # 長時間沒有通知，發個ping保活，避免被frp斷開
+                        continue
+                    self._dispatch(json.loads(message))
+            except Exception as e:
+                if self.connected:
+                    logging.warning(f"aria2 WebSocket連線中斷，{self.RECONNECT_DELAY}s後重連（期間使用輪詢）：{e}")
+                self.connected = False
+                sleep(self.RECONNECT_DELAY)
+
+    def _dispatch(self, message):
+        if message.get('method') not in self.NOTIFY_METHODS:
+            return
+        with self.cond:
+            for event in message.get('params', []):
+                if event.get('gid') in self.watched:
+                    self.events[event['gid']] = message['method']
+            self.cond.notify_all()
+
+    def wait(self, gids, timeout):
+        """等待 gids 中任意一個收到通知，返回收到通知的 gid 集合，超時返回空集合"""
+        gids = set(gids)
+        with self.cond:
+            self.watched |= gids
+            self.cond.wait_for(lambda: gids & self.events.keys(), timeout)
+            hit = gids & self.events.keys()
+            for each_gid in hit:
+                self.events.pop(each_gid)
+            return hit
+
+    def unwatch(self, gids):
+        with self.cond:
+            for each_gid in gids:
+                self.watched.discard(each_gid)
+                self.events.pop(each_gid, None)
+
+
+aria2_notifier = Aria2Notifier(f"{'wss' if ARIA2_HTTPS else 'ws'}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc")
+
+
+def wait_aria2_events(gids, timeout):
+    """等待 gids 中任意一個下載結束；未啟用或未連上 WebSocket 時退化為睡眠 timeout 秒後輪詢"""
+    if aria2_notifier.connected:
+        return aria2_notifier.wait(gids, timeout)
+    sleep(timeout)
+    return set()
+
 @app.route('/api/stats')
 def api_stats():
+    # 直接返回背景線程最近一次生成的快照，不在請求中訪問 PikPak 和 aria2
+    return jsonify(stats_cache.get())
+
+
+# 快照緩存
+class SnapshotCache:
+    """
+    由背景線程每隔 interval 秒調用 builder 生成一份快照，請求直接拿最新的快照，不會阻塞在上游。
+    超過 idle_timeout 秒沒有人讀取、也沒有訂閱者時暫停刷新（如沒有打開 Web UI），下一次讀取時恢復。
+    """
+
+    def __init__(self, builder, interval, idle_timeout=60, initial=None):
+        self.builder = builder
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.snapshot = initial
+        self.updated_at = 0
+        self.last_access = 0
+        self.subscribers = 0  # 長連線的數量，有連線時一直保持刷新
+        self.listeners = []
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def get(self):
+        with self.cond:
+            self.last_access = time()
+            self._wake()
+            return self.peek()
+
+    def peek(self):
+        """返回目前的快照，不算作一次讀取"""
+        with self.cond:
+            return dict(self.snapshot, updated_at=self.updated_at)
+
+    def subscribe(self):
+        with self.cond:
+            self.subscribers += 1
+            self._wake()
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+            self.last_access = time()
+
+    def _wake(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.subscribers > 0 or time() - self.last_access < self.idle_timeout)
+            try:
+                snapshot = self.builder()
+            except Exception as e:
+                logging.error(f"生成快照失敗：{e}")
+            else:
+                with self.cond:
+                    self.snapshot = snapshot
+                    self.updated_at = time()
+                for callback in self.listeners:
+                    callback()
+            sleep(self.interval)
+
+    def add_listener(self, callback):
+        """註冊快照更新後的回調"""
+        self.listeners.append(callback)
+
+
+def collect_stats():
     tasks = []
     
-    # 1. 獲取 PikPak 離線任務 (僅獲取第一個帳號，避免請求過多)
-    try:
-        if USER:
-            # 注意：這裡假設 get_offline_list 可以直接被調用，且 USER[0] 是有效的
-            # 為了避免頻繁調用導致被封，這裡最好能加個緩存，但為了簡單先直接調用
-            # 如果 get_offline_list 失敗，不會影響 Aria2 的顯示
-            pikpak_tasks = get_offline_list(USER[0])
-            for task in pikpak_tasks:
-                # PikPak 的 status: PHASE_TYPE_RUNNING, PHASE_TYPE_COMPLETE, PHASE_TYPE_ERROR
-                phase = task.get('phase')
-                progress = int(task.get('progress', 0))
-                error_msg = task.get('message', '')
-
-                # 1. 忽略離線完成且進度 100% 的任務，避免 Dashboard 過於擁擠
-                if phase == 'PHASE_TYPE_COMPLETE' and progress == 100:
+    # 1. 並行獲取所有帳號的 PikPak 離線任務，某個帳號失敗不會影響其他帳號和 Aria2 的顯示
+    # 由 stats_cache 的背景線程定時調用，不管開了多少個頁面都只按固定間隔請求；
+    # 離線列表取自各帳號的 OfflineTaskPoller，有任務在等待時不會重複請求
+    offline_lists = query_accounts(lambda account: get_offline_poller(account).snapshot(STATS_REFRESH_INTERVAL))
+    for account in USER:
+        for task in offline_lists.get(account, []):
+            # PikPak 的 status: PHASE_TYPE_RUNNING, PHASE_TYPE_COMPLETE, PHASE_TYPE_ERROR
+            phase = task.get('phase')
+            progress = int(task.get('progress', 0))
+            error_msg = task.get('message', '')
+
+            # 1. 忽略離線完成且進度 100% 的任務，避免 Dashboard 過於擁擠
+            if phase == 'PHASE_TYPE_COMPLETE' and progress == 100:
+                continue
+            
+            # 2. 忽略 "file deleted" 錯誤 (正常情況)
+            if phase == 'PHASE_TYPE_ERROR':
+                if "file deleted" in error_msg.lower() or "file_deleted" in error_msg.lower():
                     continue
-                
-                # 2. 忽略 "file deleted" 錯誤 (正常情況)
-                if phase == 'PHASE_TYPE_ERROR':
-                    if "file deleted" in error_msg.lower() or "file_deleted" in error_msg.lower():
-                        continue
-                    status = 'cloud_error'
-                else:
-                    # 顯示正在離線下載中或其他非錯誤狀態
-                    status = 'cloud_downloading'
-                
-                tasks.append({
-                    'type': 'pikpak',
-                    'gid': task.get('id'),
-                    'name': task.get('name') or task.get('file_name') or 'Unknown',
-                    'status': status,
-                    'total': int(task.get('file_size', 0)),
-                    'completed': int(task.get('file_size', 0)) * progress // 100,
-                    'speed': 0, # PikPak API 通常不返回即時速度
-                    'progress': progress,
-                    'error': error_msg if phase == 'PHASE_TYPE_ERROR' else ''
-                })
-    except Exception as e:
-        # logging.error(f"PikPak Stats Error: {e}") # 降低日誌級別或暫時忽略，避免刷屏
-        pass
+                status = 'cloud_error'
+            else:
+                # 顯示正在離線下載中或其他非錯誤狀態
+                status = 'cloud_downloading'
+            
+            tasks.append({
+                'type': 'pikpak',
+                'account': account,
+                'gid': task.get('id'),
+                'name': task.get('name') or task.get('file_name') or 'Unknown',
+                'status': status,
+                'total': int(task.get('file_size', 0)),
+                'completed': int(task.get('file_size', 0)) * progress // 100,
+                'speed': 0, # PikPak API 通常不返回即時速度
+                'progress': progress,
+                'error': error_msg if phase == 'PHASE_TYPE_ERROR' else ''
+            })
 
     # 2. 獲取 Aria2 任務
     keys = ["gid", "status", "files", "totalLength", "completedLength", "downloadSpeed", "errorMessage"]
@@ -243,17 +716,29 @@ def api_stats():
     except Exception as e:
         logging.error(f"Aria2 Stats Error: {e}")
 
-    return jsonify({'tasks': tasks})
+    return {'tasks': tasks}
+
+
+stats_cache = SnapshotCache(collect_stats, STATS_REFRESH_INTERVAL, initial={'tasks': []})
+
+
+def notify_events():
+    with events_cond:
+        events_cond.notify_all()
+
+
+stats_cache.add_listener(notify_events)
 
 @app.route('/api/stuck')
 def api_stuck():
     """獲取卡住的任務列表"""
     min_progress = request.args.get('min_progress', 90, type=int)
     
+    # 並行檢查所有帳號
+    stuck_lists = query_accounts(lambda account: get_stuck_tasks(account, min_progress))
     all_stuck = []
     for account in USER:
-        stuck = get_stuck_tasks(account, min_progress)
-        for task in stuck:
+        for task in stuck_lists.get(account, []):
             task['account'] = account
             all_stuck.append(task)
     
@@ -309,7 +794,7 @@ def api_clean():
     results = []
     
     for account in USER:
-        login(account)
+        get_headers(account)
         account_result = {'account': account, 'actions': []}
         
         if mode == 'deep':
@@ -432,12 +917,56 @@ def start(update: Update, context: CallbackContext):
                                   "/account\t管理帳號（發送/account查看使用說明）\n" 
                                   "/clean\t清空雲端硬碟+離線任務記錄（發送/clean查看使用說明）\n" 
                                   "/path\t管理pikpak離線下載的路徑\n"
-                                  "/retry\t重試卡住的離線任務（發送/retry查看使用說明）\n")
+                                  "/retry\t重試卡住的離線任務（發送/retry查看使用說明）\n"
+                                  "直接發送磁力清單文字檔或.torrent種子檔可大量匯入，說明文字中可加 -f 強制重新下載、加絕對路徑指定離線路徑\n")
+
+
+# PikPakApi 專用的事件循環
+class AsyncLoopThread:
+    """
+    一個常駐線程運行唯一的 asyncio 事件循環，所有 PikPakApi 的異步調用都提交到這裡執行。
+    PikPakApi 內部的 httpx 連線綁定在這個循環上，不會因循環被關閉而失效，多個線程的調用也能並行。
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """提交協程，立即返回 concurrent.futures.Future"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='pikpak-asyncio', daemon=True)
+                self.thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交協程並等待結果，協程拋出的異常會在調用方重新拋出"""
+        return self.submit(coro).result(timeout)
+
+
+pikpak_loop = AsyncLoopThread()
+
+
+def run_async(coro, timeout=120):
+    return pikpak_loop.run(coro, timeout)
+
+
+# 關閉被替換掉的 PikPakApi 的連線池，不等待結果
+def close_client(client):
+    httpx_client = getattr(client, 'httpx_client', None)
+    if httpx_client is not None:
+        pikpak_loop.submit(httpx_client.aclose())
 
 
 # 账号密码登录
 def login(account):
-    with login_lock:
+    with get_login_lock(account):
         index = USER.index(account)
 
         # 登录所需所有信息
@@ -450,48 +979,292 @@ def login(account):
         )
 
         # 执行异步的登录和刷新操作，并等待完成
-        # 使用新的事件循環以避免 "Event loop is closed" 錯誤
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(client.login())
-            loop.run_until_complete(client.refresh_access_token())
-        finally:
-            loop.close()
+        run_async(client.login())
+        run_async(client.refresh_access_token())
         headers = client.get_headers()
         pikpak_headers[index] = headers.copy()  # 拷贝
+        close_client(pikpak_clients[index])
         pikpak_clients[index] = client
+        token_manager.track(account, client.access_token)
+        save_session(account, client)
 
         logging.info(f"帳號{account}登入成功！")
 
 
+# 保存登入憑證，重啟後可以直接使用（不保存密碼）
+SESSION_FIELDS = ('access_token', 'refresh_token', 'encoded_token', 'captcha_token', 'user_id', 'device_id',
+                  'user_agent')
+
+
+def save_session(account, client):
+    try:
+        job_store.save_session(account, {key: getattr(client, key, None) for key in SESSION_FIELDS})
+    except Exception as e:
+        logging.warning(f"帳號{account}保存登入憑證失敗：{e}")
+
+
+# 從本地恢復上次保存的登入憑證，快過期的先刷新，沒有保存過則返回False
+def restore_session(account):
+    session = job_store.load_session(account)
+    if not session or not session.get('access_token') or not session.get('refresh_token'):
+        return False
+    with get_login_lock(account):
+        index = USER.index(account)
+        if pikpak_clients[index] is not None:  # 等鎖期間已被其他線程登入
+            return True
+        client = PikPakApi(username=account, password=PASSWORD[index], device_id=session.get('device_id'))
+        for key in SESSION_FIELDS:
+            if session.get(key) is not None:
+                setattr(client, key, session[key])
+        pikpak_headers[index] = client.get_headers().copy()
+        pikpak_clients[index] = client
+        if TokenManager.token_expiry(client.access_token) - TOKEN_REFRESH_MARGIN > time():
+            token_manager.track(account, client.access_token)
+            logging.info(f"帳號{account}使用已保存的登入憑證")
+        else:
+            refresh_login(account)
+    return True
+
+
+def get_login_lock(account):
+    with login_locks_lock:
+        if account not in login_locks:
+            login_locks[account] = threading.RLock()
+        return login_locks[account]
+
+
 # 获得headers，用于请求api
 def get_headers(account):
     index = USER.index(account)
 
     if not pikpak_headers[index]:  # headers为空则先登录
-        login(account)
-    return pikpak_headers[index]
+        # 同時請求的線程只有一個去登入，其餘等它完成後直接使用新的headers
+        with get_login_lock(account):
+            if not pikpak_headers[USER.index(account)] and not restore_session(account):
+                login(account)
+    return pikpak_headers[USER.index(account)]
 
 
 def get_clients(account):
     index = USER.index(account)
 
     if not pikpak_clients[index]:  # clients为空则先登录
+        with get_login_lock(account):
+            if not pikpak_clients[USER.index(account)] and not restore_session(account):
+                login(account)
+    return pikpak_clients[USER.index(account)]
+
+
+# 用 refresh token 換新的 access token，失敗時才完整重新登入
+# stale_headers 為請求失敗時實際使用的headers，當前headers已經不同說明其他線程已刷新過，直接沿用新的headers；
+# 不傳則以調用時的headers為準（主動刷新）
+def refresh_login(account, stale_headers=None):
+    if stale_headers is None:
+        stale_headers = pikpak_headers[USER.index(account)]
+    with get_login_lock(account):
+        index = USER.index(account)
+        if pikpak_headers[index] != stale_headers:  # 其他線程已經刷新或重新登入
+            return
+        client = pikpak_clients[index]
+        if client is not None and client.refresh_token:
+            try:
+                run_async(client.refresh_access_token())
+                pikpak_headers[index] = client.get_headers().copy()
+                token_manager.track(account, client.access_token)
+                save_session(account, client)
+                logging.info(f"帳號{account}已刷新登入憑證")
+                return
+            except Exception as e:
+                logging.warning(f"帳號{account}刷新登入憑證失敗，改為重新登入：{e}")
         login(account)
-    return pikpak_clients[index]
+
+
+# 登入憑證管理
+class TokenManager:
+    """
+    記錄每個帳號 access token 的過期時間（取自 JWT 的 exp），
+    在過期前 margin 秒由背景線程用 refresh token 刷新，請求時不用再等登入。
+    刷新失敗才完整重新登入；各 API 遇到 error_code 16 的重新登入邏輯保留作為兜底。
+    """
+
+    DEFAULT_LIFETIME = 3600  # 無法解析過期時間時假定的有效期（秒）
+
+    def __init__(self, margin):
+        self.margin = margin
+        self.expires = {}  # {account: access token 過期時間戳}
+        self.cond = threading.Condition()
+        self.thread = None
+
+    @classmethod
+    def token_expiry(cls, access_token):
+        try:
+            payload = access_token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except Exception:
+            return time() + cls.DEFAULT_LIFETIME
+
+    def track(self, account, access_token):
+        with self.cond:
+            self.expires[account] = self.token_expiry(access_token)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='token-refresh', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def forget(self, account):
+        with self.cond:
+            self.expires.pop(account, None)
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                now = time()
+                due = [account for account, expires in self.expires.items() if expires - self.margin <= now]
+                if not due:
+                    next_due = min(self.expires.values(), default=now + 3600) - self.margin
+                    self.cond.wait(max(1, next_due - now))
+                    continue
+                for account in due:
+                    # 先推遲下一次刷新，刷新失敗時一分鐘後再試，不會連續重試
+                    self.expires[account] = now + self.margin + 60
+            for account in due:
+                if account not in USER:
+                    self.forget(account)
+                    continue
+                try:
+                    refresh_login(account)
+                except Exception as e:
+                    logging.error(f"帳號{account}更新登入憑證失敗：{e}")
+
+
+token_manager = TokenManager(TOKEN_REFRESH_MARGIN)
+
+# 令牌桶限流器
+class TokenBucket:
+    """
+    令牌桶：容量 capacity 允許短時間突發，之後按每秒 rate 個令牌補充。
+    服務端返回限流錯誤（如 operation too frequent）時 throttle() 把速率減半並清空令牌，
+    之後每次成功請求逐步恢復到設定的速率。
+    """
+
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def throttle(self):
+        with self.lock:
+            self.rate = max(self.max_rate / 8, self.rate / 2)
+            self.tokens = 0
+
+    def success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def get_session(account):
+    with pikpak_sessions_lock:
+        if account not in pikpak_sessions:
+            pikpak_sessions[account] = new_http_session()
+        return pikpak_sessions[account]
+
+
+def get_rate_limiter(account):
+    with rate_limiters_lock:
+        if account not in rate_limiters:
+            rate_limiters[account] = TokenBucket(PIKPAK_RATE_LIMIT, PIKPAK_RATE_BURST)
+        return rate_limiters[account]
+
+
+# 判斷是否被 PikPak 限流
+def is_throttled(response):
+    return response.status_code == 429 or 'too frequent' in response.text.lower()
+
+
+# 發送 PikPak API 請求，所有請求都經過該帳號的限流器和連線池，被限流時降速並重試
+def pikpak_request(account, method, url, **kwargs):
+    limiter = get_rate_limiter(account)
+    for tries in range(3):
+        limiter.acquire()
+        response = get_session(account).request(method, url, **kwargs)
+        if not is_throttled(response):
+            limiter.success()
+            return response
+        limiter.throttle()
+        logging.warning(f"帳號{account}請求過於頻繁，已降低請求速率（{limiter.rate:.2f}次/秒），重試第{tries + 1}/3次...")
+    return response
+
+
+# 获取离线下载路径id，已經查過的路徑直接用緩存，不用再從根目錄逐級查找
+def resolve_offline_path(account, offline_path):
+    folder_id = cached_offline_path(account, offline_path)
+    if folder_id:
+        return folder_id
+
+    client = get_clients(account)
+    get_rate_limiter(account).acquire()
+    parent_ids = run_async(client.path_to_id(path=offline_path, create=True))
+    if parent_ids and offline_path.split("/")[-1] == parent_ids[-1]["name"]:
+        folder_id = parent_ids[-1]["id"]
+        with folder_id_cache_lock:
+            folder_id_cache.setdefault(account, {})[offline_path] = folder_id
+        return folder_id
+    return None
+
+
+def cached_offline_path(account, offline_path):
+    with folder_id_cache_lock:
+        return folder_id_cache.get(account, {}).get(offline_path)
+
+
+# 提交離線任務時表示父資料夾不存在或無效的錯誤，緩存的資料夾id可能已失效
+PARENT_FOLDER_ERRORS = ('file_not_found', 'file_in_recycle_bin', 'file_parent_not_found', 'invalid_parent_id')
+
+
+def is_parent_folder_error(result):
+    return result.get('error') in PARENT_FOLDER_ERRORS or 'parent' in str(result.get('error_description', '')).lower()
+
+
+# 清除路徑緩存，不指定帳號則清除所有帳號的
+def invalidate_offline_path(account=None):
+    with folder_id_cache_lock:
+        if account is None:
+            folder_id_cache.clear()
+        else:
+            folder_id_cache.pop(account, None)
+    # PikPakApi 自己也緩存了路徑，一併清掉，否則重新查找還是拿到舊的 id
+    for client in (pikpak_clients if account is None else [pikpak_clients[USER.index(account)]]):
+        if client is not None and isinstance(getattr(client, '_path_id_cache', None), dict):
+            client._path_id_cache.clear()
+
 
 # 离线下载磁力
 def magnet_upload(file_url, account, parent_id=None, offline_path=None):
     # 请求离线下载所需数据
     login_headers = get_headers(account)
-    client = get_clients(account)
     torrent_url = f"{PIKPAK_API_URL}/drive/v1/files"
     # 获取离线下载路径id
+    from_cache = bool(offline_path and cached_offline_path(account, offline_path))
     if offline_path:
-        parent_ids = asyncio.run(client.path_to_id(path=offline_path, create=True))
-        if parent_ids and offline_path.split("/")[-1] == parent_ids[-1]["name"]:
-            parent_id = parent_ids[-1]["id"]
+        parent_id = resolve_offline_path(account, offline_path) or parent_id
 
     # 磁力下载
     torrent_data = {
@@ -503,35 +1276,42 @@ def magnet_upload(file_url, account, parent_id=None, offline_path=None):
         "parent_id": parent_id,
     }
     # 请求离线下载
-    torrent_result = requests.post(url=torrent_url, headers=login_headers, json=torrent_data, timeout=5).json()
+    torrent_result = pikpak_request(account, 'POST', url=torrent_url, headers=login_headers, json=torrent_data, timeout=5).json()
 
     # 处理请求异常
     if "error" in torrent_result:
         if torrent_result['error_code'] == 16:
             logging.info(f"帳號{account}登入過期，正在重新登入")
-            login(account)  # 重新登录该账号
+            refresh_login(account, login_headers)  # 重新登录该账号
             login_headers = get_headers(account)
-            torrent_result = requests.post(url=torrent_url, headers=login_headers, json=torrent_data, timeout=5).json()
-
-        else:
+            torrent_result = pikpak_request(account, 'POST', url=torrent_url, headers=login_headers, json=torrent_data, timeout=5).json()
+
+        elif from_cache and is_parent_folder_error(torrent_result):
+            # 緩存的資料夾已被刪除，重新查找路徑後再提交一次；其他錯誤（額度、空間、磁力無效等）直接返回
+            logging.warning(f"帳號{account}提交離線下載任務失敗（{torrent_result.get('error_description')}），"
+                            f"重新查找離線路徑{offline_path}後重試")
+            invalidate_offline_path(account)
+            parent_id = resolve_offline_path(account, offline_path)
+            torrent_data["parent_id"] = parent_id
+            torrent_data["folder_type"] = "DOWNLOAD" if not parent_id else ""
+            torrent_result = pikpak_request(account, 'POST', url=torrent_url, headers=login_headers, json=torrent_data, timeout=5).json()
+
+        if "error" in torrent_result:
+            account_selector.report_error(account, torrent_result.get('error'), torrent_result.get('error_description', ''))
             # 可以考虑加入删除离线失败任务的逻辑
             logging.error(f"帳號{account}提交離線下載任務失敗，錯誤訊息：{torrent_result['error_description']}")
             return None, None
 
     # 输出日志
-    file_url_part = re.search(r'^(magnet:\?).*(xt=.+?)(&|$)', file_url)
-    if file_url_part:
-        file_url_simple = ''.join(file_url_part.groups()[:-1])
-        logging.info(f"帳號{account}添加離線任務:{file_url_simple}")
-    else:
-        logging.info(f"帳號{account}添加離線任務:{file_url}")
+    logging.info(f"帳號{account}添加離線任務:{magnet_simple(file_url)}")
 
     # 返回离线任务id、下载文件名
     return torrent_result['task']['id'], torrent_result['task']['name']
 
 
 # 获取所有离线任务
-def get_offline_list(account):
+# strict 為 True 時請求出錯直接拋出異常，不返回空的或只有部分頁的列表
+def get_offline_list(account, strict=False):
     # 准备信息
     login_headers = get_headers(account)
     tasks = []
@@ -540,16 +1320,18 @@ def get_offline_list(account):
     while True:
         offline_list_url = f"{PIKPAK_API_URL}/drive/v1/tasks?type=offline&page_token={next_page_token}&thumbnail_size=SIZE_LARGE&filters=%7B%7D&with=reference_resource"
         # 发送请求
-        offline_list_info = requests.get(url=offline_list_url, headers=login_headers, timeout=5).json()
+        offline_list_info = pikpak_request(account, 'GET', url=offline_list_url, headers=login_headers, timeout=5).json()
         # 处理错误
         if "error" in offline_list_info:
             if offline_list_info['error_code'] == 16:
                 logging.info(f"帳號{account}登入過期，正在重新登入")
-                login(account)
+                refresh_login(account, login_headers)
                 login_headers = get_headers(account)
                 continue # Retry current page
             else:
                 logging.error(f"帳號{account}獲取離線任務失敗，錯誤訊息：{offline_list_info.get('error_description')}")
+                if strict:
+                    raise RuntimeError(f"獲取離線任務失敗：{offline_list_info.get('error_description')}")
                 # Return whatever we have collected so far, or empty list if failed on first page
                 return tasks
 
@@ -562,25 +1344,175 @@ def get_offline_list(account):
     return tasks
 
 
+# 離線任務輪詢器
+class OfflineTaskPoller:
+    """
+    每個帳號一個後台線程，每隔 interval 秒拉取一次離線列表並按任務 id 建立索引，
+    然後通知所有監聽者推進等待中的任務。無論有多少磁力在等待，對 PikPak 的請求量都是固定的。
+    沒有任務在等待時線程自動退出，有新任務 watch 時再啟動。
+    Web UI 的任務列表也用 snapshot() 讀取這裡的結果，不會再單獨請求一次離線列表。
+    """
+
+    def __init__(self, account, interval=OFFLINE_POLL_INTERVAL):
+        self.account = account
+        self.interval = interval
+        self.tasks = {}  # {task_id: task}
+        self.updated = 0  # 上次成功刷新的時間
+        self.watching = {}  # {task_id: 等待者數量}
+        self.listeners = []  # 每輪刷新後的回調
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, task_id):
+        """登記等待某個任務，輪詢線程未運行時啟動它"""
+        with self.lock:
+            self.watching[task_id] = self.watching.get(task_id, 0) + 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def unwatch(self, task_id):
+        with self.lock:
+            count = self.watching.get(task_id, 0) - 1
+            if count > 0:
+                self.watching[task_id] = count
+            else:
+                self.watching.pop(task_id, None)
+
+    def add_listener(self, callback):
+        """註冊刷新回調 callback(account, tasks)，每輪刷新後在輪詢線程中調用，回調內不應做耗時操作"""
+        with self.lock:
+            self.listeners.append(callback)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.watching:
+                    self.thread = None
+                    return
+            try:
+                self._refresh()
+            except Exception as e:
+                logging.warning(f"帳號{self.account}輪詢離線列表時發生錯誤 (將自動重試): {e}")
+            sleep(self.interval)
+
+    def _refresh(self):
+        # 刷新失敗時拋出異常，不通知監聽者，避免把空的或不完整的列表當成任務消失
+        tasks = get_offline_list(self.account, strict=True)
+        with self.lock:
+            self.tasks = {t['id']: t for t in tasks}
+            self.updated = time()
+            listeners = list(self.listeners)
+            tasks = self.tasks
+        for callback in listeners:
+            callback(self.account, tasks)
+
+    def snapshot(self, max_age):
+        """
+        返回最近一次刷新的離線列表。輪詢線程在運行時直接用它的結果；
+        沒在運行且結果已超過 max_age 秒時由調用方刷新一次，刷新失敗返回舊的結果
+        """
+        with self.lock:
+            # 輪詢線程每 interval 秒刷新一次，在運行時多容忍一個間隔
+            age = time() - self.updated
+            if age < max_age or (self.thread is not None and age < max_age + self.interval):
+                return list(self.tasks.values())
+        try:
+            self._refresh()
+        except Exception as e:
+            logging.warning(f"帳號{self.account}獲取離線列表時發生錯誤: {e}")
+        with self.lock:
+            return list(self.tasks.values())
+
+
+def get_offline_poller(account):
+    with offline_pollers_lock:
+        if account not in offline_pollers:
+            offline_pollers[account] = OfflineTaskPoller(account)
+        return offline_pollers[account]
+
+
 # 获取下载信息
-def get_download_url(file_id, account):
+# 下載直鏈緩存
+class LinkCache:
+    """
+    記錄每個檔案 id 已獲取的下載直鏈和它的過期時間，直鏈有效期內直接複用，
+    離過期不到 margin 秒時視為即將過期，需要重新獲取。
+    """
+
+    DEFAULT_TTL = 1800  # 無法從返回結果判斷過期時間時假定的有效期（秒）
+
+    def __init__(self, margin):
+        self.margin = margin
+        self.links = {}  # {file_id: (文件名, 直鏈, 過期時間戳)}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def link_expiry(cls, download_info):
+        # 優先用返回的 links 中的 expire，其次是直鏈參數 e（過期時間戳）
+        for link in (download_info.get('links') or {}).values():
+            try:
+                return datetime.fromisoformat(link['expire'].replace('Z', '+00:00')).timestamp()
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+        return cls.url_expiry(download_info.get('web_content_link', '')) or time() + cls.DEFAULT_TTL
+
+    @staticmethod
+    def url_expiry(url):
+        try:
+            return float(parse_qs(urlparse(url).query)['e'][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    def get(self, file_id):
+        with self.lock:
+            entry = self.links.get(file_id)
+        if entry and entry[2] - self.margin > time():
+            return entry[0], entry[1]
+        return None
+
+    def put(self, file_id, name, url, expires):
+        with self.lock:
+            self.links[file_id] = (name, url, expires)
+            # 順便清掉已經過期的
+            now = time()
+            for each_id in [k for k, v in self.links.items() if v[2] <= now]:
+                self.links.pop(each_id)
+
+    def expiring(self, file_id, url=None):
+        """直鏈是否即將過期；沒有緩存時（如重啟後）從直鏈參數判斷，判斷不了返回False"""
+        with self.lock:
+            entry = self.links.get(file_id)
+        expires = entry[2] if entry and (url is None or entry[1] == url) else self.url_expiry(url or '')
+        return expires is not None and expires - self.margin <= time()
+
+
+link_cache = LinkCache(LINK_REFRESH_MARGIN)
+
+
+# 获取文件下载直链，fresh=True 時不使用緩存（如直鏈已失效）
+def get_download_url(file_id, account, fresh=False):
+    if not fresh:
+        cached = link_cache.get(file_id)
+        if cached:
+            return cached
     for tries in range(3):
         try:
             # 准备信息
             login_headers = get_headers(account)
             download_url = f"{PIKPAK_API_URL}/drive/v1/files/{file_id}?_magic=2021&thumbnail_size=SIZE_LARGE"
             # 发送请求
-            download_info = requests.get(url=download_url, headers=login_headers, timeout=5).json()
+            download_info = pikpak_request(account, 'GET', url=download_url, headers=login_headers, timeout=5).json()
             # logging.info('返回文件信息包括：\n' + str(download_info))
 
             # 处理错误
             if "error" in download_info:
                 if download_info['error_code'] == 16:
                     logging.info(f"帳號{account}登入過期，正在重新登入")
-                    login(account)
+                    refresh_login(account, login_headers)
                     login_headers = get_headers(account)
                     # Retry immediately with new headers
-                    download_info = requests.get(url=download_url, headers=login_headers, timeout=5).json()
+                    download_info = pikpak_request(account, 'GET', url=download_url, headers=login_headers, timeout=5).json()
                 
                 # Check error again after potential re-login
                 if "error" in download_info:
@@ -589,6 +1521,9 @@ def get_download_url(file_id, account):
                      continue # Retry loop
 
             # 返回文件名、文件下载直链
+            if download_info['web_content_link']:
+                link_cache.put(file_id, download_info['name'], download_info['web_content_link'],
+                               LinkCache.link_expiry(download_info))
             return download_info['name'], download_info['web_content_link']
 
         except Exception as e:
@@ -608,14 +1543,14 @@ def get_list(folder_id, account):
         list_url = f"{PIKPAK_API_URL}/drive/v1/files?parent_id={folder_id}&thumbnail_size=SIZE_LARGE" + \
                    "&filters=%7B%22trashed%22:%7B%22eq%22:false%7D%7D"
         # 发送请求
-        list_result = requests.get(url=list_url, headers=login_headers, timeout=5).json()
+        list_result = pikpak_request(account, 'GET', url=list_url, headers=login_headers, timeout=5).json()
         # 处理错误
         if "error" in list_result:
             if list_result['error_code'] == 16:
                 logging.info(f"帳號{account}登入過期，正在重新登入")
-                login(account)
+                refresh_login(account, login_headers)
                 login_headers = get_headers(account)
-                list_result = requests.get(url=list_url, headers=login_headers, timeout=5).json()
+                list_result = pikpak_request(account, 'GET', url=list_url, headers=login_headers, timeout=5).json()
             else:
                 logging.error(f"帳號{account}獲取資料夾下檔案id失敗，錯誤訊息：{list_result['error_description']}")
                 return file_list
@@ -628,7 +1563,7 @@ def get_list(folder_id, account):
                 'next_page_token'] + \
                        "&thumbnail_size=SIZE_LARGE" + "&filters=%7B%22trashed%22:%7B%22eq%22:false%7D%7D "
 
-            list_result = requests.get(url=list_url, headers=login_headers, timeout=5).json()
+            list_result = pikpak_request(account, 'GET', url=list_url, headers=login_headers, timeout=5).json()
 
             file_list += list_result['files']
 
@@ -640,25 +1575,50 @@ def get_list(folder_id, account):
         return []
 
 
+# 提取資料夾內檔案用的線程池，所有任務共用，限制同時發出的請求數
+folder_resolve_pool = ThreadPoolExecutor(max_workers=max(1, FOLDER_RESOLVE_WORKERS), thread_name_prefix='folder-resolve')
+
+
 # 获取文件夹及其子目录下所有文件id
-def get_folder_all_file(folder_id, path, account):
-    # 获取该文件夹下所有id
-    folder_list = get_list(folder_id, account)
-    # 逐个判断每个id
-    for a in folder_list:
-        # 如果是文件
-        if a["kind"] == "drive#file":
-            down_name, down_url = get_download_url(a["id"], account)
-            if down_name == "":
+# 子資料夾列表和每個檔案的下載連結並行獲取，哪個檔案先拿到連結就先返回，skip_ids 中的檔案不獲取連結
+# tick 不為 None 時，每等待 tick 秒仍沒有新檔案就產出一個 None，讓調用方有機會處理已收到的檔案
+def get_folder_all_file(folder_id, path, account, skip_ids=(), tick=None):
+    # {future: (類型, id, 路徑)}
+    pending = {submit_with_log_context(folder_resolve_pool, get_list, folder_id, account): ('folder', folder_id, path)}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=tick, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None
                 continue
-            yield down_name, down_url, a['id'], path  # 文件名、下载直链、文件id、文件路径
-        # 如果是根目录且文件夹是My Pack，则不更新path
-        elif a['name'] == 'My Pack' and folder_id == '':
-            yield from get_folder_all_file(a["id"], path, account)
-        # 其他文件夹
-        else:
-            new_path = path + a['name'] + "/"
-            yield from get_folder_all_file(a["id"], new_path, account)
+            for future in done:
+                kind, item_id, item_path = pending.pop(future)
+                if kind == 'file':
+                    down_name, down_url = future.result()
+                    if down_name == "":
+                        continue
+                    yield down_name, down_url, item_id, item_path  # 文件名、下载直链、文件id、文件路径
+                    continue
+
+                # 逐个判断该文件夹下每个id
+                for a in future.result():
+                    # 如果是文件
+                    if a["kind"] == "drive#file":
+                        if a['id'] not in skip_ids:
+                            pending[submit_with_log_context(folder_resolve_pool, get_download_url, a['id'], account)] = \
+                                ('file', a['id'], item_path)
+                    # 如果是根目录且文件夹是My Pack，则不更新path
+                    elif a['name'] == 'My Pack' and item_id == '':
+                        pending[submit_with_log_context(folder_resolve_pool, get_list, a['id'], account)] = \
+                            ('folder', a['id'], item_path)
+                    # 其他文件夹
+                    else:
+                        pending[submit_with_log_context(folder_resolve_pool, get_list, a['id'], account)] = \
+                            ('folder', a['id'], item_path + a['name'] + "/")
+    finally:
+        # 調用方中途停止時取消還沒開始的請求
+        for future in pending:
+            future.cancel()
 
 
 # 获取根目录文件夹下所有文件、文件夹id，清空网盘时用
@@ -696,16 +1656,16 @@ def delete_files(file_id, account, mode='normal'):
     else:
         delete_files_data = {"ids": [file_id]}
     # 发送请求
-    delete_files_result = requests.post(url=delete_files_url, headers=login_headers, json=delete_files_data,
-                                        timeout=5).json()
+    delete_files_result = pikpak_request(account, 'POST', url=delete_files_url, headers=login_headers, json=delete_files_data,
+                                         timeout=5).json()
     # 处理错误
     if "error" in delete_files_result:
         if delete_files_result['error_code'] == 16:
             logging.info(f"帳號{account}登入過期，正在重新登入")
-            login(account)
+            refresh_login(account, login_headers)
             login_headers = get_headers(account)
-            delete_files_result = requests.post(url=delete_files_url, headers=login_headers, json=delete_files_data,
-                                                timeout=5).json()
+            delete_files_result = pikpak_request(account, 'POST', url=delete_files_url, headers=login_headers, json=delete_files_data,
+                                                 timeout=5).json()
 
         else:
             logging.error(f"帳號{account}刪除雲端硬碟檔案失敗，錯誤訊息：{delete_files_result['error_description']}")
@@ -731,16 +1691,16 @@ def delete_trash(file_id, account, mode='normal'):
     else:
         delete_files_data = {"ids": [file_id]}
     # 发送请求
-    delete_files_result = requests.post(url=delete_files_url, headers=login_headers, json=delete_files_data,
-                                        timeout=5).json()
+    delete_files_result = pikpak_request(account, 'POST', url=delete_files_url, headers=login_headers, json=delete_files_data,
+                                         timeout=5).json()
     # 处理错误
     if "error" in delete_files_result:
         if delete_files_result['error_code'] == 16:
             logging.info(f"帳號{account}登入過期，正在重新登入")
-            login(account)
+            refresh_login(account, login_headers)
             login_headers = get_headers(account)
-            delete_files_result = requests.post(url=delete_files_url, headers=login_headers, json=delete_files_data,
-                                                timeout=5).json()
+            delete_files_result = pikpak_request(account, 'POST', url=delete_files_url, headers=login_headers, json=delete_files_data,
+                                                 timeout=5).json()
         else:
             logging.error(f"帳號{account}刪除垃圾桶檔案失敗，錯誤訊息：{delete_files_result['error_description']}")
             return False
@@ -790,7 +1750,7 @@ def delete_offline_tasks(account, task_ids=None, delete_files_too=False, phase_f
         }
         
         try:
-            result = requests.delete(url=delete_url, headers=login_headers, params=params, timeout=15)
+            result = pikpak_request(account, 'DELETE', url=delete_url, headers=login_headers, params=params, timeout=15)
             
             if result.status_code == 200:
                 success_count += len(batch)
@@ -799,9 +1759,9 @@ def delete_offline_tasks(account, task_ids=None, delete_files_too=False, phase_f
                 # 嘗試重新登入
                 if result.status_code == 401 or 'error_code' in result.text:
                     logging.info(f"帳號{account}登入過期，正在重新登入")
-                    login(account)
+                    refresh_login(account, login_headers)
                     login_headers = get_headers(account)
-                    result = requests.delete(url=delete_url, headers=login_headers, params=params, timeout=15)
+                    result = pikpak_request(account, 'DELETE', url=delete_url, headers=login_headers, params=params, timeout=15)
                     if result.status_code == 200:
                         success_count += len(batch)
                         logging.info(f"帳號{account}重試後成功刪除 {len(batch)} 個離線任務記錄")
@@ -814,8 +1774,6 @@ def delete_offline_tasks(account, task_ids=None, delete_files_too=False, phase_f
         except Exception as e:
             fail_count += len(batch)
             logging.error(f"帳號{account}刪除離線任務記錄時發生錯誤: {e}")
-        
-        sleep(1)  # 避免請求過於頻繁
     
     logging.info(f"帳號{account}離線任務記錄清理完成: 成功 {success_count}, 失敗 {fail_count}")
     return success_count, fail_count
@@ -830,16 +1788,16 @@ def empty_trash(account):
     empty_url = f"{PIKPAK_API_URL}/drive/v1/files/trash:empty"
     
     try:
-        result = requests.post(url=empty_url, headers=login_headers, json={}, timeout=15)
+        result = pikpak_request(account, 'POST', url=empty_url, headers=login_headers, json={}, timeout=15)
         
         if result.status_code == 200:
             logging.info(f"帳號{account}回收站已清空")
             return True
         else:
             if 'error_code' in result.text:
-                login(account)
+                refresh_login(account, login_headers)
                 login_headers = get_headers(account)
-                result = requests.post(url=empty_url, headers=login_headers, json={}, timeout=15)
+                result = pikpak_request(account, 'POST', url=empty_url, headers=login_headers, json={}, timeout=15)
                 if result.status_code == 200:
                     logging.info(f"帳號{account}回收站已清空")
                     return True
@@ -865,14 +1823,14 @@ def retry_offline_task(task_id, account):
     }
     
     try:
-        result = requests.post(url=retry_url, headers=login_headers, json=retry_data, timeout=10).json()
+        result = pikpak_request(account, 'POST', url=retry_url, headers=login_headers, json=retry_data, timeout=10).json()
         
         if "error" in result:
             if result['error_code'] == 16:
                 logging.info(f"帳號{account}登入過期，正在重新登入")
-                login(account)
+                refresh_login(account, login_headers)
                 login_headers = get_headers(account)
-                result = requests.post(url=retry_url, headers=login_headers, json=retry_data, timeout=10).json()
+                result = pikpak_request(account, 'POST', url=retry_url, headers=login_headers, json=retry_data, timeout=10).json()
             else:
                 logging.error(f"帳號{account}重試任務失敗: {result.get('error_description', result)}")
                 return False, result.get('error_description', 'Unknown error')
@@ -903,7 +1861,7 @@ def delete_offline_task(task_ids, account, delete_files=False):
     }
     
     try:
-        result = requests.delete(url=delete_url, headers=login_headers, params=params, timeout=10)
+        result = pikpak_request(account, 'DELETE', url=delete_url, headers=login_headers, params=params, timeout=10)
         
         if result.status_code == 200:
             logging.info(f"帳號{account}成功刪除 {len(task_ids)} 個任務")
@@ -924,7 +1882,7 @@ def get_stuck_tasks(account, min_progress=90):
     min_progress: 最小進度閾值，預設 90%
     返回: [{id, name, progress, file_id}, ...]
     """
-    tasks = get_offline_list(account)
+    tasks = get_offline_poller(account).snapshot(STATS_REFRESH_INTERVAL)
     stuck = []
     
     logging.debug(f"帳號{account}共有 {len(tasks)} 個離線任務，篩選進度 >= {min_progress}%")
@@ -1011,19 +1969,15 @@ def retry_stuck_tasks(account, min_progress=90, delete_cloud_files=True):
             success_count += 1
             logging.info(f"  ↳ ✅ 已重新加入佇列")
             
-            # Step 3: 啟動監控線程，等待 PikPak 完成後推送 Aria2
+            # Step 3: 加入調度器監控，等待 PikPak 完成後推送 Aria2
             # 使用 main() 的 resume_task 模式
             new_task_id = result.get('task', {}).get('id') if isinstance(result, dict) else None
             task_info = {
                 'id': new_task_id or task_id,  # 優先使用新的 task_id
                 'name': task_name
             }
-            thread_list.append(threading.Thread(
-                target=main,
-                args=[None, None, None, None, None, task_info, account]
-            ))
-            thread_list[-1].start()
-            logging.info(f"  ↳ 已啟動監控線程，等待完成後將推送 Aria2")
+            main(None, None, None, None, None, task_info, account)
+            logging.info(f"  ↳ 已加入監控，等待完成後將推送 Aria2")
             
             results.append({
                 'name': task_name,
@@ -1040,15 +1994,125 @@ def retry_stuck_tasks(account, min_progress=90, delete_cloud_files=True):
                 'status': 'fail',
                 'message': str(result)
             })
-        
-        sleep(2)  # 避免請求過於頻繁，增加延遲
     
     logging.info(f"✅ 帳號{account}重試完成: 成功 {success_count}, 失敗 {fail_count}")
     return success_count, fail_count, results
 
 
+# 任務狀態持久化
+class JobStore:
+    """
+    用 SQLite 保存每個任務所在的階段、帳號、離線任務 id、檔案 id 和 aria2 gid，以及批量任務的匯總，
+    重啟後直接從這裡恢復，不需要重新掃描所有帳號的離線列表，也不會重複推送已在 aria2 中的檔案。
+    同時保存每個帳號的登入憑證，重啟後憑證仍有效就不用重新登入；
+    以及按 info-hash 記錄的已完成下載歷史，再次提交同一磁力時可以跳過。
+    重複提交附加到任務上的通知對象單獨存一張表，不用在提交的線程裡保存別的線程正在修改的任務。
+    """
+
+    def __init__(self, path):
+        self.fresh = not os.path.exists(path)  # 第一次建立資料庫（如從舊版本升級）
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, stage TEXT, account TEXT, '
+                              'task_id TEXT, data TEXT, updated_at REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, data TEXT, updated_at REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sessions (account TEXT PRIMARY KEY, data TEXT, updated_at REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS history (info_hash TEXT PRIMARY KEY, name TEXT, '
+                              'files TEXT, completed_at REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS subscribers (job_id TEXT, chat_id INTEGER, batch_id TEXT)')
+
+    def save_job(self, job):
+        data = json.dumps(job.to_dict(), ensure_ascii=False)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+                              (job.id, job.stage, job.account, job.task_id, data, time()))
+
+    def delete_job(self, job_id):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self.conn.execute('DELETE FROM subscribers WHERE job_id = ?', (job_id,))
+
+    def add_subscriber(self, job_id, chat_id, batch_id):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT INTO subscribers VALUES (?, ?, ?)', (job_id, chat_id, batch_id))
+
+    def load_jobs(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT data FROM jobs ORDER BY updated_at').fetchall()
+            subscribers = self.conn.execute('SELECT job_id, chat_id, batch_id FROM subscribers ORDER BY rowid').fetchall()
+        jobs = [json.loads(row[0]) for row in rows]
+        for data in jobs:
+            # 舊版本把通知對象存在任務資料裡，一併保留
+            data['subscribers'] = data.get('subscribers', []) + \
+                [[chat_id, batch_id] for job_id, chat_id, batch_id in subscribers if job_id == data['id']]
+        return jobs
+
+    def save_batch(self, batch_id, batch):
+        data = json.dumps(batch, ensure_ascii=False)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO batches VALUES (?, ?, ?)', (batch_id, data, time()))
+
+    def delete_batch(self, batch_id):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM batches WHERE id = ?', (batch_id,))
+
+    def load_batches(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT id, data FROM batches').fetchall()
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def save_session(self, account, session):
+        data = json.dumps(session)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)', (account, data, time()))
+
+    def delete_session(self, account):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM sessions WHERE account = ?', (account,))
+
+    def load_session(self, account):
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM sessions WHERE account = ?', (account,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_history(self, info_hash, name, files):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?)',
+                              (info_hash, name, json.dumps(files, ensure_ascii=False), time()))
+
+    def find_history(self, info_hash):
+        with self.lock:
+            row = self.conn.execute('SELECT name, files, completed_at FROM history WHERE info_hash = ?',
+                                    (info_hash,)).fetchone()
+        if not row:
+            return None
+        return {'name': row[0], 'files': json.loads(row[1]), 'completed_at': row[2]}
+
+
+job_store = JobStore(JOB_DB_PATH)
+# 恢復上次未完成的批量任務匯總
+batch_results.update(job_store.load_batches())
+
+
+# 初始化批量任務追蹤，chat_id 為接收匯總通知的對象，None 表示不發送
+# compact 用於大量匯入：只計數，明細只保留少量失敗記錄，total 未知時先傳 None，讀完後用 set_batch_total 設置
+def create_batch(batch_id, total, chat_id=None, compact=False):
+    with batch_lock:
+        batch_results[batch_id] = {
+            'total': total,
+            'processed': 0,
+            'results': [],
+            'chat_id': chat_id
+        }
+        if compact:
+            batch_results[batch_id].update({'compact': True, 'success': 0, 'fail': 0})
+        job_store.save_batch(batch_id, batch_results[batch_id])
+
+
 # 記錄批量任務結果並發送匯總
-def record_batch_result(batch_id, status, name, message, update, context):
+def record_batch_result(batch_id, status, name, message, info_hash=None):
     global batch_results
     if not batch_id:
         return
@@ -1057,58 +2121,537 @@ def record_batch_result(batch_id, status, name, message, update, context):
         if batch_id not in batch_results:
             return
 
-        batch_results[batch_id]['processed'] += 1
-        batch_results[batch_id]['results'].append({
-            'name': name,
-            'status': status,
-            'message': message
-        })
+        batch = batch_results[batch_id]
+        batch['processed'] += 1
+        if batch.get('compact'):
+            batch[status] = batch.get(status, 0) + 1
+        if not batch.get('compact') or (status != 'success' and len(batch['results']) < BATCH_SUMMARY_ITEMS):
+            batch['results'].append({
+                'name': name,
+                'status': status,
+                'message': message,
+                'info_hash': info_hash
+            })
         
         # 檢查是否所有任務都已處理完畢
-        if batch_results[batch_id]['processed'] == batch_results[batch_id]['total']:
-            # 發送匯總通知
-            results = batch_results[batch_id]['results']
-            success_count = sum(1 for r in results if r['status'] == 'success')
-            fail_count = sum(1 for r in results if r['status'] == 'fail')
-            
-            summary = f"📋 <b>下載任務匯總 (Batch Summary)</b>\n"
-            summary += f"-------------------------\n"
-            summary += f"✅ 成功: {success_count}\n"
-            summary += f"❌ 失敗: {fail_count}\n"
-            summary += f"-------------------------\n"
-            
-            for i, res in enumerate(results, 1):
-                icon = "✅" if res['status'] == 'success' else "❌"
-                summary += f"{i}. {icon} {res['name']}\n"
-                if res['message']:
-                     summary += f"   └ {res['message']}\n"
-
-            # Check if context and update are valid (might be None for Web requests)
-            if context and update and update.effective_chat:
+        if batch['processed'] == batch['total']:
+            _finish_batch(batch_id)
+        else:
+            job_store.save_batch(batch_id, batch)
+
+
+# 批量任務的總數在建立時未知（大量匯入），讀完後再設置
+def set_batch_total(batch_id, total):
+    with batch_lock:
+        if batch_id not in batch_results:
+            return
+        batch_results[batch_id]['total'] = total
+        if batch_results[batch_id]['processed'] >= total:
+            _finish_batch(batch_id)
+        else:
+            job_store.save_batch(batch_id, batch_results[batch_id])
+
+
+# 發送匯總通知並清理記錄，需持有 batch_lock
+def _finish_batch(batch_id):
+    batch = batch_results[batch_id]
+    results = batch['results']
+    if batch.get('compact'):
+        success_count, fail_count = batch['success'], batch['fail']
+    else:
+        success_count = sum(1 for r in results if r['status'] == 'success')
+        fail_count = sum(1 for r in results if r['status'] == 'fail')
+
+    summary = f"📋 <b>下載任務匯總 (Batch Summary)</b>\n"
+    summary += f"-------------------------\n"
+    summary += f"✅ 成功: {success_count}\n"
+    summary += f"❌ 失敗: {fail_count}\n"
+    summary += f"-------------------------\n"
+
+    # 只列出前 BATCH_SUMMARY_ITEMS 項，避免超過 Telegram 訊息長度
+    for i, res in enumerate(results[:BATCH_SUMMARY_ITEMS], 1):
+        icon = "✅" if res['status'] == 'success' else "❌"
+        summary += f"{i}. {icon} {res['name']}\n"
+        if res['message']:
+             summary += f"   └ {res['message']}\n"
+    omitted = (fail_count if batch.get('compact') else len(results)) - min(len(results), BATCH_SUMMARY_ITEMS)
+    if omitted > 0:
+        summary += f"……其餘 {omitted} 項未列出\n"
+
+    # chat_id might be None for Web requests
+    if batch.get('chat_id'):
+        try:
+            updater.bot.send_message(chat_id=batch['chat_id'], text=summary, parse_mode='HTML')
+        except Exception as e:
+            logging.error(f"發送匯總通知失敗: {e}")
+
+    # 清理記錄，最近完成的批次留在記憶體中供查詢
+    finished_batches[batch_id] = batch_results.pop(batch_id)
+    while len(finished_batches) > FINISHED_BATCHES_SIZE:
+        finished_batches.pop(next(iter(finished_batches)))
+    job_store.delete_batch(batch_id)
+
+
+# 模擬 TG update 對象，只為了兼容 main 函數的參數，main 用 update.effective_chat.id 作為通知對象
+class MockChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class MockUpdate:
+    def __init__(self, chat_id):
+        self.effective_chat = MockChat(chat_id)
+
+
+class BatchReleaser:
+    """
+    Web 批量提交的磁力先登記在批次記錄的 items 中就返回，由一個背景線程每隔 interval 秒放出一個到調度器，
+    不佔用 HTTP 請求，也不會一次向 PikPak 提交大量離線任務。
+    items 隨批次記錄持久化，重啟後未放出的磁力繼續放出。放出前先把 item 標記為 releasing 並保存，
+    放出途中程序中斷的 item 重啟後視為已放出（任務已建立的話會從任務資料庫恢復），不會重複放出、重複計數。
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.pending = deque()  # 等待放出的批次id
+        self.thread = None
+
+    def add(self, batch_id):
+        with self.cond:
+            self.pending.append(batch_id)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='batch-releaser', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def restore(self):
+        """重新放出上次未放完的批次"""
+        with batch_lock:
+            for batch_id, batch in batch_results.items():
+                interrupted = [item for item in batch.get('items', []) if item['status'] == 'releasing']
+                for item in interrupted:
+                    item['status'] = 'released'
+                if interrupted:
+                    job_store.save_batch(batch_id, batch)
+            batch_ids = [batch_id for batch_id, batch in batch_results.items()
+                         if any(item['status'] == 'queued' for item in batch.get('items', []))]
+        for batch_id in batch_ids:
+            self.add(batch_id)
+        return len(batch_ids)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                batch_id = self.pending.popleft()
+            while True:
+                with batch_lock:
+                    batch = batch_results.get(batch_id)
+                    item = next((item for item in batch.get('items', []) if item['status'] == 'queued'), None) \
+                        if batch else None
+                if item is None:
+                    break
+                with batch_lock:
+                    item['status'] = 'releasing'
+                    job_store.save_batch(batch_id, batch)
                 try:
-                    context.bot.send_message(chat_id=update.effective_chat.id, text=summary, parse_mode='HTML')
+                    job = main(MockUpdate(batch['notify_chat_id']), None, item['magnet'], batch.get('offline_path'),
+                               batch_id, force=batch.get('force', False))
                 except Exception as e:
-                    logging.error(f"發送匯總通知失敗: {e}")
-            
-            # 清理記錄
-            del batch_results[batch_id]
+                    logging.error(f"放出磁力{item['magnet']}失敗: {e}")
+                    with batch_lock:
+                        item['status'] = 'error'
+                    record_batch_result(batch_id, 'fail', item['magnet'], f'加入下載隊列失敗: {e}', item['info_hash'])
+                    continue
+                with batch_lock:
+                    item['status'] = 'released'
+                    item['job_id'] = job.id
+                    if batch_id in batch_results:
+                        job_store.save_batch(batch_id, batch)
+                sleep(self.interval)
 
 
-# /pikpak命令主程序
-def main(update: Update, context: CallbackContext, magnet, offline_path=None, batch_id=None, resume_task=None, target_account=None):
-    # 磁链的简化表示，不保证兼容所有磁链，仅为显示信息时比较简介，不影响任何实际功能
-    mag_url_simple = magnet
-    if resume_task:
-        mag_url_simple = f"恢復任務: {resume_task.get('name', 'Unknown')}"
-    elif str(magnet).startswith("magnet:?"):
-        mag_url_part = re.search(r'^(magnet:\?).*(xt=.+?)(&|$)', magnet)
-        mag_url_simple = ''.join(mag_url_part.groups()[:-1])
+batch_releaser = BatchReleaser(WEB_RELEASE_INTERVAL)
+
+
+# 單個批次中每個磁力的進度，queued 等待放出，releasing 正在放出，之後為所在任務的階段，完成後為 success/fail
+def batch_progress(batch_id):
+    with batch_lock:
+        batch = batch_results.get(batch_id) or finished_batches.get(batch_id)
+        if batch is None:
+            return None
+        items = [dict(item) for item in batch.get('items', [])]
+        results = {result.get('info_hash'): result for result in batch['results'] if result.get('info_hash')}
+        summary = {'total': batch['total'], 'processed': batch['processed'],
+                   'finished': batch_id not in batch_results}
+        if batch.get('compact'):
+            summary.update(success=batch['success'], fail=batch['fail'], failures=list(batch['results']))
+        if batch.get('import'):
+            summary['imported'] = batch['import']['offset']
+    with scheduler.cond:
+        live_jobs = dict(scheduler.jobs)
+    progress = []
+    for item in items:
+        entry = {'magnet': item['mag_url_simple'], 'status': item['status'], 'job_id': item.get('job_id'),
+                 'name': None, 'account': None, 'message': ''}
+        result = results.get(item['info_hash'])
+        job = live_jobs.get(item.get('job_id'))
+        if result:
+            entry.update(status=result['status'], name=result['name'], message=result['message'])
+        elif job is not None and item['status'] == 'released':
+            entry.update(status=job.stage, name=job.down_name or job.name, account=job.account, job_id=job.id)
+        progress.append(entry)
+    summary['items'] = progress
+    return summary
+
+
+# 文字中的磁力連結：info-hash 之後只接受以 & 開頭的參數，遇到空白、引號或下一個磁力即結束
+MAGNET_PATTERN = re.compile(r'magnet:\?xt=urn:btih:(?:[0-9a-fA-F]{40}|[a-zA-Z2-7]{32})'
+                            r'(?:&(?:(?!magnet:\?)[^\s&"\'<>])*)*')
+# 同一行中磁力之間的分隔符號，從匹配結果的結尾去掉
+MAGNET_SEPARATORS = ',;|'
+
+
+def find_magnets(text):
+    return [magnet.rstrip(MAGNET_SEPARATORS) for magnet in MAGNET_PATTERN.findall(text)]
+
+# 大量匯入時每次讀取的文字大小
+IMPORT_CHUNK_SIZE = 64 * 1024
+
+
+# 解析 .torrent 檔案內容，轉換為磁力連結。info-hash 為 info 字典原始 bencode 內容的 SHA1
+def torrent_to_magnet(data):
+    info_span = []
+
+    def decode(pos, depth):
+        kind = data[pos:pos + 1]
+        if kind == b'i':
+            end = data.index(b'e', pos)
+            return int(data[pos + 1:end]), end + 1
+        if kind == b'l':
+            values, pos = [], pos + 1
+            while data[pos:pos + 1] != b'e':
+                value, pos = decode(pos, depth + 1)
+                values.append(value)
+            return values, pos + 1
+        if kind == b'd':
+            values, pos = {}, pos + 1
+            while data[pos:pos + 1] != b'e':
+                key, pos = decode(pos, depth + 1)
+                start = pos
+                values[key], pos = decode(pos, depth + 1)
+                if depth == 0 and key == b'info':
+                    info_span[:] = [start, pos]
+            return values, pos + 1
+        if kind.isdigit():
+            colon = data.index(b':', pos)
+            end = colon + 1 + int(data[pos:colon])
+            if end > len(data):
+                raise ValueError('字串長度超出檔案')
+            return data[colon + 1:end], end
+        raise ValueError(f'無法解析的 bencode 內容（位置 {pos}）')
+
+    try:
+        torrent, _ = decode(0, 0)
+    except (IndexError, ValueError, RecursionError) as e:
+        raise ValueError(f'不是有效的種子檔案: {e}')
+    if not isinstance(torrent, dict) or not info_span:
+        raise ValueError('不是有效的種子檔案: 缺少 info')
+    info = torrent[b'info']
+    if b'pieces' not in info:
+        raise ValueError('不支援純 BitTorrent v2 種子')
+
+    magnet = f'magnet:?xt=urn:btih:{hashlib.sha1(data[info_span[0]:info_span[1]]).hexdigest()}'
+    if isinstance(info.get(b'name'), bytes):
+        magnet += f"&dn={quote(info[b'name'].decode('utf-8', errors='replace'))}"
+    trackers = [torrent[b'announce']] if isinstance(torrent.get(b'announce'), bytes) else []
+    for tier in torrent.get(b'announce-list') or []:
+        trackers += [tracker for tracker in tier if isinstance(tracker, bytes) and tracker not in trackers]
+    for tracker in trackers[:10]:
+        magnet += f"&tr={quote(tracker.decode('utf-8', errors='replace'), safe='')}"
+    return magnet
+
+
+# 逐條讀出匯入檔案中的項目，[(磁力連結, 錯誤訊息)]，文字檔分塊讀取，不會整個載入記憶體；
+# 每塊只解析到最後一個換行，之後不完整的一行留到下一塊一起解析
+def iter_import_entries(path, filename):
+    if filename.lower().endswith('.torrent'):
+        try:
+            with open(path, 'rb') as f:
+                yield torrent_to_magnet(f.read()), None
+        except (OSError, ValueError) as e:
+            yield None, str(e)
+        return
+
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        tail = ''
+        while True:
+            chunk = f.read(IMPORT_CHUNK_SIZE)
+            text = tail + chunk
+            if not chunk:
+                for magnet in find_magnets(text):
+                    yield magnet, None
+                return
+            cut = text.rfind('\n') + 1
+            for magnet in find_magnets(text[:cut]):
+                yield magnet, None
+            tail = text[cut:]
+
+
+class BulkImporter:
+    """
+    大量匯入磁力清單（文字檔）和種子檔。上傳的檔案先存到 IMPORT_DIR，由一個背景線程逐條解析、逐個交給調度器；
+    調度器中未結束的任務達到 IMPORT_MAX_ACTIVE 時暫停解析，等有任務結束再繼續，
+    所以清單再大，記憶體中也只有正在處理的任務。
+    匯入的任務不單獨發送 Telegram 通知，全部結束後只發一條匯總。
+    已讀取的條數隨批次記錄持久化，重啟後從中斷處繼續。
+    """
+
+    def __init__(self, max_active):
+        self.max_active = max_active
+        self.cond = threading.Condition()
+        self.pending = deque()  # 等待匯入的批次id
+        self.thread = None
+
+    def create(self, files, chat_id=None, notify_chat_id=None, offline_path=None, force=False):
+        """files: [(本地路徑, 原檔名), ...]，返回批次id"""
+        batch_id = str(uuid.uuid4())[:8]
+        create_batch(batch_id, None, chat_id=chat_id, compact=True)
+        with batch_lock:
+            batch_results[batch_id].update({
+                'notify_chat_id': notify_chat_id or chat_id or (ADMIN_IDS[0] if ADMIN_IDS else None),
+                'offline_path': offline_path,
+                'force': force,
+                'import': {'files': [list(each) for each in files], 'offset': 0, 'done': False}
+            })
+            job_store.save_batch(batch_id, batch_results[batch_id])
+        with self.cond:
+            self.pending.append(batch_id)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='bulk-importer', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        logging.info(f"建立匯入批次 {batch_id}，共 {len(files)} 個檔案")
+        return batch_id
+
+    def restore(self):
+        """繼續上次未讀完的匯入批次"""
+        with batch_lock:
+            batch_ids = [batch_id for batch_id, batch in batch_results.items()
+                         if batch.get('import') and not batch['import']['done']]
+        with self.cond:
+            self.pending.extend(batch_ids)
+            if batch_ids and self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='bulk-importer', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return len(batch_ids)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                batch_id = self.pending.popleft()
+            try:
+                self._import(batch_id)
+            except Exception as e:
+                logging.error(f"匯入批次 {batch_id} 失敗: {e}")
+
+    def _wait_capacity(self):
+        # 背壓：調度器中未結束的任務太多時等待
+        with scheduler.cond:
+            scheduler.cond.wait_for(lambda: len(scheduler.jobs) < self.max_active)
+
+    def _import(self, batch_id):
+        with batch_lock:
+            batch = batch_results.get(batch_id)
+            if not batch:
+                return
+            state = batch['import']
+            skip = state['offset']  # 重啟前已放出的條數
+        update = MockUpdate(batch['notify_chat_id'])
+        count = 0
+        file_index = 0
+        while True:
+            with batch_lock:
+                if file_index >= len(state['files']):
+                    state['done'] = True
+                    break
+                path, filename = state['files'][file_index]
+            file_index += 1
+            if not os.path.exists(path):
+                logging.warning(f"匯入檔案 {filename} 已不存在，略過")
+                continue
+            for magnet, error in iter_import_entries(path, filename):
+                count += 1
+                if count <= skip:
+                    continue
+                if error:
+                    record_batch_result(batch_id, 'fail', filename, error)
+                else:
+                    self._wait_capacity()
+                    try:
+                        main(update, None, magnet, batch.get('offline_path'), batch_id,
+                             force=batch.get('force', False), quiet=True)
+                    except Exception as e:
+                        logging.error(f"匯入磁力{magnet}失敗: {e}")
+                        record_batch_result(batch_id, 'fail', magnet, f'加入下載隊列失敗: {e}')
+                with batch_lock:
+                    state['offset'] = count
+                    if batch_id in batch_results:
+                        job_store.save_batch(batch_id, batch)
+
+        logging.info(f"匯入批次 {batch_id} 讀取完成，共 {count} 條")
+        for path, _ in state['files']:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        set_batch_total(batch_id, count)
+
+
+bulk_importer = BulkImporter(IMPORT_MAX_ACTIVE)
+
+
+# 推送一個下載鏈接到aria2，返回gid，多次失敗返回None
+def aria2_add_uri(url, options, name):
+    jsonreq = json.dumps({'jsonrpc': '2.0', 'id': 'qwer', 'method': 'aria2.addUri',
+                          'params': [f"token:{ARIA2_SECRET}", [url], options]})
+    # 推送下载是网络请求密集地之一，每个链接将尝试5次
+    for tries in range(5):
+        try:
+            response = aria2_session.post(ARIA2_RPC_URL, data=jsonreq, timeout=5).json()
+            return response['result']
+        except requests.exceptions.ReadTimeout:
+            logging.warning(f'{name}第{tries + 1}(/5)次推送aria2下載超時，將重試！')
+            continue
+        except json.JSONDecodeError:
+            logging.warning(f'{name}第{tries + 1}(/5)次推送aria2下載出錯，可能是frp故障，將重試！')
+            sleep(5)  # frp问题就休息一会
+            continue
+        except Exception as e:
+            logging.warning(f'{name}第{tries + 1}(/5)次推送aria2下載發生未知錯誤: {e}，將重試！')
+            sleep(2)
+            continue
+    return None
+
+
+# 查詢 urls 中已經在aria2佇列（下載中、等待中、最近結束的）的連結，返回 {url: gid}，查詢失敗返回 None
+def aria2_find_uris(urls):
+    keys = ["gid", "files"]
+    results = aria2_multicall([('aria2.tellActive', [keys]), ('aria2.tellWaiting', [0, 10000, keys]),
+                               ('aria2.tellStopped', [-1, 1000, keys])], timeout=10)
+    if not results or not all(isinstance(result, list) for result in results):
+        return None
+    found = {}
+    for task in (task for result in results for task in result):
+        for each_file in task.get('files', []):
+            for uri in each_file.get('uris', []):
+                if uri.get('uri') in urls:
+                    found.setdefault(uri['uri'], task['gid'])
+    return found
+
+
+# 批量推送多個檔案，items: [(url, options, name), ...]，返回與 items 一一對應的 gid，推送失敗的為 None
+def aria2_add_uri_batch(items):
+    results = aria2_multicall([('aria2.addUri', [[url], options]) for url, options, _ in items], timeout=10)
+    queued = {}
+    if not results:
+        # 整個批量請求失敗（如frp故障或讀取超時），aria2可能其實已經收到，先查出已在佇列中的連結，只逐個推送其餘的
+        logging.warning(f'批量推送{len(items)}個檔案到aria2失敗，檢查已加入的檔案後改為逐個推送')
+        for tries in range(3):
+            queued = aria2_find_uris({url for url, _, _ in items})
+            if queued is not None:
+                break
+            sleep(2)
+        else:
+            # 無法確認哪些已加入，不重複推送，按推送失敗處理
+            logging.error(f'無法確認批量推送的{len(items)}個檔案是否已加入aria2，不再重新推送')
+            return [None] * len(items)
+    gids = []
+    for index, (url, options, name) in enumerate(items):
+        result = results[index] if results else queued.get(url)
+        if isinstance(result, str):
+            gids.append(result)
+            continue
+        # 只重試出錯的檔案
+        if result is not None:
+            logging.warning(f'{name}批量推送aria2下載出錯：{result.get("message", result)}，將單獨重試！')
+        gids.append(aria2_add_uri(url, options, name))
+    return gids
+
+
+# 磁链的简化表示，仅提取磁链中xt参数部分，不保证兼容所有磁链，仅为显示信息时比较简洁；匹配不上則原样返回
+def magnet_simple(magnet):
+    mag_url_part = re.search(r'^(magnet:\?).*(xt=.+?)(&|$)', str(magnet))
+    return ''.join(mag_url_part.groups()[:-1]) if mag_url_part else magnet
+
+
+# 下載任務，一個磁力（或一個待恢復的離線任務）對應一個
+class Job:
+    # 需要持久化的欄位，重啟後據此恢復任務
+    PERSIST_FIELDS = ('id', 'stage', 'chat_id', 'magnet', 'offline_path', 'batch_id', 'account', 'task_id', 'name',
+                      'file_id', 'offline_message', 'offline_start', 'down_name', 'gids', 'repush',
+                      'complete_file_id', 'failed_gid', 'error', 'error_name', 'error_info', 'mag_url_simple',
+                      'info_hash', 'completed_files', 'quiet')
+
+    def __init__(self, chat_id, magnet, offline_path=None, batch_id=None, resume_task=None, target_account=None):
+        self.id = str(uuid.uuid4())[:8]
+        self.chat_id = chat_id  # 接收通知的對象，None 時發給第一個管理員
+        self.magnet = magnet
+        self.offline_path = offline_path
+        self.batch_id = batch_id
+        self.stage = None
+        self.account = target_account  # 離線任務所在帳號
+        self.task_id = None  # 離線任務id
+        self.name = None  # 離線任務名稱
+        self.file_id = None  # 離線完成後的雲端檔案（夾）id
+        self.offline_message = ''
+        self.offline_start = 0
+        self.not_found_count = 0
+        self.down_name = None
+        self.gids = {}  # 记录每个下载任务的gid，{gid:[文件名,file_id,下载直链]}
+        self.repush = {}  # 需要重新推送的下載，{gid:([文件名,file_id,下载直链], 下載目錄, 錯誤訊息)}
+        self.complete_file_id = []  # 记录aria2下载成功的文件id
+        self.completed_files = []  # aria2下載成功的檔案本地路徑，記錄到下載歷史
+        self.failed_gid = {}  # 记录下载失败的gid
+        self.error = None  # 失敗原因，設置後直接進入 cleanup 階段匯報
+        self.error_name = None
+        self.error_info = None
+        self.timeout_retries = 0
+        self.info_hash = None if resume_task else magnet_info_hash(magnet)
+        self.subscribers = []  # 重複提交同一磁力的對象，完成後一併通知，[[chat_id, batch_id], ...]
+        self.quiet = False  # 大量匯入的任務不單獨發送通知，只記錄日誌，結果由批量匯總通知
+
+        # 磁链的简化表示，仅用于显示信息，不影响任何实际功能
+        self.mag_url_simple = magnet_simple(magnet)
+        if resume_task:
+            self.task_id = resume_task['id']
+            self.name = resume_task['name']
+            self.mag_url_simple = f"恢復任務: {resume_task.get('name', 'Unknown')}"
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.PERSIST_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data.get('chat_id'), data.get('magnet'))
+        for field in cls.PERSIST_FIELDS:
+            if field in data:
+                setattr(job, field, data[field])
+        job.subscribers = data.get('subscribers', [])  # 由 JobStore 從 subscribers 表中讀出
+        # json 會把 tuple 存成 list，這裡還原
+        job.repush = {gid: tuple(value) for gid, value in job.repush.items()}
+        return job
 
     # Helper function to safely send messages
-    def safe_send_message(text, parse_mode=None):
+    def send_message(self, text, parse_mode=None):
+        if self.quiet:
+            return
         try:
-            if context and update and update.effective_chat:
-                context.bot.send_message(chat_id=update.effective_chat.id, text=text, parse_mode=parse_mode)
+            if self.chat_id:
+                updater.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
             else:
                 # Fallback for startup recovery or internal calls
                 if ADMIN_IDS:
@@ -1116,387 +2659,786 @@ def main(update: Update, context: CallbackContext, magnet, offline_path=None, ba
         except Exception as e:
             logging.error(f"Failed to send Telegram message: {e}")
 
-    try:  # 捕捉所有的请求超时异常
-        for each_account in USER:
-            # 如果是恢復模式，跳過非目標帳號
-            if resume_task and each_account != target_account:
-                continue
+    def fail(self, reason, name=None, print_info=None):
+        """標記任務失敗，返回 cleanup 階段，由 cleanup 發送通知並記錄批量結果"""
+        self.error = reason
+        self.error_name = name or self.name or self.mag_url_simple
+        self.error_info = print_info
+        return 'cleanup'
+
+    def notify_subscribers(self, status, name, message, text=None):
+        """把結果轉告重複提交同一磁力的對象，並記錄到它們各自的批量任務"""
+        for chat_id, batch_id in self.subscribers:
+            if text and chat_id and (chat_id != self.chat_id or self.quiet):
+                try:
+                    updater.bot.send_message(chat_id=chat_id, text=text)
+                except Exception as e:
+                    logging.error(f"Failed to send Telegram message: {e}")
+            record_batch_result(batch_id, status, name, message, self.info_hash)
+
+
+# 從磁力連結中取出 BitTorrent info-hash，統一為小寫16進制，base32 的也轉換過來；不是 btih 磁力返回None
+def magnet_info_hash(magnet):
+    match = re.search(r'xt=urn:btih:([0-9a-zA-Z]+)', str(magnet))
+    if not match:
+        return None
+    info_hash = match.group(1)
+    if len(info_hash) == 40 and re.fullmatch(r'[0-9a-fA-F]+', info_hash):
+        return info_hash.lower()
+    if len(info_hash) == 32:
+        try:
+            return base64.b32decode(info_hash.upper()).hex()
+        except ValueError:
+            return None
+    return None
 
-            # 离线下载并获取任务id和文件名
-            mag_id, mag_name = None, None
-            
-            if resume_task:
-                mag_id = resume_task['id']
-                mag_name = resume_task['name']
-                logging.info(f"正在恢復帳號 {each_account} 的任務: {mag_name}")
+
+# 帳號選擇器
+class AccountSelector:
+    """
+    記錄每個帳號的 vip 狀態、雲端硬碟剩餘空間、最近連續失敗次數和正在提交的任務數，
+    提交磁力時把帳號按成功可能性排序，不用每次都從第一個帳號開始試。
+    vip 和空間資訊過期後在後台更新，排序只用已知的值，提交磁力不會等待查詢或登入。
+    免費次數用盡或空間不足的帳號在 EXHAUSTED_COOLDOWN 秒內排到最後。
+    """
+
+    INFO_TTL = 600  # vip 和空間資訊的緩存時間（秒）
+    EXHAUSTED_COOLDOWN = 3600
+    # 表示離線次數用盡或空間不足的錯誤
+    EXHAUSTED_ERRORS = ('task_daily_create_limit', 'task_daily_create_limit_vip', 'task_run_nums_limit',
+                        'file_space_not_enough', 'storage_space_not_enough')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}  # {account: {...}}
+
+    def _state(self, account):
+        if account not in self.states:
+            self.states[account] = {'vip': None, 'free': None, 'checked_at': 0, 'failures': 0,
+                                    'exhausted_at': 0, 'inflight': 0, 'last_error': ''}
+        return self.states[account]
+
+    def _refresh(self, account):
+        try:
+            vip = get_my_vip(account)
+            free = get_free_space(account)
+        except Exception as e:
+            logging.warning(f"帳號{account}更新vip和空間資訊失敗：{e}")
+            return
+        with self.lock:
+            state = self._state(account)
+            state['vip'] = vip
+            if free is not None:
+                state['free'] = free
+
+    def candidates(self):
+        """返回按優先順序排好的帳號列表，過期的 vip 和空間資訊交給後台更新，這次先用已知的值"""
+        now = time()
+        with self.lock:
+            stale = [account for account in USER if now - self._state(account)['checked_at'] > self.INFO_TTL]
+            for account in stale:  # 先標記，避免多個線程同時去查
+                self.states[account]['checked_at'] = now
+        for account in stale:
+            account_query_pool.submit(self._refresh, account)
+
+        # 已提交、還在離線下載中的任務也佔用帳號的同時任務數
+        offline = {account: scheduler.offline_count(account) for account in USER}
+        with self.lock:
+            def score(account):
+                state = self._state(account)
+                return (now - state['exhausted_at'] < self.EXHAUSTED_COOLDOWN,
+                        state['vip'] not in (0, None),  # vip 有效的優先
+                        min(state['failures'], 5),
+                        state['inflight'] + offline[account],
+                        -(state['free'] or 0),
+                        USER.index(account))
+            return sorted(USER, key=score)
+
+    def begin(self, account):
+        with self.lock:
+            self._state(account)['inflight'] += 1
+
+    def end(self, account, success):
+        with self.lock:
+            state = self._state(account)
+            state['inflight'] -= 1
+            if success:
+                state['failures'] = 0
+                state['exhausted_at'] = 0
             else:
-                for tries in range(3):
-                    try:
-                        mag_id, mag_name = magnet_upload(magnet, each_account, offline_path=offline_path)
-                        if mag_id: # 成功獲取到ID
-                            break
-                    except requests.exceptions.ReadTimeout:
-                        logging.warning(f"帳號{each_account}添加磁力鏈接超時，重試第{tries + 1}/3次...")
-                        sleep(2)
-                    except Exception as e:
-                        logging.warning(f"帳號{each_account}添加磁力鏈接發生錯誤: {e}，重試第{tries + 1}/3次...")
-                        sleep(2)
-
-            if not mag_id:  # 如果添加离线失败，那就试试下一个账号
-                if each_account == USER[-1]:  # 最后一个账号仍然无法离线下载
-                    print_info = f'{mag_url_simple}所有帳號均離線下載失敗！可能是所有帳號免費離線次數用盡，或者檔案大小超過雲端硬碟剩餘容量！'
-                    safe_send_message(print_info)
-                    logging.warning(print_info)
-                    record_batch_result(batch_id, 'fail', mag_url_simple, "所有帳號離線失敗", update, context)
-                    return
-                continue
+                state['failures'] += 1
 
-            # 查询是否离线完成
-            done = False  # 是否完成标志
-            logging.info('5s後將檢查離線下載進度...')
-            sleep(5)  # 等待5秒，一般是秒离线，可以保证大多数情况下直接就完成了离线下载
-            offline_start = time()  # 离线开始时间
-            not_found_count = 0
-            while (not done) and (time() - offline_start < 60 * 60):  # 1小时超时
-                try:
-                    temp = get_offline_list(each_account)  # 获取离线列表
-                    find = False  # 离线列表中找到了任务id的标志
-                    for each_down in temp:
-                        if each_down['id'] == mag_id:  # 匹配上任务id就是找到了
-                            find = True
-                            not_found_count = 0
-                            
-                            # 檢查是否已刪除 (點 2)
-                            msg = each_down.get('message', '')
-                            if "file deleted" in msg.lower() or "file_deleted" in msg.lower():
-                                logging.info(f"帳號{each_account}離線任務 {mag_name} 檔案已在雲端刪除，跳過處理")
-                                find = False # 視為未找到，這將導致 main 返回而不進行後續下載
-                                break
-
-                            if each_down['progress'] == 100 and msg == 'Saved':  # 查看完成了吗
-                                done = True
-                                file_id = each_down['file_id']
-                                # 输出信息
-                                print_info = f'帳號{each_account}離線下載磁力已完成：\n{mag_url_simple}\n檔案名稱：{mag_name}'
-                                safe_send_message(print_info)
-                                logging.info(print_info)
-                            elif each_down['progress'] == 100:  # 可能存在错误但还是允许推送aria2下载了
-                                done = True
-                                file_id = each_down['file_id']
-                                # 输出信息
-                                print_info = f'帳號{each_account}離線下載磁力已完成:\n{mag_url_simple}\n但含有訊息：' \
-                                             f'{msg.strip()}！\n檔案名稱：{mag_name}'
-                                safe_send_message(print_info)
-                                logging.warning(print_info)
-                            else:
-                                # 嘗試獲取文件名以便顯示更友好的日誌
-                                current_file_name = each_down.get('file_name') or each_down.get('name') or mag_name or mag_url_simple
-                                logging.info(
-                                    f'帳號{each_account}離線下載 "{current_file_name}" 還未完成，進度{each_down["progress"]}%...'
-                                )
-                                sleep(10)
-                            # 只要找到了就可以退出查找循环
-                            break
-                    # 非正常退出查询离线完成方式
-                    if not find:  # 一轮下来没找到可能是删除或者添加失败等等异常
-                        not_found_count += 1
-                        if not_found_count >= 5:
-                            print_info = f'帳號{each_account}離線下載{mag_url_simple}的任務被取消（或多次查詢未找到）！'
-                            safe_send_message(print_info)
-                            logging.warning(print_info)
-                            break
-                        else:
-                            logging.warning(f"帳號{each_account}未找到任務{mag_id}，重試({not_found_count}/5)...")
-                            sleep(5)
-                            continue
-                except Exception as e:
-                    logging.warning(f"監控離線下載進度時發生錯誤 (將自動重試): {e}")
-                    sleep(5)
-                    continue
+    def report_error(self, account, error, description=''):
+        """magnet_upload 收到錯誤時調用"""
+        with self.lock:
+            state = self._state(account)
+            state['last_error'] = error
+            if error in self.EXHAUSTED_ERRORS:
+                state['exhausted_at'] = time()
+                logging.info(f"帳號{account}離線次數或空間不足（{error}），暫時降低該帳號的優先順序")
+
+    def is_exhausted(self, account):
+        with self.lock:
+            return time() - self._state(account)['exhausted_at'] < self.EXHAUSTED_COOLDOWN
+
+    def forget(self, account):
+        with self.lock:
+            self.states.pop(account, None)
+
+
+account_selector = AccountSelector()
+
+
+# 用指定帳號提交磁力，最多嘗試3次，返回离线任务id、文件名，失敗返回 None, None
+def submit_to_account(job, account):
+    mag_id, mag_name = None, None
+    account_selector.begin(account)
+    with job_log_context(job.id):
+        for tries in range(3):
+            try:
+                mag_id, mag_name = magnet_upload(job.magnet, account, offline_path=job.offline_path)
+                if mag_id:  # 成功獲取到ID
+                    break
+                if account_selector.is_exhausted(account):  # 次數或空間不足，重試也沒用，直接換帳號
+                    break
+            except requests.exceptions.ReadTimeout:
+                logging.warning(f"帳號{account}添加磁力鏈接超時，重試第{tries + 1}/3次...")
+                sleep(2)
+            except Exception as e:
+                logging.warning(f"帳號{account}添加磁力鏈接發生錯誤: {e}，重試第{tries + 1}/3次...")
+                sleep(2)
+    account_selector.end(account, bool(mag_id))
+    return mag_id, mag_name
+
+
+# 對沖提交用的線程池
+hedge_pool = ThreadPoolExecutor(max_workers=max(2, SCHEDULER_WORKERS * 2), thread_name_prefix='hedge-submit')
+
+
+# 對沖提交：首選帳號 HEDGE_DELAY 秒內沒有接受（或已失敗）就同時提交給下一個帳號，最多兩個帳號同時在提交，
+# 採用最先接受的那個，另一個之後也成功的話刪除它的離線任務。返回 (帳號, 任務id, 文件名) 或 None
+def submit_hedged(job, candidates):
+    remaining = list(candidates)
+    pending = {}
+    accepted = None
+    while remaining or pending:
+        if remaining and len(pending) < 2:
+            account = remaining.pop(0)
+            if pending:
+                logging.info(f"{job.mag_url_simple}等待帳號{list(pending.values())[0]}超過{HEDGE_DELAY}s，同時提交給帳號{account}")
+            pending[submit_with_log_context(hedge_pool, submit_to_account, job, account)] = account
+        done, _ = wait(pending, timeout=HEDGE_DELAY if remaining else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            account = pending.pop(future)
+            mag_id, mag_name = future.result()
+            if mag_id and accepted is None:
+                accepted = account, mag_id, mag_name
+            elif mag_id:  # 同一輪中另一個帳號也接受了，是重複任務
+                submit_with_log_context(hedge_pool, cancel_duplicate_task, job, accepted[0], account, mag_id)
+        if accepted:
+            break
 
-            # 查询账号是否完成离线
-            if (find and done) or (not find and not done):  # 前者找到离线任务并且完成了，后者是要么手动取消了要么卡在进度0
-                if not done:
-                     # 離線失敗/取消
-                     record_batch_result(batch_id, 'fail', mag_name if mag_name else mag_url_simple, "離線任務被取消或失敗", update, context)
-                     return
+    # 還沒返回的提交，之後成功了就是重複任務，刪掉
+    for future, account in pending.items():
+        future.add_done_callback(
+            lambda f, account=account: cancel_duplicate_task(job, accepted[0], account, f.result()[0]))
+    return accepted
+
+
+def cancel_duplicate_task(job, accepted_account, account, task_id):
+    if not task_id:
+        return
+    logging.info(f"{job.mag_url_simple}已由帳號{accepted_account}接受，刪除帳號{account}上重複的離線任務")
+    delete_offline_task([task_id], account, delete_files=True)
+
+
+# 階段一：提交離線下載
+def stage_submit(job):
+    candidates = account_selector.candidates()
+    if HEDGE_DELAY > 0 and len(candidates) > 1:
+        accepted = submit_hedged(job, candidates)
+    else:
+        accepted = None
+        for each_account in candidates:
+            mag_id, mag_name = submit_to_account(job, each_account)
+            if mag_id:
+                accepted = each_account, mag_id, mag_name
                 break
-            elif find and not done:
-                print_info = f'帳號{each_account}離線下載{mag_url_simple}的任務超時（1小時）！已取消該任務！'
-                safe_send_message(print_info)
-                logging.warning(print_info)
-                record_batch_result(batch_id, 'fail', mag_name if mag_name else mag_url_simple, "離線下載超時", update, context)
-                return
-            else:  # 其他情况都换个号再试
-                continue
 
-        # 如果找到了任务并且任务已完成，则开始从网盘下载到本地
-        if mag_id and find and done:  # 判断mag_id是否为空防止所有号次数用尽的情况
-            gid = {}  # 记录每个下载任务的gid，{gid:[文件名,file_id,下载直链]}
-            # 偶尔会出现aria2下载失败，报ssl i/o error错误，试试加上headers
-            download_headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:50.0) Gecko/20100101 Firefox/50.0'}
-
-            down_name, down_url = get_download_url(file_id, each_account)
-            # 获取到文件夹
-            if down_url == "":
-                logging.info(f"磁力{mag_url_simple}內容為資料夾:{down_name}，準備提取出每個檔案並下載")
-
-                for name, url, down_file_id, path in get_folder_all_file(file_id, f"{down_name}/", each_account):
-                    jsonreq = json.dumps({'jsonrpc': '2.0', 'id': 'qwer', 'method': 'aria2.addUri',
-                                          'params': [f"token:{ARIA2_SECRET}", [url],
-                                                     {"dir": ARIA2_DOWNLOAD_PATH + '/' + path, "out": f"{name}",
-                                                      "header": download_headers}]})
-
-                    push_flag = False  # 成功推送aria2下载标志
-                    # 文件夹的推送下载是网络请求密集地之一，每个链接将尝试5次
-                    for tries in range(5):
-                        try:
-                            response = requests.post(f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc', data=jsonreq,
-                                                     timeout=5).json()
-                            push_flag = True
-                            break
-                        except requests.exceptions.ReadTimeout:
-                            logging.warning(f'{name}第{tries + 1}(/5)次推送下載超時，將重試！')
-                            continue
-                        except json.JSONDecodeError:
-                            logging.warning(f'{name}第{tries + 1}(/5)次推送下載出錯，可能是frp故障，將重試！')
-                            sleep(5)  # frp问题就休息一会
-                            continue
-                    if not push_flag:  # 5次都推送下载失败，让用户手动下载该文件，并且要检查网络！
-                        print_info = f'{name}推送aria2下載失敗！該檔案直連如下，請手動下載：\n{url}'
-                        safe_send_message(print_info)
-                        logging.error(print_info)
-                        continue  # 这个文件让用户手动下载，程序处理下一个文件
-
-                    gid[response['result']] = [f'{name}', down_file_id, url]
-                    # context.bot.send_message(chat_id=update.effective_chat.id, text=f'{name}推送aria2下载')  # 注释掉防止发送消息过多
-                    logging.info(f'{path}{name}推送aria2下載')
-
-                # 文件夹所有文件都推送完后再发送信息，避免消息过多
-                safe_send_message(f'資料夾已推送aria2下載：\n{down_name}\n請耐心等待...')
-                logging.info(f'{down_name}資料夾下所有檔案已推送aria2下載，請耐心等待...')
-
-            # 否则是单个文件，只推送一次，不用太担心网络请求出错
+    if accepted:
+        job.account, job.task_id, job.name = accepted
+        return 'wait_offline'
+
+    # 最后一个账号仍然无法离线下载
+    print_info = f'{job.mag_url_simple}所有帳號均離線下載失敗！可能是所有帳號免費離線次數用盡，或者檔案大小超過雲端硬碟剩餘容量！'
+    logging.warning(print_info)
+    return job.fail("所有帳號離線失敗", name=job.mag_url_simple, print_info=print_info)
+
+
+# 階段二：等待離線完成，每輪離線列表刷新後由輪詢線程調用，只更新狀態不做網路請求
+def check_offline(job, tasks):
+    each_down = tasks.get(job.task_id)
+    if each_down is not None:
+        # 檢查是否已刪除 (點 2)
+        msg = each_down.get('message', '')
+        if "file deleted" in msg.lower() or "file_deleted" in msg.lower():
+            logging.info(f"帳號{job.account}離線任務 {job.name} 檔案已在雲端刪除，跳過處理")
+            each_down = None  # 視為未找到，不進行後續下載
+
+    if each_down is None:  # 没找到可能是删除或者添加失败等等异常
+        job.not_found_count += 1
+        if job.not_found_count >= 5:
+            print_info = f'帳號{job.account}離線下載{job.mag_url_simple}的任務被取消（或多次查詢未找到）！'
+            logging.warning(print_info)
+            return job.fail("離線任務被取消或失敗", print_info=print_info)
+        logging.warning(f"帳號{job.account}未找到任務{job.task_id}，重試({job.not_found_count}/5)...")
+        return None
+
+    job.not_found_count = 0
+    if each_down['progress'] == 100:  # 查看完成了吗
+        job.file_id = each_down['file_id']
+        job.offline_message = msg
+        return 'push'
+
+    if time() - job.offline_start >= 60 * 60:  # 1小时超时
+        print_info = f'帳號{job.account}離線下載{job.mag_url_simple}的任務超時（1小時）！已取消該任務！'
+        logging.warning(print_info)
+        return job.fail("離線下載超時", print_info=print_info)
+
+    # 嘗試獲取文件名以便顯示更友好的日誌
+    current_file_name = each_down.get('file_name') or each_down.get('name') or job.name or job.mag_url_simple
+    logging.info(f'帳號{job.account}離線下載 "{current_file_name}" 還未完成，進度{each_down["progress"]}%...')
+    return None
+
+
+# 階段三：推送aria2下載（首次推送，或重新推送下載出錯的檔案）
+def stage_push(job):
+    if job.repush:
+        return repush_files(job)
+
+    # 输出离线完成信息
+    if job.offline_message == 'Saved':
+        print_info = f'帳號{job.account}離線下載磁力已完成：\n{job.mag_url_simple}\n檔案名稱：{job.name}'
+        job.send_message(print_info)
+        logging.info(print_info)
+    else:  # 可能存在错误但还是允许推送aria2下载了
+        print_info = f'帳號{job.account}離線下載磁力已完成:\n{job.mag_url_simple}\n但含有訊息：' \
+                     f'{job.offline_message.strip()}！\n檔案名稱：{job.name}'
+        job.send_message(print_info)
+        logging.warning(print_info)
+
+    down_name, down_url = get_download_url(job.file_id, job.account)
+    job.down_name = down_name
+    # 获取到文件夹
+    if down_url == "":
+        logging.info(f"磁力{job.mag_url_simple}內容為資料夾:{down_name}，準備提取出每個檔案並下載")
+
+        # 重啟後恢復的任務跳過已經推送過的檔案
+        pushed_file_ids = {info[1] for info in job.gids.values()}
+        # 湊滿一批或第一個檔案已等了3秒就推送，連結獲取得慢時每秒檢查一次，也不會一直等
+        files = []
+        batch_started = 0
+        for each_file in get_folder_all_file(job.file_id, f"{down_name}/", job.account, pushed_file_ids, tick=1):
+            if each_file is not None:
+                if not files:
+                    batch_started = time()
+                files.append(each_file)
+            if files and (len(files) >= ARIA2_ADD_BATCH or time() - batch_started >= 3):
+                push_folder_files(job, files)
+                files = []
+        push_folder_files(job, files)
+
+        # 文件夹所有文件都推送完后再发送信息，避免消息过多
+        job.send_message(f'資料夾已推送aria2下載：\n{down_name}\n請耐心等待...')
+        logging.info(f'{down_name}資料夾下所有檔案已推送aria2下載，請耐心等待...')
+
+    # 否则是单个文件，只推送一次
+    elif not job.gids:
+        logging.info(f'{job.mag_url_simple}內容為單檔案，將直接推送aria2下載')
+        new_gid = aria2_add_uri(down_url, {"dir": ARIA2_DOWNLOAD_PATH, "out": down_name,
+                                           "header": ARIA2_DOWNLOAD_HEADERS}, down_name)
+        if not new_gid:
+            print_info = f'{down_name}推送aria2下載失敗（多次重試無效）！該檔案直連如下，請手動下載：\n{down_url}'
+            logging.error(print_info)
+            return job.fail("推送Aria2失敗", name=down_name, print_info=print_info)
+
+        job.gids[new_gid] = [down_name, job.file_id, down_url]
+        job_store.save_job(job)
+        job.send_message(f'檔案已推送aria2下載：\n{down_name}\n請耐心等待...')
+        logging.info(f'{down_name}已推送aria2下載，請耐心等待...')
+
+    return 'wait_aria2'
+
+
+# 把資料夾中的一批檔案用一個請求推送到aria2
+def push_folder_files(job, files):
+    if not files:
+        return
+    gids = aria2_add_uri_batch([(url, {"dir": ARIA2_DOWNLOAD_PATH + '/' + path, "out": f"{name}",
+                                       "header": ARIA2_DOWNLOAD_HEADERS}, name)
+                                for name, url, down_file_id, path in files])
+    for (name, url, down_file_id, path), new_gid in zip(files, gids):
+        if not new_gid:  # 5次都推送下载失败，让用户手动下载该文件，并且要检查网络！
+            print_info = f'{name}推送aria2下載失敗！該檔案直連如下，請手動下載：\n{url}'
+            job.send_message(print_info)
+            logging.error(print_info)
+            continue  # 这个文件让用户手动下载，程序处理下一个文件
+
+        job.gids[new_gid] = [f'{name}', down_file_id, url]
+        logging.debug(f'{path}{name}推送aria2下載')
+    job_store.save_job(job)  # 每推送一批就保存，重啟後不會重複推送
+    logging.info(f'{job.down_name}資料夾已推送{len(job.gids)}個檔案到aria2下載')
+
+
+# 重新推送下載出錯的檔案
+def repush_files(job):
+    for old_gid, (info, down_dir, error_message) in list(job.repush.items()):
+        job.repush.pop(old_gid)
+        # 这只可能是文件，不会是文件夹
+        retry_down_name, retry_the_url = get_download_url(info[1], job.account, fresh=True)
+        new_gid = aria2_add_uri(retry_the_url, {"dir": down_dir, "out": retry_down_name,
+                                                "header": ARIA2_DOWNLOAD_HEADERS}, retry_down_name)
+        if not new_gid:  # 多次重新推送失败，则认为此文件下载失败，让用户手动下载
+            print_info = f'{retry_down_name}下載異常後重新推送失敗！該檔案直連如下，請手動下載：\n{retry_the_url}'
+            job.send_message(print_info)
+            logging.error(print_info)
+            job.failed_gid[old_gid] = info
+            continue
+
+        # 重新记录gid
+        job.gids[new_gid] = [retry_down_name, info[1], retry_the_url]
+        job_store.save_job(job)
+        logging.warning(f'aria2下載{info[0]}出錯！錯誤訊息：{error_message}\t此檔案已重新推送aria2下載！')
+
+    return 'wait_aria2'
+
+
+# 階段四：等待aria2下載完成，由監控線程用批量查詢的結果調用
+def check_aria2(job, statuses):
+    for each_gid, info in list(job.gids.items()):
+        if each_gid not in statuses:  # 此輪查詢失敗，下一輪再查
+            continue
+        result = statuses[each_gid]
+        status = result.get('status')
+        if status is None:  # 查詢出錯，此时任务可能已被手动删除
+            job.send_message(f'aria2下載{info[0]}任務被刪除！')
+            logging.warning(f'aria2下載{info[0]}任務被刪除！')
+            job.failed_gid[each_gid] = job.gids.pop(each_gid)  # 认为该任务失败
+        elif status == 'complete':  # 完成了删除对应的gid并记录成功下载
+            job.gids.pop(each_gid)
+            job.complete_file_id.append(info[1])
+            job.completed_files.append(f"{result.get('dir', ARIA2_DOWNLOAD_PATH)}/{info[0]}")
+        elif status == 'error':  # 如果aria2下载产生error
+            error_message = result.get("errorMessage", '')  # 识别错误信息
+            # 如果是这两种错误信息，可尝试重新推送aria2下载来解决
+            if error_message in ['No URI available.', 'SSL/TLS handshake failure: SSL I/O error']:
+                job.repush[each_gid] = (job.gids.pop(each_gid), result.get("dir", ARIA2_DOWNLOAD_PATH), error_message)
+            # 其他错误信息暂未遇到，先跳过处理
             else:
-                logging.info(f'{mag_url_simple}內容為單檔案，將直接推送aria2下載')
+                print_info = f'aria2下載{info[0]}出錯！錯誤訊息：{error_message}\t該檔案直連如下，' \
+                             f'請手動下載並反饋bug：\n{info[2]}'
+                job.send_message(print_info)
+                logging.warning(print_info)
+                job.failed_gid[each_gid] = job.gids.pop(each_gid)  # 认为该任务失败
+
+    if job.repush:
+        return 'push'
+    if not job.gids:
+        return 'cleanup'
+    return None
+
+
+# 給還在aria2佇列中排隊、直鏈即將過期的檔案換上新的直鏈
+def expiring_queued_links(job, statuses):
+    """還在aria2佇列中排隊、直鏈即將過期的gid"""
+    return [each_gid for each_gid, info in job.gids.items()
+            if statuses.get(each_gid, {}).get('status') in ('waiting', 'paused')
+            and link_cache.expiring(info[1], info[2])]
+
+
+def refresh_queued_link(account, gid, info):
+    """重新獲取直鏈並替換aria2佇列中的舊直鏈，成功返回新直鏈，否則返回None"""
+    down_name, down_url = get_download_url(info[1], account, fresh=True)
+    if not down_url or down_url == info[2]:
+        return None
+    # 刪除舊直鏈並加入新直鏈
+    result = call_aria2('aria2.changeUri', [gid, 1, [info[2]], [down_url]], timeout=5)
+    if result and result[1] > 0:
+        logging.info(f'{info[0]}的下載直鏈即將過期，已更新aria2佇列中的直鏈')
+        return down_url
+    return None
+
+
+# 階段五：釋放雲端硬碟空間並匯報結果（失敗的任務只匯報）
+def stage_cleanup(job):
+    if job.error:
+        if job.error_info:
+            job.send_message(job.error_info)
+        record_batch_result(job.batch_id, 'fail', job.error_name, job.error, job.info_hash)
+        job.notify_subscribers('fail', job.error_name, job.error, job.error_info or f'{job.error_name}下載失敗：{job.error}')
+        return None
+
+    down_name, each_account = job.down_name, job.account
+    complete_file_id, failed_gid = job.complete_file_id, job.failed_gid
+    print_info = f'aria2下載已完成：\n{down_name}\n共{len(complete_file_id) + len(failed_gid)}個檔案，' \
+                 f'其中{len(complete_file_id)}個成功，{len(failed_gid)}個失敗'
+
+    # Log cleanup start
+    logging.info(f"Aria2下載完成，準備清理PikPak檔案... (成功: {len(complete_file_id)}, 失敗: {len(failed_gid)})")
+    sleep(2)  # 等待一小段時間確保狀態同步
+
+    # 输出下载失败的文件信息
+    if len(failed_gid):
+        print_info += '，下載失敗檔案為：\n'
+        for values in failed_gid.values():
+            print_info += values[0] + '\n'
+
+        # 存在失败文件则只释放成功文件的网盘空间
+        # 增加重試機制確保刪除成功
+        status_a = False
+        status_b = False
+        for _ in range(3):
+            if not status_a:
+                status_a = delete_files(complete_file_id, each_account)
+            if not status_b:
+                status_b = delete_trash(complete_file_id, each_account)
+            if status_a and status_b:
+                break
+            sleep(2)
 
-                jsonreq = json.dumps({'jsonrpc': '2.0', 'id': 'qwer', 'method': 'aria2.addUri',
-                                      'params': [f"token:{ARIA2_SECRET}", [down_url],
-                                                 {"dir": ARIA2_DOWNLOAD_PATH, "out": down_name,
-                                                  "header": download_headers}]})
-                
-                push_flag = False
-                for tries in range(5):
-                    try:
-                        response = requests.post(f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc', data=jsonreq,
-                                                 timeout=5).json()
-                        push_flag = True
-                        break
-                    except requests.exceptions.ReadTimeout:
-                        logging.warning(f'{down_name}第{tries + 1}(/5)次推送aria2下載超時，將重試！')
-                        continue
-                    except json.JSONDecodeError:
-                        logging.warning(f'{down_name}第{tries + 1}(/5)次推送aria2下載出錯，可能是frp故障，將重試！')
-                        sleep(5)
-                        continue
-                    except Exception as e:
-                        logging.warning(f'{down_name}第{tries + 1}(/5)次推送aria2下載發生未知錯誤: {e}，將重試！')
-                        sleep(2)
-                        continue
+        if status_a:
+            logging.info(f'帳號{each_account}已刪除{down_name}中下載成功的雲端硬碟檔案')
+        if status_b:
+            logging.info(f'帳號{each_account}已刪除{down_name}中下載成功的垃圾桶檔案')
 
-                if not push_flag:
-                    print_info = f'{down_name}推送aria2下載失敗（多次重試無效）！該檔案直連如下，請手動下載：\n{down_url}'
-                    safe_send_message(print_info)
-                    logging.error(print_info)
-                    # 這裡應該要標記失敗並返回，或者讓它進入失敗邏輯
-                    record_batch_result(batch_id, 'fail', down_name, "推送Aria2失敗", update, context)
-                    return 
-
-                gid[response['result']] = [down_name, file_id, down_url]
-                safe_send_message(f'檔案已推送aria2下載：\n{down_name}\n請耐心等待...')
-                logging.info(f'{down_name}已推送aria2下載，請耐心等待...')
-
-            logging.info(f'睡眠30s，之後將開始查詢{down_name}下載進度...')
-            # pikpak单文件限速6MB/s
-            sleep(30)
-            # 查询每个gid是否完成
-            download_done = False
-            complete_file_id = []  # 记录aria2下载成功的文件id
-            failed_gid = {}  # 记录下载失败的gid
-            while not download_done:
-                temp_gid = gid.copy()  # 下面的操作仅对temp_gid进行，别污染gid
-                for each_gid in gid.keys():
-                    # 这里是网络请求最密集的地方，一次查询失败跳过即可
-                    try:
-                        jsonreq = json.dumps({'jsonrpc': '2.0', 'id': 'qwer', 'method': 'aria2.tellStatus',
-                                              'params': [f"token:{ARIA2_SECRET}", each_gid,
-                                                         ["gid", "status", "errorMessage", "dir"]]})
-                        response = requests.post(f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc', data=jsonreq,
-                                                 timeout=5).json()
-                    except requests.exceptions.ReadTimeout:  # 超时就查询下一个gid，跳过一个无所谓的
-                        logging.warning(f'查詢GID{each_gid}時網路請求超時，將跳過此次查詢！')
-                        continue
-                    except json.JSONDecodeError:
-                        logging.warning(f'查詢GID{each_gid}時返回結果錯誤，可能是frp故障，將跳過此次查詢！')
-                        sleep(5)  # frp的问题就休息一会
-                        continue
+        if status_a and status_b:
+            print_info += f'帳號{each_account}中下載成功的雲端硬碟檔案已刪除\n'
+        elif each_account in AUTO_DELETE and AUTO_DELETE[each_account] == 'False':
+            print_info += f'帳號{each_account}未開啟自動刪除\n'
+        else:
+            print_info += f'帳號{each_account}中下載成功的雲端硬碟檔案刪除失敗，請手動刪除\n'
+
+        job.send_message(print_info)
+        logging.info(print_info)
+        job.notify_subscribers('fail', down_name, f"部分檔案下載失敗: {len(failed_gid)}個", print_info)
+
+        # /download命令仅打算临时解决问题，当/pikpak命令足够健壮后将弃用/download命令
+        print_info = f'對於下載失敗的檔案可使用指令：\n`/clean {each_account}`清空此帳號下所有檔案\n~~或者使用臨時指令：~~' \
+                     f'\n~~`/download {each_account}`重試下載此帳號下所有檔案~~'
+        job.send_message(print_info, parse_mode='Markdown')
+        logging.info(print_info)
+        # 記錄批量失敗
+        record_batch_result(job.batch_id, 'fail', down_name, f"部分檔案下載失敗: {len(failed_gid)}個", job.info_hash)
+    else:
+        # 没有失败文件，则直接删除该文件根目录
+        # 增加重試機制確保刪除成功
+        status_a = False
+        status_b = False
+        for _ in range(3):
+            if not status_a:
+                status_a = delete_files(job.file_id, each_account)
+            if not status_b:
+                status_b = delete_trash(job.file_id, each_account)
+            if status_a and status_b:
+                break
+            sleep(2)
 
-                    try:  # 检查任务状态
-                        status = response['result']['status']
-                        if status == 'complete':  # 完成了删除对应的gid并记录成功下载
-                            temp_gid.pop(each_gid)  # 不再查询此gid
-                            complete_file_id.append(gid[each_gid][1])  # 将它记为已完成gid
-                        elif status == 'error':  # 如果aria2下载产生error
-                            error_message = response["result"]["errorMessage"]  # 识别错误信息
-                            # 如果是这两种错误信息，可尝试重新推送aria2下载来解决
-                            if error_message in ['No URI available.', 'SSL/TLS handshake failure: SSL I/O error']:
-                                # 再次推送aria2下载
-                                retry_down_name, retry_the_url = get_download_url(gid[each_gid][1], each_account)
-                                # 这只可能是文件，不会是文件夹
-                                jsonreq = json.dumps({'jsonrpc': '2.0', 'id': 'qwer', 'method': 'aria2.addUri',
-                                                      'params': [f"token:{ARIA2_SECRET}", [retry_the_url],
-                                                                 {"dir": response["result"]["dir"],
-                                                                  "out": retry_down_name,
-                                                                  "header": download_headers}]})
-                                # 当失败文件较多时，这里也是网络请求密集地
-                                repush_flag = False
-                                for tries in range(5):
-                                    try:
-                                        response = requests.post(f'{SCHEMA}://{ARIA2_HOST}:{ARIA2_PORT}/jsonrpc',
-                                                                 data=jsonreq, timeout=5).json()
-                                        repush_flag = True
-                                        break
-                                    except requests.exceptions.ReadTimeout:
-                                        logging.warning(
-                                            f'{retry_down_name}下載異常後重新推送第{tries + 1}(/5)次網路請求超時！將重試')
-                                        continue
-                                    except json.JSONDecodeError:
-                                        logging.warning(
-                                            f'{retry_down_name}下載異常後重新推送第{tries + 1}(/5)次返回結果錯誤，可能是frp故障！將重試！')
-                                        sleep(5)  # frp的问题就休息一会
-                                        continue
-                                if not repush_flag:  # ?次重新推送失败，则认为此文件下载失败，让用户手动下载
-                                    print_info = f'{retry_down_name}下載異常後重新推送失敗！該檔案直連如下，請手動下載：\n{retry_the_url}'
-                                    safe_send_message(print_info)
-                                    logging.error(print_info)
-                                    failed_gid[each_gid] = temp_gid.pop(each_gid)  # 5次都不成功，别管这个任务了，放弃吧没救了
-                                    continue  # 程序将查询下一个gid
-
-                                # 重新记录gid
-                                temp_gid[response['result']] = [retry_down_name, gid[each_gid][1], retry_the_url]
-                                # 删除旧的gid
-                                temp_gid.pop(each_gid)
-                                # 消息提示
-                                logging.warning(
-                                    f'aria2下載{gid[each_gid][0]}出錯！錯誤訊息：{error_message}\t此檔案已重新推送aria2下載！')
-                            # 其他错误信息暂未遇到，先跳过处理
-                            else:
-                                print_info = f'aria2下載{gid[each_gid][0]}出錯！錯誤訊息：{error_message}\t該檔案直連如下，' \
-                                             f'請手動下載並反饋bug：\n{gid[each_gid][2]}'
-                                safe_send_message(print_info)
-                                logging.warning(print_info)
-                                failed_gid[each_gid] = temp_gid.pop(each_gid)  # 认为该任务失败
-
-                    except KeyError:  # 此时任务可能已被手动删除
-                        safe_send_message(f'aria2下載{gid[each_gid][0]}任務被刪除！')
-                        logging.warning(f'aria2下載{gid[each_gid][0]}任務被刪除！')
-                        failed_gid[each_gid] = temp_gid.pop(each_gid)  # 认为该任务失败
-
-                # 判断完所有下载任务情况
-                gid = temp_gid
-                if len(gid) == 0:
-                    download_done = True
-                    print_info = f'aria2下載已完成：\n{down_name}\n共{len(complete_file_id) + len(failed_gid)}個檔案，' \
-                                 f'其中{len(complete_file_id)}個成功，{len(failed_gid)}個失敗'
-                    
-                    # Log cleanup start
-                    logging.info(f"Aria2下載完成，準備清理PikPak檔案... (成功: {len(complete_file_id)}, 失敗: {len(failed_gid)})")
-                    sleep(2) # 等待一小段時間確保狀態同步
-
-                    # 输出下载失败的文件信息
-                    if len(failed_gid):
-                        print_info += '，下載失敗檔案為：\n'
-                        for values in failed_gid.values():
-                            print_info += values[0] + '\n'
-
-                        # 存在失败文件则只释放成功文件的网盘空间
-                        # 增加重試機制確保刪除成功
-                        status_a = False
-                        status_b = False
-                        for _ in range(3):
-                            if not status_a:
-                                status_a = delete_files(complete_file_id, each_account)
-                            if not status_b:
-                                status_b = delete_trash(complete_file_id, each_account)
-                            if status_a and status_b:
-                                break
-                            sleep(2)
-
-                        if status_a:
-                            logging.info(f'帳號{each_account}已刪除{down_name}中下載成功的雲端硬碟檔案')
-                        if status_b:
-                            logging.info(f'帳號{each_account}已刪除{down_name}中下載成功的垃圾桶檔案')
-                        
-                        if status_a and status_b:
-                            print_info += f'帳號{each_account}中下載成功的雲端硬碟檔案已刪除\n'
-                        elif each_account in AUTO_DELETE and AUTO_DELETE[each_account] == 'False':
-                            print_info += f'帳號{each_account}未開啟自動刪除\n'
-                        else:
-                            print_info += f'帳號{each_account}中下載成功的雲端硬碟檔案刪除失敗，請手動刪除\n'
-
-                        safe_send_message(print_info)
-                        logging.info(print_info)
-
-                        # /download命令仅打算临时解决问题，当/pikpak命令足够健壮后将弃用/download命令
-                        print_info = f'對於下載失敗的檔案可使用指令：\n`/clean {each_account}`清空此帳號下所有檔案\n~~或者使用臨時指令：~~' \
-                                     f'\n~~`/download {each_account}`重試下載此帳號下所有檔案~~'
-                        safe_send_message(print_info, parse_mode='Markdown')
-                        logging.info(print_info)
-                        # 記錄批量失敗
-                        record_batch_result(batch_id, 'fail', down_name, f"部分檔案下載失敗: {len(failed_gid)}個", update, context)
-                    else:
-                        # 没有失败文件，则直接删除该文件根目录
-                        # 增加重試機制確保刪除成功
-                        status_a = False
-                        status_b = False
-                        for _ in range(3):
-                            if not status_a:
-                                status_a = delete_files(file_id, each_account)
-                            if not status_b:
-                                status_b = delete_trash(file_id, each_account)
-                            if status_a and status_b:
-                                break
-                            sleep(2)
-
-                        if status_a:
-                            logging.info(f'帳號{each_account}已刪除{down_name}雲端硬碟檔案')
-                        if status_b:
-                            logging.info(f'帳號{each_account}已刪除{down_name}垃圾桶檔案')
-                        
-                        if status_a and status_b:
-                            print_info += f'\n帳號{each_account}中該檔案的雲端硬碟空間已釋放'
-                        elif each_account in AUTO_DELETE and AUTO_DELETE[each_account] == 'False':
-                            print_info += f'\n帳號{each_account}未開啟自動刪除'
-                        else:
-                            print_info += f'\n帳號{each_account}中該檔案的雲端硬碟空間釋放失敗，請手動刪除'
-                        # 发送下载结果统计信息
-                        safe_send_message(print_info)
-                        logging.info(print_info)
-                        
-                        # 記錄批量成功
-                        record_batch_result(batch_id, 'success', down_name, "", update, context)
-                else:
-                    logging.info(f'aria2下載{down_name}還未完成，睡眠20s後進行下一次查詢...')
-                    sleep(20)
+        if status_a:
+            logging.info(f'帳號{each_account}已刪除{down_name}雲端硬碟檔案')
+        if status_b:
+            logging.info(f'帳號{each_account}已刪除{down_name}垃圾桶檔案')
 
-    except requests.exceptions.ReadTimeout:
-        # 即使發生超時，也不要直接判定失敗，因為可能是查詢狀態時的短暫超時
-        logging.warning(f'下載磁力{mag_url_simple}期間發生網路請求超時，但任務可能仍在進行中。')
-        # 不發送失敗通知，讓它自然結束或由其他邏輯處理
-    except Exception as e:
-        logging.error(f"處理磁力{mag_url_simple}時發生未知錯誤: {e}")
-        record_batch_result(batch_id, 'fail', mag_url_simple, f"發生未知錯誤: {str(e)}", update, context)
+        if status_a and status_b:
+            print_info += f'\n帳號{each_account}中該檔案的雲端硬碟空間已釋放'
+        elif each_account in AUTO_DELETE and AUTO_DELETE[each_account] == 'False':
+            print_info += f'\n帳號{each_account}未開啟自動刪除'
+        else:
+            print_info += f'\n帳號{each_account}中該檔案的雲端硬碟空間釋放失敗，請手動刪除'
+        # 发送下载结果统计信息
+        job.send_message(print_info)
+        logging.info(print_info)
+
+        # 全部檔案下載成功才記錄到下載歷史，部分失敗的下次仍會重新下載
+        if job.info_hash:
+            job_store.save_history(job.info_hash, down_name, job.completed_files)
+
+        # 記錄批量成功
+        record_batch_result(job.batch_id, 'success', down_name, "", job.info_hash)
+        job.notify_subscribers('success', down_name, "", print_info)
+    return None
+
+
+# 任務調度器
+class JobScheduler:
+    """
+    固定數量的工作線程 + 分階段佇列：submit → wait_offline → push → wait_aria2 → cleanup
+    需要調用 API 的階段（submit/push/cleanup）由工作線程處理；兩個等待階段不佔用工作線程，
+    wait_offline 由各帳號的 OfflineTaskPoller 刷新後回調推進，
+    wait_aria2 由一個監控線程對所有任務的 gid 做一次批量查詢推進。
+    無論積壓多少磁力，線程數量都是固定的。
+    """
+
+    # 越靠後的階段越優先處理，儘快釋放雲端硬碟空間
+    WORK_STAGES = ('cleanup', 'push', 'submit')
+    STAGE_HANDLERS = {'submit': stage_submit, 'push': stage_push, 'cleanup': stage_cleanup}
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.queues = {stage: deque() for stage in self.WORK_STAGES}
+        self.delayed = []  # 延遲執行的階段，[(到期時間, 序號, stage, job)] 小頂堆
+        self.seq = 0
+        self.jobs = {}  # 所有未結束的任務，{job.id: job}
+        self.by_hash = {}  # 未進入 cleanup 階段的任務的 info-hash 索引，{info_hash: job}
+        self.offline_waiting = {}  # 等待離線完成的任務，{account: {job.id: job}}
+        self.aria2_waiting = {}  # 等待aria2下載完成的任務，{job.id: job}
+        self.link_refreshing = set()  # 正在更新直鏈的 (job.id, gid)
+        self.link_updates = {}  # 已更新、等待監控線程寫回任務的直鏈，{(job.id, gid): 新直鏈}
+        self.listening = set()  # 已註冊刷新回調的帳號
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True).start()
+        threading.Thread(target=self._aria2_monitor, name='aria2-monitor', daemon=True).start()
+
+    def add(self, job):
+        """
+        提交新磁力。同一個 info-hash 已有任務在處理時不再提交，只把通知對象附加到該任務上，
+        返回實際處理這個磁力的任務
+        """
+        with self.cond:
+            existing = self.by_hash.get(job.info_hash) if job.info_hash else None
+            if existing is not None:
+                existing.subscribers.append([None if job.quiet else job.chat_id, job.batch_id])
+                # 該任務可能正由工作線程或aria2監控線程修改，不在這裡保存整個任務，只記錄新的通知對象；
+                # 在鎖內寫入，保證任務結束刪除記錄時這條已經寫入
+                job_store.add_subscriber(existing.id, None if job.quiet else job.chat_id, job.batch_id)
+            elif job.info_hash:
+                self.by_hash[job.info_hash] = job
+        if existing is not None:
+            return existing
+        self.submit(job, 'submit')
+        return job
+
+    def submit(self, job, stage, delay=0):
+        job.stage = stage
+        job_store.save_job(job)
+        with self.cond:
+            self.jobs[job.id] = job
+            if job.info_hash and stage != 'cleanup':
+                self.by_hash.setdefault(job.info_hash, job)
+            if stage == 'wait_offline':
+                self._park_offline(job)
+            elif stage == 'wait_aria2':
+                self.aria2_waiting[job.id] = job
+            elif delay:
+                self.seq += 1
+                heapq.heappush(self.delayed, (time() + delay, self.seq, stage, job))
+            else:
+                self.queues[stage].append(job)
+            self.cond.notify_all()
+
+    def restore(self):
+        """從資料庫恢復上次未完成的任務，每個任務回到它所在的階段繼續"""
+        jobs = [Job.from_dict(data) for data in job_store.load_jobs()]
+        for job in jobs:
+            logging.info(f"恢復任務 {job.name or job.mag_url_simple}（階段: {job.stage}）")
+            self.submit(job, job.stage)
+        return len(jobs)
+
+    def _release_hash(self, job):
+        with self.cond:
+            if self.by_hash.get(job.info_hash) is job:
+                self.by_hash.pop(job.info_hash)
+
+    def has_jobs(self):
+        with self.cond:
+            return bool(self.jobs)
+
+    def offline_count(self, account):
+        """帳號上還在離線下載中的任務數"""
+        with self.cond:
+            return len(self.offline_waiting.get(account, {}))
+
+    def _park_offline(self, job):
+        job.offline_start = job.offline_start or time()  # 恢復的任務沿用原來的開始時間
+        job.not_found_count = 0
+        self.offline_waiting.setdefault(job.account, {})[job.id] = job
+        poller = get_offline_poller(job.account)
+        if job.account not in self.listening:
+            poller.add_listener(self._on_offline_refresh)
+            self.listening.add(job.account)
+        poller.watch(job.task_id)
+
+    def _on_offline_refresh(self, account, tasks):
+        with self.cond:
+            jobs = list(self.offline_waiting.get(account, {}).values())
+        for job in jobs:
+            with job_log_context(job.id):
+                next_stage = check_offline(job, tasks)
+            if next_stage:
+                with self.cond:
+                    self.offline_waiting[account].pop(job.id, None)
+                get_offline_poller(account).unwatch(job.task_id)
+                self.submit(job, next_stage)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while True:
+                    # 把到期的延遲任務放回佇列
+                    while self.delayed and self.delayed[0][0] <= time():
+                        _, _, stage, job = heapq.heappop(self.delayed)
+                        self.queues[stage].append(job)
+                    stage = next((s for s in self.WORK_STAGES if self.queues[s]), None)
+                    if stage:
+                        job = self.queues[stage].popleft()
+                        break
+                    self.cond.wait(self.delayed[0][0] - time() if self.delayed else None)
+            with job_log_context(job.id):
+                self._run_stage(job, stage)
+
+    def _run_stage(self, job, stage):
+        if stage == 'cleanup':
+            # cleanup 會通知訂閱者，先移出 info-hash 索引，之後同一磁力的提交不會再附加到這個即將結束的任務上
+            self._release_hash(job)
+        try:
+            next_stage = self.STAGE_HANDLERS[stage](job)
+        except requests.exceptions.ReadTimeout:
+            # 即使發生超時，也不要直接判定失敗，因為可能是查詢狀態時的短暫超時
+            job.timeout_retries += 1
+            if job.timeout_retries <= 3:
+                logging.warning(f'處理磁力{job.mag_url_simple}期間發生網路請求超時，10s後重試此步驟...')
+                self.submit(job, stage, delay=10)
+                return
+            next_stage = job.fail("多次網路請求超時")
+        except Exception as e:
+            logging.error(f"處理磁力{job.mag_url_simple}時發生未知錯誤: {e}")
+            next_stage = job.fail(f"發生未知錯誤: {str(e)}", name=job.mag_url_simple)
+
+        if next_stage == 'cleanup' and stage == 'cleanup':  # cleanup 本身出錯就只記錄結果，不再重入
+            record_batch_result(job.batch_id, 'fail', job.error_name, job.error, job.info_hash)
+            job.notify_subscribers('fail', job.error_name, job.error)
+            next_stage = None
+        if next_stage:
+            self.submit(job, next_stage)
+        else:
+            with self.cond:
+                self.jobs.pop(job.id, None)
+                self.cond.notify_all()  # 喚醒等待空位的大量匯入
+            self._release_hash(job)
+            job_store.delete_job(job.id)
+
+    def _aria2_monitor(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.aria2_waiting)
+                jobs = list(self.aria2_waiting.values())
+
+            # 所有任務的gid一次批量查詢
+            gids = [each_gid for job in jobs for each_gid in job.gids]
+            statuses = aria2_tell_status_batch(gids)
+            if statuses is None:  # 整個批量請求失敗就跳過此輪查詢
+                logging.warning('批量查詢aria2下載狀態失敗，可能是frp故障，將跳過此次查詢！')
+                statuses = {}
+
+            for job in jobs:
+                pending = len(job.gids)
+                refreshed = self._apply_link_updates(job)
+                try:
+                    with job_log_context(job.id):
+                        next_stage = check_aria2(job, statuses)
+                except Exception as e:
+                    logging.error(f"檢查{job.down_name}的aria2下載狀態時發生錯誤: {e}")
+                    continue
+                if next_stage:
+                    with self.cond:
+                        self.aria2_waiting.pop(job.id, None)
+                    self.submit(job, next_stage)
+                    continue
+                with job_log_context(job.id):
+                    self._refresh_links(job, statuses)
+                if refreshed or len(job.gids) != pending:  # 有檔案完成、失敗或更新了直鏈，保存進度
+                    job_store.save_job(job)
+
+            with self.cond:
+                # 已離開aria2階段的任務不再需要更新直鏈
+                for key in [key for key in self.link_updates if key[0] not in self.aria2_waiting]:
+                    self.link_updates.pop(key)
+                remaining = [each_gid for job in self.aria2_waiting.values() for each_gid in job.gids]
+            aria2_notifier.unwatch(set(gids) - set(remaining))
+            if remaining:
+                logging.info(f'aria2還有{len(remaining)}個檔案未完成，睡眠{ARIA2_POLL_INTERVAL}s（收到通知時提前喚醒）後進行下一次查詢...')
+                wait_aria2_events(remaining, ARIA2_POLL_INTERVAL)
+
+
+    def _refresh_links(self, job, statuses):
+        """
+        把即將過期的排隊直鏈交給線程池更新，監控線程不等待受限流的直鏈請求，只負責查詢狀態。
+        更新結果由監控線程下一輪寫回任務，任務只在監控線程中修改和保存
+        """
+        for each_gid in expiring_queued_links(job, statuses):
+            key = (job.id, each_gid)
+            with self.cond:
+                if key in self.link_refreshing or key in self.link_updates:
+                    continue
+                self.link_refreshing.add(key)
+            future = submit_with_log_context(folder_resolve_pool, refresh_queued_link,
+                                             job.account, each_gid, list(job.gids[each_gid]))
+            future.add_done_callback(lambda future, key=key: self._link_refreshed(key, future))
+
+    def _link_refreshed(self, key, future):
+        try:
+            down_url = future.result()
+        except Exception as e:
+            logging.error(f"更新gid {key[1]}的下載直鏈時發生錯誤: {e}")
+            down_url = None
+        with self.cond:
+            self.link_refreshing.discard(key)
+            if down_url and key[0] in self.aria2_waiting:
+                self.link_updates[key] = down_url
+
+    def _apply_link_updates(self, job):
+        """把線程池更新好的直鏈寫回任務，返回寫回的數量"""
+        with self.cond:
+            updates = {key[1]: self.link_updates.pop(key) for key in list(self.link_updates) if key[0] == job.id}
+        refreshed = 0
+        for each_gid, down_url in updates.items():
+            if each_gid in job.gids:
+                job.gids[each_gid][2] = down_url
+                refreshed += 1
+        return refreshed
+
+
+scheduler = JobScheduler()
+
+
+# /pikpak命令主程序：把磁力（或待恢復的離線任務）交給調度器，立即返回
+def main(update: Update, context: CallbackContext, magnet, offline_path=None, batch_id=None, resume_task=None, target_account=None, force=False, quiet=False):
+    chat_id = update.effective_chat.id if update and update.effective_chat else None
+    job = Job(chat_id, magnet, offline_path, batch_id, resume_task, target_account)
+    job.quiet = quiet
+    # 以前完整下載過的磁力直接略過，除非指定強制重新下載
+    if not resume_task and not force and SKIP_DOWNLOADED and job.info_hash:
+        history = job_store.find_history(job.info_hash)
+        if history:
+            job.stage = 'downloaded'
+            files = '\n'.join(history['files'][:10]) + ('\n...' if len(history['files']) > 10 else '')
+            completed_at = datetime.fromtimestamp(history['completed_at']).strftime('%Y-%m-%d %H:%M')
+            print_info = f'{job.mag_url_simple}已於{completed_at}下載過，略過：\n{history["name"]}\n' \
+                         f'共{len(history["files"])}個檔案：\n{files}\n如需重新下載請使用 /p -f 磁力'
+            job.send_message(print_info)
+            logging.info(print_info)
+            record_batch_result(batch_id, 'success', history['name'], '之前已下載過，略過', job.info_hash)
+            return job
+    if resume_task:
+        logging.info(f"正在恢復帳號 {target_account} 的任務: {job.name}")
+        scheduler.submit(job, 'wait_offline')
+        return job
+    existing = scheduler.add(job)
+    if existing is not job:
+        logging.info(f"{job.mag_url_simple}已在處理中（{existing.name or existing.mag_url_simple}），完成後一併通知結果")
+    return existing
 
 
 def pikpak(update: Update, context: CallbackContext):
@@ -1505,9 +3447,13 @@ def pikpak(update: Update, context: CallbackContext):
         argv = update.message.text.split()
     else:
         argv = context.args  # 获取命令参数
+    # -f/--force 強制重新下載之前已下載過的磁力
+    force = any(each_arg in ['-f', '--force'] for each_arg in argv)
+    argv = [each_arg for each_arg in argv if each_arg not in ['-f', '--force']]
 
     if len(argv) == 0:  # 如果仅为/pikpak命令，没有附带参数则返回帮助信息
-        context.bot.send_message(chat_id=update.effective_chat.id, text='【用法】\n/p magnet1 [magnet2] [...]')
+        context.bot.send_message(chat_id=update.effective_chat.id, text='【用法】\n/p magnet1 [magnet2] [...]\n'
+                                                                        '/p -f magnet1 [...]\t強制重新下載之前已下載過的磁力')
     else:
         print_info = '下載隊列添加離線磁力任務：\n'  # 将要输出的信息
         if os.path.isabs(argv[0]):
@@ -1527,24 +3473,18 @@ def pikpak(update: Update, context: CallbackContext):
 
         # 初始化批量任務追蹤
         batch_id = str(uuid.uuid4())[:8]
-        with batch_lock:
-             batch_results[batch_id] = {
-                 'total': len(argv),
-                 'processed': 0,
-                 'results': []
-             }
+        create_batch(batch_id, len(argv), chat_id=update.effective_chat.id)
 
         for each_magnet in argv:  # 逐个判断每个参数是否为磁力链接，并提取出
-            # 一个磁链一个线程，此线程负责从离线到aria2下本地全过程
-            thread_list.append(threading.Thread(target=main, args=[update, context, each_magnet, offline_path, batch_id]))
-            thread_list[-1].start()
+            # 一个磁链一个任务，由调度器负责从离线到aria2下本地全过程
+            job = main(update, context, each_magnet, offline_path, batch_id, force=force)
 
             # 显示信息为了简洁，仅提取磁链中xt参数部分
-            mag_url_part = re.search(r'^(magnet:\?).*(xt=.+?)(&|$)', each_magnet)
-            if mag_url_part:  # 正则匹配上，則输出信息
-                print_info += ''.join(mag_url_part.groups()[:-1])
-            else:  # 否则输出未识别信息
-                print_info += each_magnet
+            print_info += magnet_simple(each_magnet)
+            if [update.effective_chat.id, batch_id] in job.subscribers:
+                print_info += '\n（已在處理中，完成後一併通知結果）'
+            elif job.stage == 'downloaded':
+                print_info += '\n（之前已下載過，略過）'
             print_info += '\n\n'
 
         context.bot.send_message(chat_id=update.effective_chat.id, text=print_info.rstrip())
@@ -1552,14 +3492,8 @@ def pikpak(update: Update, context: CallbackContext):
 
 
 def check_download_thread_status():
-    global thread_list
-    thread_list = [i for i in thread_list if i.is_alive()]
-
     # 未完成返回True，完成返回False，类似running标志
-    if len(thread_list):
-        return True
-    else:
-        return False
+    return scheduler.has_jobs()
 
 
 def clean(update: Update, context: CallbackContext):
@@ -1584,7 +3518,7 @@ def clean(update: Update, context: CallbackContext):
     elif argv[0] in ['d', 'deep']:
         context.bot.send_message(chat_id=update.effective_chat.id, text='🔄 開始深度清理...')
         for temp_account in USER:
-            login(temp_account)
+            get_headers(temp_account)
             msg_parts = []
             
             # 1. 刪除所有檔案
@@ -1620,7 +3554,7 @@ def clean(update: Update, context: CallbackContext):
             context.bot.send_message(chat_id=update.effective_chat.id, text='🔄 正在清理所有離線任務記錄...')
         
         for temp_account in USER:
-            login(temp_account)
+            get_headers(temp_account)
             success, fail = delete_offline_tasks(temp_account, phase_filter=phase_filter)
             if success > 0 or fail > 0:
                 context.bot.send_message(
@@ -1633,7 +3567,7 @@ def clean(update: Update, context: CallbackContext):
     elif argv[0] in ['a', 'all']:
         context.bot.send_message(chat_id=update.effective_chat.id, text='🔄 開始清空所有帳號...')
         for temp_account in USER:
-            login(temp_account)
+            get_headers(temp_account)
             msg_parts = []
             
             # 1. 刪除檔案
@@ -1659,7 +3593,7 @@ def clean(update: Update, context: CallbackContext):
     else:
         for each_account in argv:  # 输入参数是账户名称
             if each_account in USER:
-                login(each_account)
+                get_headers(each_account)
                 msg_parts = []
                 
                 # 1. 刪除檔案
@@ -1744,7 +3678,25 @@ def record_config():
             f'ARIA2_SECRET = "{ARIA2_SECRET}"\n'
             f'ARIA2_DOWNLOAD_PATH = "{ARIA2_DOWNLOAD_PATH}"\n'
             f'TG_API_URL = "{TG_API_URL}"\n'
-            f'PIKPAK_OFFLINE_PATH = "{PIKPAK_OFFLINE_PATH}"\n')
+            f'PIKPAK_OFFLINE_PATH = "{PIKPAK_OFFLINE_PATH}"\n'
+            f'OFFLINE_POLL_INTERVAL = {OFFLINE_POLL_INTERVAL}\n'
+            f'ARIA2_WS_NOTIFY = {ARIA2_WS_NOTIFY}\n'
+            f'SCHEDULER_WORKERS = {SCHEDULER_WORKERS}\n'
+            f'PIKPAK_RATE_LIMIT = {PIKPAK_RATE_LIMIT}\n'
+            f'PIKPAK_RATE_BURST = {PIKPAK_RATE_BURST}\n'
+            f'HTTP_POOL_SIZE = {HTTP_POOL_SIZE}\n'
+            f'JOB_DB_PATH = "{JOB_DB_PATH}"\n'
+            f'TOKEN_REFRESH_MARGIN = {TOKEN_REFRESH_MARGIN}\n'
+            f'STATS_REFRESH_INTERVAL = {STATS_REFRESH_INTERVAL}\n'
+            f'ACCOUNT_QUERY_WORKERS = {ACCOUNT_QUERY_WORKERS}\n'
+            f'LOG_BUFFER_SIZE = {LOG_BUFFER_SIZE}\n'
+            f'FOLDER_RESOLVE_WORKERS = {FOLDER_RESOLVE_WORKERS}\n'
+            f'ARIA2_ADD_BATCH = {ARIA2_ADD_BATCH}\n'
+            f'LINK_REFRESH_MARGIN = {LINK_REFRESH_MARGIN}\n'
+            f'HEDGE_DELAY = {HEDGE_DELAY}\n'
+            f'SKIP_DOWNLOADED = {SKIP_DOWNLOADED}\n'
+            f'WEB_RELEASE_INTERVAL = {WEB_RELEASE_INTERVAL}\n'
+            f'IMPORT_MAX_ACTIVE = {IMPORT_MAX_ACTIVE}\n')
     logging.info('已更新config.py文件')
 
 
@@ -1754,16 +3706,16 @@ def get_my_vip(account):
         login_headers = get_headers(account)
 
         me_url = f"{PIKPAK_API_URL}/drive/v1/privilege/vip"
-        me_result = requests.get(url=me_url, headers=login_headers, timeout=5).json()
+        me_result = pikpak_request(account, 'GET', url=me_url, headers=login_headers, timeout=5).json()
     except Exception:
         return 3
 
     if "error" in me_result:
         if me_result['error_code'] == 16:
             logging.info(f"帳號{account}登入過期，正在重新登入")
-            login(account)
+            refresh_login(account, login_headers)
             login_headers = get_headers(account)
-            me_result = requests.get(url=me_url, headers=login_headers, timeout=5).json()
+            me_result = pikpak_request(account, 'GET', url=me_url, headers=login_headers, timeout=5).json()
         else:
             logging.error(f"獲取vip訊息失敗{me_result['error_description']}")
             return 3
@@ -1776,6 +3728,18 @@ def get_my_vip(account):
         return 2
 
 
+# 获取网盘剩余空间（字节），失败返回None
+def get_free_space(account):
+    try:
+        about_url = f"{PIKPAK_API_URL}/drive/v1/about"
+        about_result = pikpak_request(account, 'GET', url=about_url, headers=get_headers(account), timeout=5).json()
+        quota = about_result['quota']
+        return int(quota['limit']) - int(quota['usage'])
+    except Exception as e:
+        logging.warning(f"帳號{account}獲取雲端硬碟容量失敗：{e}")
+        return None
+
+
 # 账号管理功能
 def account_manage(update: Update, context: CallbackContext):
     # account l/list --> 账号名称 是否为 vip
@@ -1821,6 +3785,7 @@ def account_manage(update: Update, context: CallbackContext):
             USER.insert(0, argv[1])  # 插入账号
             PASSWORD.insert(0, argv[2])  # 插入密码
             pikpak_headers.insert(0, None)  # 设置pikpak_headers
+            pikpak_clients.insert(0, None)
             record_config()  # 记录进入config文件
 
             print_info = print_user()
@@ -1835,6 +3800,7 @@ def account_manage(update: Update, context: CallbackContext):
                 USER.insert(0, register['account'])
                 PASSWORD.insert(0, register['password'])
                 pikpak_headers.insert(0, None)  # 设置pikpak_headers
+                pikpak_clients.insert(0, None)
                 record_config()  # 记录进入config文件
                 print_info = print_user()
                 context.bot.send_message(chat_id=update.effective_chat.id, text=print_info, parse_mode='Markdown')
@@ -1854,6 +3820,10 @@ def account_manage(update: Update, context: CallbackContext):
                 USER.pop(temp_account_index)
                 PASSWORD.pop(temp_account_index)
                 pikpak_headers.pop(temp_account_index)
+                close_client(pikpak_clients.pop(temp_account_index))
+                token_manager.forget(each_account)
+                account_selector.forget(each_account)
+                job_store.delete_session(each_account)
 
                 # 解决删除账号后，自动删除状态也要删除
                 # 先判断是否存在，存在则删除
@@ -1915,6 +3885,7 @@ def path(update: Update, context: CallbackContext):
             context.bot.send_message(chat_id=update.effective_chat.id, text=f'當前離線下載路徑為：`{PIKPAK_OFFLINE_PATH}`', parse_mode='Markdown')
     elif argv[0] == 'default':
         PIKPAK_OFFLINE_PATH = "None"
+        invalidate_offline_path()
         record_config()
         context.bot.send_message(chat_id=update.effective_chat.id, text='已恢復預設路徑：`/My Pack`', parse_mode='Markdown')
     else:
@@ -1923,6 +3894,7 @@ def path(update: Update, context: CallbackContext):
             context.bot.send_message(chat_id=update.effective_chat.id, text='路徑參數請使用絕對路徑或指令不存在！')
             return
         PIKPAK_OFFLINE_PATH = argv[0]
+        invalidate_offline_path()
         record_config()
         context.bot.send_message(chat_id=update.effective_chat.id, text=f'已設置離線下載路徑：`{PIKPAK_OFFLINE_PATH}`', parse_mode='Markdown')
 
@@ -2028,18 +4000,89 @@ def retry(update: Update, context: CallbackContext):
     )
 
 
+# Telegram 一次傳多個檔案時每個檔案是一條訊息，屬於同一個 media group，
+# 收齊（IMPORT_GROUP_WAIT 秒內沒有新檔案）後合併為一個匯入批次，{media_group_id: {...}}
+import_groups = {}
+import_groups_lock = threading.Lock()
+IMPORT_GROUP_WAIT = 2
+# Bot API 能下載的檔案大小上限
+TG_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+
+def import_document(update: Update, context: CallbackContext):
+    """接收磁力清單文字檔或種子檔，交給 bulk_importer 在背景匯入"""
+    document = update.message.document
+    filename = os.path.basename(document.file_name or 'document')
+    mime_type = document.mime_type or ''
+    if mime_type == 'application/x-bittorrent' and not filename.lower().endswith('.torrent'):
+        filename += '.torrent'
+    if not (filename.lower().endswith(('.torrent', '.txt')) or mime_type.startswith('text/')):
+        update.message.reply_text('只支援磁力清單文字檔（.txt）或種子檔（.torrent）')
+        return
+    if document.file_size and document.file_size > TG_DOWNLOAD_LIMIT:
+        update.message.reply_text('檔案超過 20MB，Telegram 無法下載，請改用 Web UI 匯入')
+        return
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, uuid.uuid4().hex)
+    try:
+        context.bot.get_file(document.file_id).download(custom_path=path)
+    except Exception as e:
+        logging.error(f"下載匯入檔案 {filename} 失敗: {e}")
+        update.message.reply_text(f'下載檔案 {filename} 失敗：{e}')
+        return
+
+    # 說明文字中的 -f 強制重新下載，絕對路徑為離線路徑；一組檔案通常只有第一個帶說明文字
+    argv = (update.message.caption or '').split()
+    force = any(each_arg in ['-f', '--force'] for each_arg in argv)
+    offline_path = next((each_arg for each_arg in argv if os.path.isabs(each_arg)), None)
+
+    group = update.message.media_group_id
+    if not group:
+        start_import(update, [(path, filename)], offline_path, force)
+        return
+    with import_groups_lock:
+        pending = import_groups.setdefault(group, {'update': update, 'files': [], 'offline_path': None,
+                                                   'force': False, 'timer': None})
+        pending['files'].append((path, filename))
+        pending['offline_path'] = pending['offline_path'] or offline_path
+        pending['force'] = pending['force'] or force
+        if pending['timer']:
+            pending['timer'].cancel()
+        pending['timer'] = threading.Timer(IMPORT_GROUP_WAIT, flush_import_group, (group,))
+        pending['timer'].daemon = True
+        pending['timer'].start()
+
+
+def flush_import_group(group):
+    with import_groups_lock:
+        pending = import_groups.pop(group, None)
+    if pending:
+        start_import(pending['update'], pending['files'], pending['offline_path'], pending['force'])
+
+
+def start_import(update, files, offline_path, force):
+    if not offline_path and str(PIKPAK_OFFLINE_PATH) not in ["None", "/My Pack"]:
+        offline_path = PIKPAK_OFFLINE_PATH
+    batch_id = bulk_importer.create(files, chat_id=update.effective_chat.id, offline_path=offline_path, force=force)
+    names = '、'.join(filename for _, filename in files)
+    update.message.reply_text(f'已開始匯入 {names}（批次 {batch_id}），任務將在背景逐個加入下載隊列，全部結束後發送匯總通知')
+
+
 start_handler = CommandHandler(['start', 'help'], start)
 pikpak_handler = CommandHandler('p', pikpak)
 clean_handler = CommandHandler(['clean', 'clear'], clean)
 account_handler = CommandHandler('account', account_manage)
 path_handler = CommandHandler('path', path)
 retry_handler = CommandHandler('retry', retry)
-magnet_handler = MessageHandler(Filters.regex('^magnet:\?xt=urn:btih:[0-9a-fA-F]{40,}.*$'), pikpak)
+magnet_handler = MessageHandler(Filters.regex('^magnet:\?xt=urn:btih:(?:[0-9a-fA-F]{40,}|[a-zA-Z2-7]{32}).*$'), pikpak)
+import_handler = MessageHandler(Filters.document, import_document)
 
 dispatcher.add_handler(AdminHandler())
 dispatcher.add_handler(account_handler)
 dispatcher.add_handler(start_handler)
 dispatcher.add_handler(magnet_handler)
+dispatcher.add_handler(import_handler)
 dispatcher.add_handler(pikpak_handler)
 dispatcher.add_handler(clean_handler)
 dispatcher.add_handler(path_handler)
@@ -2048,6 +4091,23 @@ dispatcher.add_handler(retry_handler)
 def startup_recovery():
     """Bot 啟動時檢查是否有未完成的任務並恢復監控"""
     logging.info("正在檢查是否有未完成的任務需要恢復...")
+    # 任務資料庫記錄了每個任務的進度，直接從中斷的階段繼續
+    if not job_store.fresh:
+        try:
+            resumed_count = scheduler.restore()
+            if resumed_count > 0:
+                logging.info(f"已從任務資料庫恢復 {resumed_count} 個任務")
+            released_count = batch_releaser.restore()
+            if released_count > 0:
+                logging.info(f"繼續放出 {released_count} 個 Web 批次中尚未加入隊列的磁力")
+            imported_count = bulk_importer.restore()
+            if imported_count > 0:
+                logging.info(f"繼續 {imported_count} 個未讀完的匯入批次")
+        except Exception as e:
+            logging.error(f"啟動恢復任務失敗: {e}")
+        return
+
+    # 第一次使用任務資料庫（從舊版本升級）時，掃描各帳號的離線列表恢復
     try:
         for account in USER:
             # 獲取該帳號的所有離線任務
@@ -2070,17 +4130,22 @@ def startup_recovery():
                         'id': task.get('id'),
                         'name': task.get('name') or task.get('file_name')
                     }
-                    # 啟動恢復線程
-                    thread_list.append(threading.Thread(target=main, args=[None, None, None, None, None, task_info, account]))
-                    thread_list[-1].start()
+                    # 交給調度器恢復監控
+                    main(None, None, None, None, None, task_info, account)
                     resumed_count += 1
-                    sleep(1) # 避免過快啟動
             
             if resumed_count > 0:
                 logging.info(f"已從帳號 {account} 恢復 {resumed_count} 個任務")
     except Exception as e:
         logging.error(f"啟動恢復任務失敗: {e}")
 
+# 訂閱 aria2 下載完成通知
+if ARIA2_WS_NOTIFY:
+    aria2_notifier.start()
+
+# 啟動任務調度器
+scheduler.start()
+
 # 啟動恢復線程
 recovery_thread = threading.Thread(target=startup_recovery)
 recovery_thread.daemon = True
@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    """
+    載入 pikpakTgBot 模組：使用臨時目錄中的 config.py（不配置帳號、不啟動 Telegram 輪詢），
+    任務資料庫和匯入目錄也放在臨時目錄
+    """
+    config_dir = tmp_path_factory.mktemp('config')
+    with open(os.path.join(REPO_DIR, 'config.py'), encoding='utf-8') as f:
+        config = f.read()
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        web_port = s.getsockname()[1]
+    config += (f'\nTOKEN = "123456:TEST"\nUSER = []\nPASSWORD = []\n'
+               f'ARIA2_HOST = "127.0.0.1"\nARIA2_PORT = "1"\nARIA2_WS_NOTIFY = False\n'
+               f'WEB_PORT = {web_port}\nJOB_DB_PATH = "{config_dir / "jobs.db"}"\n'
+               f'IMPORT_DIR = "{config_dir / "imports"}"\n')
+    (config_dir / 'config.py').write_text(config, encoding='utf-8')
+    sys.path[:0] = [str(config_dir), REPO_DIR]
+    sys.modules.pop('config', None)
+
+    import telegram.ext
+    telegram.ext.Updater.start_polling = lambda self, *args, **kwargs: None
+    telegram.ext.Updater.idle = lambda self, *args, **kwargs: None
+    import pikpakTgBot
+    return pikpakTgBot
+
+
+class FakeAria2:
+    """
+    本地的假 aria2：同一個端口上，WebSocket 連線用於推送通知，普通 HTTP POST 按 JSON-RPC 回應
+    tellStatus/addUri/tellActive/tellWaiting/tellStopped。
+    statuses 為各 gid 的狀態，accept_ws 為 False 時拒絕 WebSocket 連線（模擬 aria2 無法連上），
+    含有 slow_methods 中方法的請求處理完後 response_delay 秒才回應（模擬請求已被處理但回應超時）
+    """
+
+    WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        port = self.server.getsockname()[1]
+        self.ws_url = f'ws://127.0.0.1:{port}/jsonrpc'
+        self.rpc_url = f'http://127.0.0.1:{port}/jsonrpc'
+        self.statuses = {}
+        self.added = []  # addUri 收到的連結
+        self.slow_methods = set()
+        self.response_delay = 0
+        self.accept_ws = True
+        self.clients = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = conn.recv(4096)
+            if not chunk:
+                conn.close()
+                return
+            data += chunk
+        head, body = data.split(b'\r\n\r\n', 1)
+        lines = head.decode().split('\r\n')
+        headers = {k.strip().lower(): v.strip() for k, v in (line.split(':', 1) for line in lines[1:])}
+
+        if headers.get('upgrade', '').lower() == 'websocket':
+            if not self.accept_ws:
+                conn.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+                conn.close()
+                return
+            accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + self.WS_GUID).encode()).digest())
+            conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+            with self.lock:
+                self.clients.append(conn)
+            return
+
+        while len(body) < int(headers.get('content-length', 0)):
+            body += conn.recv(4096)
+        request = json.loads(body)
+        if request['method'] == 'system.multicall':
+            methods = [call['methodName'] for call in request['params'][0]]
+            result = [self._call(call['methodName'], call['params'][1:]) for call in request['params'][0]]
+            result = [each if isinstance(each, dict) and 'code' in each else [each] for each in result]
+        else:
+            methods = [request['method']]
+            result = self._call(request['method'], request['params'][1:])
+        if self.slow_methods.intersection(methods):
+            time.sleep(self.response_delay)
+        payload = json.dumps({'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}).encode()
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: ' + str(len(payload)).encode() + b'\r\n\r\n' + payload)
+        conn.close()
+
+    def _call(self, method, params):
+        with self.lock:
+            if method == 'aria2.tellStatus':
+                return self.statuses.get(params[0], {'code': 1, 'message': 'not found'})
+            if method == 'aria2.addUri':
+                gid = f'{len(self.added) + 1:016x}'
+                self.added.append(params[0][0])
+                self.statuses[gid] = {'gid': gid, 'status': 'waiting', 'files': [{'uris': [{'uri': params[0][0]}]}]}
+                return gid
+            if method in ('aria2.tellActive', 'aria2.tellWaiting', 'aria2.tellStopped'):
+                wanted = {'aria2.tellActive': 'active', 'aria2.tellWaiting': 'waiting'}.get(method)
+                return [status for status in self.statuses.values()
+                        if status['status'] == wanted or (wanted is None and status['status'] in ('complete', 'error'))]
+            return 'OK'
+
+    def notify(self, method, gid):
+        """向所有 WebSocket 連線推送一條 aria2 通知"""
+        payload = json.dumps({'jsonrpc': '2.0', 'method': method, 'params': [{'gid': gid}]}).encode()
+        frame = bytes([0x81, len(payload)]) if len(payload) < 126 else \
+            bytes([0x81, 126]) + len(payload).to_bytes(2, 'big')
+        with self.lock:
+            for conn in self.clients:
+                conn.sendall(frame + payload)
+
+    def drop(self):
+        """斷開所有 WebSocket 連線"""
+        with self.lock:
+            for conn in self.clients:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            self.clients.clear()
+
+    def close(self):
+        self.drop()
+        self.server.close()
+
+
+@pytest.fixture
+def fake_aria2():
+    fake = FakeAria2()
+    yield fake
+    fake.close()
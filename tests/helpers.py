@@ -0,0 +1,22 @@
+from time import sleep, time
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time() + timeout
+    while not predicate():
+        if time() > deadline:
+            return False
+        sleep(0.02)
+    return True
+
+
+class FakeResponse:
+    """代替 requests 的回應，只支援 json()"""
+
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
@@ -0,0 +1,32 @@
+from time import sleep, time
+
+
+def test_query_accounts_runs_in_parallel_and_skips_failures(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'USER', ['a', 'b', 'c'])
+
+    def query(account):
+        sleep(0.3)
+        if account == 'b':
+            raise RuntimeError('login failed')
+        return account.upper()
+
+    start = time()
+    assert bot.query_accounts(query) == {'a': 'A', 'c': 'C'}
+    assert time() - start < 0.6
+    assert bot.query_accounts(query, ['c']) == {'c': 'C'}
+
+
+def test_api_stuck_merges_accounts(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'USER', ['a', 'b', 'c'])
+
+    def stuck(account, min_progress):
+        if account == 'b':
+            raise RuntimeError('login failed')
+        return [{'id': f'{account}-1', 'name': 'name', 'progress': min_progress}]
+
+    monkeypatch.setattr(bot, 'get_stuck_tasks', stuck)
+    data = bot.app.test_client().get('/api/stuck?min_progress=95').get_json()
+    # 某個帳號失敗不影響其他帳號的結果
+    assert data['count'] == 2
+    assert [(task['account'], task['id'], task['progress']) for task in data['tasks']] == \
+        [('a', 'a-1', 95), ('c', 'c-1', 95)]
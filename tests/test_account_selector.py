@@ -0,0 +1,59 @@
+import threading
+from time import time
+
+from helpers import wait_until
+
+
+def setup_accounts(bot, monkeypatch, vip_status):
+    release = threading.Event()
+
+    def fake_vip(account):
+        release.wait()
+        return vip_status[account]
+
+    monkeypatch.setattr(bot, 'USER', ['a', 'b'])
+    monkeypatch.setattr(bot, 'get_my_vip', fake_vip)
+    monkeypatch.setattr(bot, 'get_free_space', lambda account: 100)
+    monkeypatch.setattr(bot, 'scheduler', bot.JobScheduler(workers=0))
+    return release
+
+
+def test_candidates_refresh_in_background(bot, monkeypatch):
+    release = setup_accounts(bot, monkeypatch, {'a': 1, 'b': 0})
+    selector = bot.AccountSelector()
+
+    # 查詢 vip 被卡住時不等待，先按已知的值（都未知）排序
+    start = time()
+    assert selector.candidates() == ['a', 'b']
+    assert time() - start < 0.5
+
+    release.set()
+    assert wait_until(lambda: selector.states['b']['vip'] == 0)
+    assert selector.candidates() == ['b', 'a']
+
+
+def test_candidates_count_running_offline_tasks(bot, monkeypatch):
+    release = setup_accounts(bot, monkeypatch, {'a': 0, 'b': 0})
+    release.set()
+    selector = bot.AccountSelector()
+    for account in ('a', 'b'):
+        selector.states[account] = dict(selector._state(account), vip=0, free=100, checked_at=time())
+
+    bot.scheduler.offline_waiting['a'] = {'job-1': object(), 'job-2': object()}
+    selector.begin('b')
+    assert selector.candidates() == ['b', 'a']
+    selector.end('b', True)
+    assert selector.candidates() == ['b', 'a']
+
+
+def test_only_specific_errors_mark_account_exhausted(bot):
+    selector = bot.AccountSelector()
+    selector.report_error('a', 'file_not_found', 'parent folder space limit')
+    assert not selector.is_exhausted('a')
+    selector.report_error('a', 'task_daily_create_limit', 'daily limit reached')
+    assert selector.is_exhausted('a')
+
+    # 提交成功後解除
+    selector.begin('a')
+    selector.end('a', True)
+    assert not selector.is_exhausted('a')
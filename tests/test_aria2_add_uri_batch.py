@@ -0,0 +1,33 @@
+def test_timed_out_batch_is_not_pushed_twice(bot, fake_aria2, monkeypatch):
+    monkeypatch.setattr(bot, 'ARIA2_RPC_URL', fake_aria2.rpc_url)
+    multicall = bot.aria2_multicall
+    monkeypatch.setattr(bot, 'aria2_multicall', lambda calls, timeout=10: multicall(calls, timeout=0.5))
+
+    # aria2 收到了批量推送，但回應超時
+    fake_aria2.slow_methods = {'aria2.addUri'}
+    fake_aria2.response_delay = 1
+    items = [(f'https://example.com/file{i}', {'dir': '/downloads'}, f'file{i}') for i in range(3)]
+    gids = bot.aria2_add_uri_batch(items)
+
+    assert fake_aria2.added == [url for url, _, _ in items]
+    assert gids == [f'{i + 1:016x}' for i in range(3)]
+
+
+def test_failed_batch_pushes_only_missing_files(bot, fake_aria2, monkeypatch):
+    monkeypatch.setattr(bot, 'ARIA2_RPC_URL', fake_aria2.rpc_url)
+    multicall = bot.aria2_multicall
+    calls_made = []
+
+    def failing_add(calls, timeout=10):
+        # 第一次批量推送整個失敗，之後的查詢正常
+        if not calls_made and calls[0][0] == 'aria2.addUri':
+            calls_made.append(calls)
+            return []
+        return multicall(calls, timeout=timeout)
+
+    monkeypatch.setattr(bot, 'aria2_multicall', failing_add)
+    items = [(f'https://example.com/file{i}', {'dir': '/downloads'}, f'file{i}') for i in range(2)]
+    gids = bot.aria2_add_uri_batch(items)
+
+    assert fake_aria2.added == [url for url, _, _ in items]
+    assert all(gids)
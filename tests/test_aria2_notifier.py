@@ -0,0 +1,49 @@
+import threading
+from time import time
+
+from helpers import wait_until
+
+
+def start_notifier(bot, fake_aria2):
+    notifier = bot.Aria2Notifier(fake_aria2.ws_url)
+    notifier.RECONNECT_DELAY = 0.2
+    notifier.start()
+    assert wait_until(lambda: notifier.connected)
+    return notifier
+
+
+def test_notification_wakes_wait(bot, fake_aria2):
+    notifier = start_notifier(bot, fake_aria2)
+    threading.Timer(0.2, fake_aria2.notify, ('aria2.onDownloadComplete', 'gid-a')).start()
+
+    start = time()
+    assert notifier.wait({'gid-a', 'gid-b'}, 5) == {'gid-a'}
+    assert time() - start < 2
+
+    # 沒有任務在等待的 gid 的通知不會被記錄
+    fake_aria2.notify('aria2.onDownloadError', 'gid-c')
+    assert notifier.wait({'gid-b'}, 0.3) == set()
+    assert 'gid-c' not in notifier.events
+
+
+def test_polling_resumes_after_socket_drops(bot, fake_aria2, monkeypatch):
+    notifier = start_notifier(bot, fake_aria2)
+    monkeypatch.setattr(bot, 'aria2_notifier', notifier)
+    monkeypatch.setattr(bot, 'ARIA2_RPC_URL', fake_aria2.rpc_url)
+
+    fake_aria2.accept_ws = False
+    fake_aria2.drop()
+    assert wait_until(lambda: not notifier.connected)
+
+    # 斷線期間 wait_aria2_events 睡滿間隔後返回，由調用方輪詢狀態
+    fake_aria2.statuses['gid-a'] = {'gid': 'gid-a', 'status': 'complete'}
+    start = time()
+    assert bot.wait_aria2_events({'gid-a'}, 0.3) == set()
+    assert time() - start >= 0.3
+    assert bot.aria2_tell_status_batch(['gid-a'])['gid-a']['status'] == 'complete'
+
+    # aria2 恢復後自動重連，通知重新生效
+    fake_aria2.accept_ws = True
+    assert wait_until(lambda: notifier.connected)
+    threading.Timer(0.2, fake_aria2.notify, ('aria2.onDownloadComplete', 'gid-b')).start()
+    assert bot.wait_aria2_events({'gid-b'}, 5) == {'gid-b'}
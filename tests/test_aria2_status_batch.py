@@ -0,0 +1,16 @@
+def test_status_batch_uses_one_multicall(bot, fake_aria2, monkeypatch):
+    monkeypatch.setattr(bot, 'ARIA2_RPC_URL', fake_aria2.rpc_url)
+    fake_aria2.statuses['gid-a'] = {'gid': 'gid-a', 'status': 'complete'}
+    fake_aria2.statuses['gid-b'] = {'gid': 'gid-b', 'status': 'active'}
+
+    statuses = bot.aria2_tell_status_batch(['gid-a', 'gid-b', 'gid-missing'])
+
+    assert statuses['gid-a']['status'] == 'complete'
+    assert statuses['gid-b']['status'] == 'active'
+    assert statuses['gid-missing'] == {'code': 1, 'message': 'not found'}  # 單個 gid 出錯不影響其他
+
+
+def test_status_batch_returns_none_when_aria2_unreachable(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'ARIA2_RPC_URL', 'http://127.0.0.1:1/jsonrpc')
+    assert bot.aria2_tell_status_batch(['gid-a']) is None
+    assert bot.aria2_tell_status_batch([]) == {}
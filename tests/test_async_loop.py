@@ -0,0 +1,39 @@
+import asyncio
+import threading
+from time import time
+
+import pytest
+
+
+def test_calls_from_many_threads_share_one_loop(bot):
+    loop_thread = bot.AsyncLoopThread()
+    seen = []
+
+    async def work(i):
+        await asyncio.sleep(0.2)
+        seen.append((asyncio.get_running_loop(), threading.current_thread().name))
+        return i
+
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(loop_thread.run(work(i), 5))) for i in range(5)]
+    start = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 各線程的調用在同一個常駐循環上並行執行
+    assert sorted(results) == list(range(5))
+    assert time() - start < 0.6
+    assert set(seen) == {(loop_thread.loop, 'pikpak-asyncio')}
+    assert not loop_thread.loop.is_closed()
+
+
+def test_exception_is_raised_in_caller(bot):
+    async def fail():
+        raise ValueError('bad token')
+
+    with pytest.raises(ValueError):
+        bot.run_async(fail(), timeout=5)
+    # 出錯後循環仍可繼續使用
+    assert bot.run_async(asyncio.sleep(0, result='ok'), timeout=5) == 'ok'
@@ -0,0 +1,63 @@
+from helpers import wait_until
+
+
+def magnet(i):
+    return f'magnet:?xt=urn:btih:{i:040x}&dn=name-{i}'
+
+
+def start_batch(bot, batch_id, items):
+    bot.create_batch(batch_id, len(items))
+    with bot.batch_lock:
+        bot.batch_results[batch_id].update({'notify_chat_id': None, 'items': [
+            {'magnet': each, 'mag_url_simple': bot.magnet_simple(each), 'info_hash': bot.magnet_info_hash(each),
+             'status': status, 'job_id': None} for each, status in items]})
+        bot.job_store.save_batch(batch_id, bot.batch_results[batch_id])
+
+
+def fake_main(bot, released):
+    def main(update, context, each_magnet, offline_path=None, batch_id=None, force=False):
+        # 放出時 item 已先以 releasing 狀態保存，中途中斷的話重啟後不會再放出一次
+        saved = bot.job_store.load_batches()[batch_id]
+        assert [item['status'] for item in saved['items'] if item['magnet'] == each_magnet] == ['releasing']
+        released.append(each_magnet)
+        job = bot.Job(None, each_magnet, batch_id=batch_id)
+        bot.record_batch_result(batch_id, 'success', job.mag_url_simple, '', job.info_hash)
+        return job
+    return main
+
+
+def test_releaser_progress_counting(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'job_store', bot.JobStore(str(tmp_path / 'jobs.db')))
+    released = []
+    monkeypatch.setattr(bot, 'main', fake_main(bot, released))
+    releaser = bot.BatchReleaser(0)
+
+    magnets = [magnet(1), magnet(2), magnet(3)]
+    start_batch(bot, 'rel-1', [(each, 'queued') for each in magnets])
+    assert bot.batch_progress('rel-1')['items'][0]['magnet'] == f'magnet:?xt=urn:btih:{1:040x}'
+    releaser.add('rel-1')
+
+    assert wait_until(lambda: 'rel-1' in bot.finished_batches)
+    assert released == magnets
+    progress = bot.batch_progress('rel-1')
+    assert progress['processed'] == progress['total'] == 3
+    assert [item['status'] for item in progress['items']] == ['success'] * 3
+    assert 'rel-1' not in bot.job_store.load_batches()
+
+
+def test_restore_treats_releasing_items_as_released(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'job_store', bot.JobStore(str(tmp_path / 'jobs.db')))
+    released = []
+    monkeypatch.setattr(bot, 'main', fake_main(bot, released))
+    monkeypatch.setattr(bot, 'batch_releaser', bot.BatchReleaser(0))
+
+    # 上次放出 magnet(4) 途中程序中斷，任務已建立並在之後匯報了結果
+    start_batch(bot, 'rel-2', [(magnet(4), 'releasing'), (magnet(5), 'queued')])
+    assert bot.batch_releaser.restore() == 1
+    assert wait_until(lambda: released == [magnet(5)])
+    assert bot.batch_results['rel-2']['items'][0]['status'] == 'released'
+    assert bot.job_store.load_batches()['rel-2']['items'][0]['status'] == 'released'
+
+    bot.record_batch_result('rel-2', 'success', 'name-4', '', bot.magnet_info_hash(magnet(4)))
+    assert bot.batch_progress('rel-2')['processed'] == 2
+    assert 'rel-2' in bot.finished_batches
@@ -0,0 +1,44 @@
+from time import sleep
+
+import pytest
+
+from helpers import wait_until
+
+
+def test_subscriber_keeps_snapshot_refreshing(bot):
+    builds = []
+    cache = bot.SnapshotCache(lambda: builds.append(1) or {'tasks': []}, 0.02, idle_timeout=0.05, initial={'tasks': []})
+
+    cache.subscribe()
+    assert wait_until(lambda: len(builds) >= 10)
+    cache.unsubscribe()
+
+    # 沒有訂閱者、也沒有人讀取後暫停刷新
+    sleep(0.2)
+    count = len(builds)
+    sleep(0.2)
+    assert len(builds) == count
+
+
+def test_events_stream_reads_existing_snapshot(bot, monkeypatch):
+    cache = bot.SnapshotCache(lambda: {'tasks': [{'type': 'aria2', 'gid': 'gid-a'}]}, 60,
+                              initial={'tasks': []})
+    cache.get = lambda: pytest.fail('stream should not touch the snapshot on each loop')
+    monkeypatch.setattr(bot, 'stats_cache', cache)
+    monkeypatch.setattr(bot, 'EVENTS_HEARTBEAT', 0.1)
+
+    response = bot.app.test_client().get('/api/events', buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry')
+    assert next(chunks).startswith(b'event: logs')
+    assert b'"reset": true' in next(chunks)
+
+    # 訂閱後背景線程刷新快照，推送有變化的任務
+    assert wait_until(lambda: cache.updated_at)
+    bot.notify_events()
+    chunk = next(chunk for chunk in chunks if chunk.startswith(b'event: tasks'))
+    assert b'gid-a' in chunk
+    assert cache.subscribers == 1
+
+    response.close()
+    assert cache.subscribers == 0
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+
+TREE = {
+    '': [{'kind': 'drive#folder', 'id': 'pack', 'name': 'My Pack'}],
+    'pack': [{'kind': 'drive#folder', 'id': 'show', 'name': 'Show'},
+             {'kind': 'drive#file', 'id': 'f1', 'name': 'a.mkv'}],
+    'show': [{'kind': 'drive#file', 'id': f'f{i}', 'name': f'{i}.mkv'} for i in range(2, 8)],
+}
+
+
+def setup_tree(bot, monkeypatch, delay=0.0):
+    monkeypatch.setattr(bot, 'folder_resolve_pool', ThreadPoolExecutor(max_workers=8))
+
+    def fake_list(folder_id, account):
+        sleep(delay)
+        return TREE[folder_id]
+
+    def fake_url(file_id, account):
+        sleep(delay)
+        return f'{file_id}.mkv', f'http://example/{file_id}'
+
+    monkeypatch.setattr(bot, 'get_list', fake_list)
+    monkeypatch.setattr(bot, 'get_download_url', fake_url)
+
+
+def test_folder_files_resolved_concurrently(bot, monkeypatch):
+    setup_tree(bot, monkeypatch, delay=0.2)
+    start = time()
+    files = sorted(bot.get_folder_all_file('', '', 'user', skip_ids={'f7'}))
+    # 3 層資料夾加 1 輪直鏈，同一層的請求同時進行
+    assert time() - start < 1.2
+
+    # My Pack 不計入路徑，其他資料夾名稱加到路徑中，已推送過的檔案略過
+    assert files == [('f1.mkv', 'http://example/f1', 'f1', '')] + \
+        [(f'f{i}.mkv', f'http://example/f{i}', f'f{i}', 'Show/') for i in range(2, 7)]
+
+
+def test_tick_yields_none_and_stop_cancels_pending(bot, monkeypatch):
+    setup_tree(bot, monkeypatch, delay=0.3)
+    monkeypatch.setattr(bot, 'folder_resolve_pool', ThreadPoolExecutor(max_workers=1))
+    files = bot.get_folder_all_file('show', 'Show/', 'user', tick=0.05)
+
+    # 沒有請求在 tick 秒內完成時返回 None，調用方可以趁機處理已拿到的檔案
+    assert next(files) is None
+    first = next(each for each in files if each is not None)
+    assert first[2] == 'f2'
+    files.close()
+
+    # 停止後還沒開始的直鏈請求已取消，線程池很快空閒
+    start = time()
+    bot.folder_resolve_pool.submit(lambda: None).result()
+    assert time() - start < 0.5
@@ -0,0 +1,33 @@
+import base64
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.added = []
+
+    def add(self, job):
+        self.added.append(job)
+        return job
+
+
+def test_downloaded_magnet_is_skipped(bot, monkeypatch, tmp_path):
+    store = bot.JobStore(str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(bot, 'job_store', store)
+    monkeypatch.setattr(bot, 'scheduler', RecordingScheduler())
+    monkeypatch.setattr(bot, 'SKIP_DOWNLOADED', True)
+    info_hash = 'ab' * 20
+    store.save_history(info_hash, 'name', ['/downloads/name/a.mkv'])
+    assert store.find_history(info_hash)['files'] == ['/downloads/name/a.mkv']
+    assert store.find_history('cd' * 20) is None
+
+    # base32 形式的同一個 info-hash 也能對上
+    base32 = base64.b32encode(bytes.fromhex(info_hash)).decode()
+    for magnet in (f'magnet:?xt=urn:btih:{info_hash.upper()}&dn=x', f'magnet:?xt=urn:btih:{base32}'):
+        job = bot.main(None, None, magnet, quiet=True)
+        assert job.stage == 'downloaded'
+    assert bot.scheduler.added == []
+
+    # 強制重新下載和沒有記錄的磁力照常提交
+    forced = bot.main(None, None, f'magnet:?xt=urn:btih:{info_hash}', force=True, quiet=True)
+    fresh = bot.main(None, None, f'magnet:?xt=urn:btih:{"cd" * 20}', quiet=True)
+    assert bot.scheduler.added == [forced, fresh]
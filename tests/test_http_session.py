@@ -0,0 +1,42 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = []
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_session_reuses_connection(bot):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    try:
+        session = bot.new_http_session()
+        for _ in range(5):
+            assert session.get(url, timeout=5).status_code == 200
+        # 五個請求共用同一條長連線
+        assert len(KeepAliveHandler.connections) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_one_session_per_account(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'pikpak_sessions', {})
+    assert bot.get_session('a') is bot.get_session('a')
+    assert bot.get_session('a') is not bot.get_session('b')
@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from helpers import wait_until
+
+
+def bencode(value):
+    if isinstance(value, int):
+        return b'i%de' % value
+    if isinstance(value, bytes):
+        return b'%d:%s' % (len(value), value)
+    if isinstance(value, list):
+        return b'l' + b''.join(bencode(each) for each in value) + b'e'
+    return b'd' + b''.join(bencode(key) + bencode(value[key]) for key in sorted(value)) + b'e'
+
+
+def test_torrent_to_magnet(bot):
+    info = {b'name': 'ubuntu 測試.iso'.encode(), b'piece length': 262144, b'pieces': b'x' * 20, b'length': 1}
+    torrent = bencode({b'announce': b'udp://a:1', b'announce-list': [[b'udp://a:1'], [b'udp://b:2']], b'info': info})
+
+    magnet = bot.torrent_to_magnet(torrent)
+    assert magnet == (f'magnet:?xt=urn:btih:{hashlib.sha1(bencode(info)).hexdigest()}'
+                      '&dn=ubuntu%20%E6%B8%AC%E8%A9%A6.iso&tr=udp%3A%2F%2Fa%3A1&tr=udp%3A%2F%2Fb%3A2')
+
+    for data in (b'not a torrent', bencode({b'announce': b'x'}), torrent[:-10],
+                 bencode({b'info': {b'name': b'v2', b'meta version': 2}})):
+        with pytest.raises(ValueError):
+            bot.torrent_to_magnet(data)
+
+
+def test_import_entries_across_chunks(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'IMPORT_CHUNK_SIZE', 16)
+    magnets = [f'magnet:?xt=urn:btih:{i:040x}&dn=file-{i}&tr=udp%3A%2F%2Ftracker' for i in range(6)]
+    text = (f'{magnets[0]}\n  {magnets[1]} note\r\n{magnets[2]},{magnets[3]};{magnets[4]}\n'
+            f'"{magnets[5]}"')
+    path = tmp_path / 'list.txt'
+    path.write_text(text, encoding='utf-8')
+    assert list(bot.iter_import_entries(str(path), 'list.txt')) == [(each, None) for each in magnets]
+
+    path = tmp_path / 'broken.torrent'
+    path.write_bytes(b'garbage')
+    [(magnet, error)] = bot.iter_import_entries(str(path), 'broken.torrent')
+    assert magnet is None and error
+
+
+def test_importer_waits_for_scheduler_capacity(bot, monkeypatch, tmp_path):
+    scheduler = bot.JobScheduler(workers=0)
+    monkeypatch.setattr(bot, 'scheduler', scheduler)
+    monkeypatch.setattr(bot, 'job_store', bot.JobStore(str(tmp_path / 'jobs.db')))
+    submitted = []
+
+    def fake_main(update, context, magnet, offline_path=None, batch_id=None, force=False, quiet=False):
+        assert quiet
+        with scheduler.cond:
+            scheduler.jobs[magnet] = batch_id
+        submitted.append(magnet)
+
+    monkeypatch.setattr(bot, 'main', fake_main)
+    torrent = bencode({b'info': {b'name': b'a', b'pieces': b'x' * 20, b'length': 1}})
+    (tmp_path / 'a.torrent').write_bytes(torrent)
+    (tmp_path / 'list.txt').write_text('\n'.join(f'magnet:?xt=urn:btih:{i:040x}' for i in range(4)))
+    importer = bot.BulkImporter(max_active=2)
+    batch_id = importer.create([(str(tmp_path / 'list.txt'), 'list.txt'), (str(tmp_path / 'a.torrent'), 'a.torrent')])
+
+    # 調度器中未結束的任務達到上限時暫停解析
+    assert wait_until(lambda: len(submitted) == 2)
+    assert not wait_until(lambda: len(submitted) > 2, timeout=0.3)
+
+    def finish_all():
+        for magnet in list(submitted):
+            with scheduler.cond:
+                if scheduler.jobs.pop(magnet, None):
+                    scheduler.cond.notify_all()
+                    bot.record_batch_result(batch_id, 'success', magnet, '')
+
+    while not wait_until(lambda: len(submitted) == 5, timeout=0.2):
+        finish_all()
+    finish_all()
+    assert submitted[-1] == bot.torrent_to_magnet(torrent)
+    assert wait_until(lambda: batch_id in bot.finished_batches)
+    assert bot.finished_batches[batch_id]['success'] == 5
+    assert not (tmp_path / 'list.txt').exists()
+
+
+class FakeDocumentMessage:
+    def __init__(self, name, group, caption=None):
+        self.document = SimpleNamespace(file_name=name, mime_type='text/plain', file_size=10, file_id=name)
+        self.media_group_id = group
+        self.caption = caption
+        self.replies = []
+
+    def reply_text(self, text):
+        self.replies.append(text)
+
+
+def test_media_group_documents_become_one_batch(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'IMPORT_DIR', str(tmp_path))
+    monkeypatch.setattr(bot, 'IMPORT_GROUP_WAIT', 0.2)
+    created = []
+    monkeypatch.setattr(bot.bulk_importer, 'create',
+                        lambda files, **kwargs: created.append((files, kwargs)) or f'batch-{len(created)}')
+    context = SimpleNamespace(bot=SimpleNamespace(get_file=lambda file_id: SimpleNamespace(
+        download=lambda custom_path: open(custom_path, 'w').close())))
+
+    messages = [FakeDocumentMessage('a.txt', 'group-1', '-f /Downloads'), FakeDocumentMessage('b.txt', 'group-1'),
+                FakeDocumentMessage('c.txt', None)]
+    threads = [threading.Thread(target=bot.import_document, args=(
+        SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=1)), context)) for message in messages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 同一組的檔案收齊後才建立一個批次，說明文字對整組生效
+    assert wait_until(lambda: len(created) == 2)
+    group_files, group_kwargs = next(each for each in created if len(each[0]) == 2)
+    assert sorted(filename for _, filename in group_files) == ['a.txt', 'b.txt']
+    assert group_kwargs['force'] and group_kwargs['offline_path'] == '/Downloads'
+    assert len(messages[0].replies) + len(messages[1].replies) == 1
+    assert len(messages[2].replies) == 1
+    assert not bot.import_groups
@@ -0,0 +1,39 @@
+def test_jobs_batches_and_sessions_survive_reopen(bot, tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    store = bot.JobStore(path)
+    assert store.fresh
+
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + '2' * 40, batch_id='batch-1')
+    job.stage, job.account, job.task_id, job.file_id = 'wait_aria2', 'user', 'task-1', 'file-1'
+    job.gids = {'gid-1': ['a.mkv', 'file-2', 'https://example.com/a']}
+    job.repush = {'gid-0': (['b.mkv', 'file-3', 'https://example.com/b'], '/downloads', 'error')}
+    store.save_job(job)
+    store.save_batch('batch-1', {'total': 2, 'processed': 1, 'results': [], 'chat_id': None})
+    store.save_session('user', {'access_token': 'token'})
+
+    reopened = bot.JobStore(path)
+    assert not reopened.fresh
+    restored = bot.Job.from_dict(reopened.load_jobs()[0])
+    assert (restored.id, restored.stage, restored.account, restored.task_id) == (job.id, 'wait_aria2', 'user', 'task-1')
+    assert restored.gids == job.gids
+    assert restored.repush == job.repush  # json 存成 list 的 tuple 要還原
+    assert reopened.load_batches() == {'batch-1': {'total': 2, 'processed': 1, 'results': [], 'chat_id': None}}
+    assert reopened.load_session('user') == {'access_token': 'token'}
+
+
+def test_restore_resumes_each_job_at_its_stage(bot, tmp_path, monkeypatch):
+    store = bot.JobStore(str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(bot, 'job_store', store)
+    for stage in ('submit', 'push', 'wait_aria2', 'cleanup'):
+        job = bot.Job(None, f'magnet:?xt=urn:btih:{stage.encode().hex():0>40}')
+        job.stage = stage
+        store.save_job(job)
+
+    scheduler = bot.JobScheduler(workers=0)
+    assert scheduler.restore() == 4
+    assert [job.stage for job in scheduler.queues['submit']] == ['submit']
+    assert [job.stage for job in scheduler.queues['push']] == ['push']
+    assert [job.stage for job in scheduler.queues['cleanup']] == ['cleanup']
+    assert [job.stage for job in scheduler.aria2_waiting.values()] == ['wait_aria2']
+    # 進入 cleanup 的任務不再接受重複提交
+    assert len(scheduler.by_hash) == 3
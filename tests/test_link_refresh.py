@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+
+from helpers import wait_until
+
+
+def test_link_cache_expiry(bot, monkeypatch):
+    cache = bot.LinkCache(margin=60)
+    now = time()
+    cache.put('file-1', 'a', 'http://example/a?e=1', now + 600)
+    assert cache.get('file-1') == ('a', 'http://example/a?e=1')
+    assert not cache.expiring('file-1')
+
+    # 離過期不到 margin 秒時不再複用，視為即將過期
+    cache.put('file-2', 'b', 'http://example/b', now + 30)
+    assert cache.get('file-2') is None
+    assert cache.expiring('file-2')
+
+    # 已過期的在下一次寫入時清掉
+    cache.put('file-3', 'c', 'http://example/c', now - 1)
+    cache.put('file-4', 'd', 'http://example/d', now + 600)
+    assert 'file-3' not in cache.links
+
+    # 沒有緩存或緩存的不是同一條直鏈時，從直鏈參數 e 判斷，判斷不了不算過期
+    assert cache.expiring('file-5', f'http://example/e?e={int(now + 10)}')
+    assert not cache.expiring('file-1', f'http://example/a?e={int(now + 600)}')
+    assert not cache.expiring('file-6', 'http://example/f')
+    assert bot.LinkCache.link_expiry({'links': {'application/octet-stream': {'expire': '2030-01-01T00:00:00Z'}}}) == \
+        1893456000
+
+
+def make_waiting_job(bot, scheduler, gids):
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + 'c' * 40)
+    job.account = 'user'
+    job.gids = {gid: [f'{gid}.mkv', f'file-{gid}', f'http://example/{gid}?e=1'] for gid in gids}
+    scheduler.aria2_waiting[job.id] = job
+    return job
+
+
+def test_link_refresh_runs_in_pool_without_duplicates(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=0)
+    job = make_waiting_job(bot, scheduler, ['gid-a'])
+    release = threading.Event()
+    requested = []
+
+    def fake_url(file_id, account, fresh=False):
+        requested.append(file_id)
+        release.wait()
+        return 'gid-a.mkv', 'http://example/new'
+
+    monkeypatch.setattr(bot, 'folder_resolve_pool', ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(bot, 'get_download_url', fake_url)
+    monkeypatch.setattr(bot, 'call_aria2', lambda method, params, timeout=None: [0, 1])
+    statuses = {'gid-a': {'status': 'waiting'}}
+
+    # 直鏈請求被卡住時，監控線程不等待，也不會重複提交同一個gid
+    start = time()
+    scheduler._refresh_links(job, statuses)
+    scheduler._refresh_links(job, statuses)
+    assert time() - start < 0.5
+    assert wait_until(lambda: requested == ['file-gid-a'])
+    assert scheduler._apply_link_updates(job) == 0
+
+    release.set()
+    assert wait_until(lambda: scheduler.link_updates)
+    scheduler._refresh_links(job, statuses)
+    assert scheduler._apply_link_updates(job) == 1
+    assert job.gids['gid-a'][2] == 'http://example/new'
+    assert requested == ['file-gid-a']
+
+
+def test_monitor_keeps_polling_while_links_refresh(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=0)
+    make_waiting_job(bot, scheduler, ['gid-a', 'gid-b'])
+    release = threading.Event()
+    polls = []
+
+    def fake_url(file_id, account, fresh=False):
+        release.wait()
+        return None, None
+
+    monkeypatch.setattr(bot, 'folder_resolve_pool', ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(bot, 'get_download_url', fake_url)
+    monkeypatch.setattr(bot, 'aria2_tell_status_batch',
+                        lambda gids: polls.append(gids) or {gid: {'status': 'waiting'} for gid in gids})
+    monkeypatch.setattr(bot, 'wait_aria2_events', lambda gids, timeout: sleep(0.02))
+    threading.Thread(target=scheduler._aria2_monitor, daemon=True).start()
+
+    assert wait_until(lambda: len(polls) >= 5)
+    assert scheduler.link_refreshing == {(job_id, gid) for job_id in scheduler.aria2_waiting for gid in ('gid-a', 'gid-b')}
+    release.set()
+    with scheduler.cond:
+        scheduler.aria2_waiting.clear()
@@ -0,0 +1,41 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_since_returns_only_entries_after_cursor(bot):
+    ring = bot.LogRing(3)
+    for i in range(5):
+        ring.append(logging.INFO if i % 2 else logging.WARNING, f'job-{i % 2}', f'line {i}')
+
+    # 容量為 3，最舊的兩條已被丟棄
+    assert ring.seq == 5
+    assert ring.since(limit=10) == [(3, 'line 2'), (4, 'line 3'), (5, 'line 4')]
+    assert ring.since(4) == [(5, 'line 4')]
+    assert ring.since(5) == []
+    assert ring.since(limit=2) == [(4, 'line 3'), (5, 'line 4')]
+    assert ring.since(0, level=logging.WARNING) == [(3, 'line 2'), (5, 'line 4')]
+    assert ring.since(0, job_id='job-1') == [(4, 'line 3')]
+
+
+def test_pool_tasks_log_with_submitter_job_id(bot, monkeypatch):
+    ring = bot.LogRing(100)
+    monkeypatch.setattr(bot, 'log_ring', ring)
+    monkeypatch.setattr(bot, 'folder_resolve_pool', ThreadPoolExecutor(max_workers=2))
+
+    def fake_list(folder_id, account):
+        logging.info(f'list {folder_id}')
+        return [{'kind': 'drive#file', 'id': 'file-1', 'name': 'a'}] if folder_id == 'root' else []
+
+    def fake_url(file_id, account):
+        logging.info(f'url {file_id}')
+        return 'a', 'http://example/a'
+
+    monkeypatch.setattr(bot, 'get_list', fake_list)
+    monkeypatch.setattr(bot, 'get_download_url', fake_url)
+    with bot.job_log_context('job-1'):
+        files = list(bot.get_folder_all_file('root', '', 'user'))
+
+    assert [each[2] for each in files] == ['file-1']
+    lines = [text for _, text in ring.since(0, job_id='job-1')]
+    assert any('list root' in text for text in lines)
+    assert any('url file-1' in text for text in lines)
@@ -0,0 +1,41 @@
+import pytest
+
+from helpers import FakeResponse
+
+
+@pytest.fixture
+def upload_env(bot, monkeypatch):
+    """帳號 user 的離線路徑 /downloads 已緩存為 old-id，記錄每次提交和查找路徑"""
+    env = {'posts': [], 'resolves': [], 'responses': []}
+
+    def fake_request(account, method, url=None, json=None, **kwargs):
+        env['posts'].append(json['parent_id'])
+        return FakeResponse(env['responses'].pop(0))
+
+    def fake_resolve(account, offline_path):
+        env['resolves'].append(offline_path)
+        return bot.cached_offline_path(account, offline_path) or 'new-id'
+
+    monkeypatch.setattr(bot, 'USER', ['user'])
+    monkeypatch.setattr(bot, 'pikpak_clients', [None])
+    monkeypatch.setattr(bot, 'get_headers', lambda account: {'Authorization': 'Bearer token'})
+    monkeypatch.setattr(bot, 'pikpak_request', fake_request)
+    monkeypatch.setattr(bot, 'resolve_offline_path', fake_resolve)
+    monkeypatch.setitem(bot.folder_id_cache, 'user', {'/downloads': 'old-id'})
+    return env
+
+
+def test_other_errors_do_not_re_resolve_path(bot, upload_env):
+    upload_env['responses'] = [{'error': 'task_daily_create_limit', 'error_code': 4,
+                                'error_description': 'daily limit'}]
+    assert bot.magnet_upload('magnet:?xt=urn:btih:' + 'a' * 40, 'user', offline_path='/downloads') == (None, None)
+    assert upload_env['posts'] == ['old-id']
+    assert upload_env['resolves'] == ['/downloads']
+    assert bot.cached_offline_path('user', '/downloads') == 'old-id'
+
+
+def test_missing_cached_folder_is_re_resolved(bot, upload_env):
+    upload_env['responses'] = [{'error': 'file_not_found', 'error_code': 9, 'error_description': 'parent not found'},
+                               {'task': {'id': 'task-1', 'name': 'name'}}]
+    assert bot.magnet_upload('magnet:?xt=urn:btih:' + 'a' * 40, 'user', offline_path='/downloads') == ('task-1', 'name')
+    assert upload_env['posts'] == ['old-id', 'new-id']
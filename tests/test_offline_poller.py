@@ -0,0 +1,98 @@
+import pytest
+
+from helpers import FakeResponse, wait_until
+
+
+def test_failed_refresh_does_not_notify_listeners(bot, monkeypatch):
+    responses = [[{'id': 'task-1'}], RuntimeError('bad response'), [{'id': 'task-1'}, {'id': 'task-2'}]]
+
+    def fake_list(account, strict=False):
+        assert strict
+        response = responses.pop(0) if responses else [{'id': 'task-1'}]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(bot, 'get_offline_list', fake_list)
+    poller = bot.OfflineTaskPoller('user', interval=0.02)
+    refreshes = []
+    poller.add_listener(lambda account, tasks: refreshes.append(sorted(tasks)))
+    poller.watch('task-1')
+    assert wait_until(lambda: len(refreshes) >= 2)
+    poller.unwatch('task-1')
+
+    # 出錯的那一輪沒有回調，監聽者只看到完整的列表
+    assert refreshes[:2] == [['task-1'], ['task-1', 'task-2']]
+
+
+def test_error_page_raises_in_strict_mode(bot, monkeypatch):
+    pages = [{'tasks': [{'id': 'task-1'}], 'next_page_token': 'next'},
+             {'error': 'internal', 'error_code': 5, 'error_description': 'oops'}]
+    monkeypatch.setattr(bot, 'get_headers', lambda account: {})
+    monkeypatch.setattr(bot, 'pikpak_request', lambda *args, **kwargs: FakeResponse(pages.pop(0)))
+
+    try:
+        bot.get_offline_list('user', strict=True)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('partial list should not be returned')
+
+
+def test_waiting_jobs_move_to_push_when_task_completes(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=0)
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + 'd' * 40)
+    job.account, job.task_id = 'user', 'task-1'
+    monkeypatch.setattr(bot, 'get_offline_poller', lambda account: FakePoller())
+    scheduler.submit(job, 'wait_offline')
+
+    scheduler._on_offline_refresh('user', {'task-1': {'id': 'task-1', 'phase': 'PHASE_TYPE_COMPLETE', 'progress': 100,
+                                                      'message': 'Saved', 'file_id': 'file-1', 'name': 'name'}})
+    assert job.stage == 'push'
+    assert scheduler.queues['push'][0] is job
+
+
+class FakePoller:
+    def watch(self, task_id):
+        pass
+
+    def unwatch(self, task_id):
+        pass
+
+    def add_listener(self, callback):
+        pass
+
+
+def test_snapshot_reuses_recent_refresh(bot, monkeypatch):
+    calls = []
+
+    def fake_list(account, strict=False):
+        calls.append(account)
+        return [{'id': f'task-{len(calls)}'}]
+
+    monkeypatch.setattr(bot, 'get_offline_list', fake_list)
+    poller = bot.OfflineTaskPoller('user', interval=60)
+    refreshes = []
+    poller.add_listener(lambda account, tasks: refreshes.append(sorted(tasks)))
+
+    # 第一次讀取時刷新，之後 max_age 內直接用上次的結果，刷新結果也會通知等待中的任務
+    assert poller.snapshot(60) == [{'id': 'task-1'}]
+    assert poller.snapshot(60) == [{'id': 'task-1'}]
+    assert calls == ['user'] and refreshes == [['task-1']]
+
+    poller.updated -= 61
+    assert poller.snapshot(60) == [{'id': 'task-2'}]
+    assert len(calls) == 2
+
+
+def test_stats_read_offline_list_from_poller(bot, monkeypatch):
+    class SnapshotPoller(FakePoller):
+        def snapshot(self, max_age):
+            return [{'id': 'task-1', 'name': 'name', 'phase': 'PHASE_TYPE_RUNNING', 'progress': 50}]
+
+    monkeypatch.setattr(bot, 'USER', ['user'])
+    monkeypatch.setattr(bot, 'get_offline_poller', lambda account: SnapshotPoller())
+    monkeypatch.setattr(bot, 'get_offline_list', lambda *args, **kwargs: pytest.fail('offline list queried twice'))
+    bot.get_stuck_tasks('user', 0)
+    stats = bot.collect_stats()
+    assert any(task.get('name') == 'name' for task in stats['tasks'])
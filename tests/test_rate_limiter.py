@@ -0,0 +1,43 @@
+from time import time
+
+from helpers import FakeResponse
+
+
+def test_token_bucket_allows_burst_then_paces(bot):
+    bucket = bot.TokenBucket(rate=20, capacity=3)
+    start = time()
+    for _ in range(3):
+        bucket.acquire()
+    assert time() - start < 0.05
+    for _ in range(2):
+        bucket.acquire()
+    assert time() - start >= 0.09
+
+
+def test_throttle_halves_rate_and_success_recovers(bot):
+    bucket = bot.TokenBucket(rate=8, capacity=2)
+    bucket.throttle()
+    assert bucket.rate == 4 and bucket.tokens == 0
+    for _ in range(3):
+        bucket.throttle()
+    assert bucket.rate == 1  # 最低降到設定速率的 1/8
+    for _ in range(100):
+        bucket.success()
+    assert bucket.rate == 8
+
+
+def test_pikpak_request_backs_off_on_429(bot, monkeypatch):
+    responses = [FakeResponse({}, status_code=429), FakeResponse({'ok': True})]
+    for response in responses:
+        response.text = ''
+
+    class FakeSession:
+        def request(self, method, url, **kwargs):
+            return responses.pop(0)
+
+    bucket = bot.TokenBucket(rate=100, capacity=5)
+    monkeypatch.setitem(bot.rate_limiters, 'throttled-user', bucket)
+    monkeypatch.setattr(bot, 'get_session', lambda account: FakeSession())
+
+    assert bot.pikpak_request('throttled-user', 'GET', 'https://example.com').json() == {'ok': True}
+    assert bucket.rate == 50 + 100 / 20
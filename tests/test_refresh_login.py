@@ -0,0 +1,22 @@
+def test_refresh_login_skips_when_headers_already_refreshed(bot, monkeypatch):
+    logins = []
+
+    def fake_login(account):
+        logins.append(account)
+        bot.pikpak_headers[0] = {'Authorization': f'Bearer new-{len(logins)}'}
+
+    monkeypatch.setattr(bot, 'USER', ['user'])
+    monkeypatch.setattr(bot, 'pikpak_headers', [{'Authorization': 'Bearer old'}])
+    monkeypatch.setattr(bot, 'pikpak_clients', [None])
+    monkeypatch.setattr(bot, 'login', fake_login)
+
+    sent_headers = bot.get_headers('user')
+    bot.refresh_login('user', sent_headers)
+    assert logins == ['user']
+
+    # 用舊headers發出的請求較晚才收到 error_code 16，不應再次登入
+    bot.refresh_login('user', sent_headers)
+    assert logins == ['user']
+
+    bot.refresh_login('user', bot.get_headers('user'))
+    assert logins == ['user', 'user']
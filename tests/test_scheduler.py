@@ -0,0 +1,77 @@
+import threading
+
+from helpers import wait_until
+
+
+def start_workers(scheduler, count):
+    for _ in range(count):
+        threading.Thread(target=scheduler._worker, daemon=True).start()
+
+
+def test_job_runs_through_stages_and_is_removed(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=1)
+    stages = []
+
+    def handler(stage, next_stage):
+        def run(job):
+            stages.append(stage)
+            return next_stage
+        return run
+
+    monkeypatch.setitem(scheduler.STAGE_HANDLERS, 'submit', handler('submit', 'push'))
+    monkeypatch.setitem(scheduler.STAGE_HANDLERS, 'push', handler('push', 'cleanup'))
+    monkeypatch.setitem(scheduler.STAGE_HANDLERS, 'cleanup', handler('cleanup', None))
+    start_workers(scheduler, 1)
+
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + 'e' * 40)
+    assert scheduler.add(job) is job
+    assert wait_until(lambda: not scheduler.has_jobs())
+    assert stages == ['submit', 'push', 'cleanup']
+    assert job.id not in [data['id'] for data in bot.job_store.load_jobs()]
+    assert job.info_hash not in scheduler.by_hash
+
+
+def test_later_stages_run_first_and_workers_are_bounded(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=2)
+    release = threading.Event()
+    running, peak, order = [0], [0], []
+    lock = threading.Lock()
+
+    def handler(stage):
+        def run(job):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait()
+            with lock:
+                running[0] -= 1
+                order.append(stage)
+            return None
+        return run
+
+    for stage in scheduler.WORK_STAGES:
+        monkeypatch.setitem(scheduler.STAGE_HANDLERS, stage, handler(stage))
+    for i in range(4):
+        scheduler.submit(bot.Job(None, f'magnet:?xt=urn:btih:{i:040x}'), 'submit')
+    scheduler.submit(bot.Job(None, 'magnet:?xt=urn:btih:' + 'f' * 40), 'cleanup')
+    start_workers(scheduler, 2)
+
+    assert wait_until(lambda: running[0] == 2)
+    release.set()
+    assert wait_until(lambda: not scheduler.has_jobs())
+    assert peak[0] == 2
+    assert order[0] == 'cleanup' or order[1] == 'cleanup'
+
+
+def test_read_timeout_retries_stage_later(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=1)
+
+    def timeout(job):
+        raise bot.requests.exceptions.ReadTimeout()
+
+    monkeypatch.setitem(scheduler.STAGE_HANDLERS, 'push', timeout)
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + '1' * 40)
+    scheduler._run_stage(job, 'push')
+
+    assert job.timeout_retries == 1
+    assert scheduler.delayed[0][2] == 'push' and scheduler.delayed[0][3] is job
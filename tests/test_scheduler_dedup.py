@@ -0,0 +1,66 @@
+import threading
+
+
+def test_duplicate_during_cleanup_starts_new_job(bot, monkeypatch):
+    scheduler = bot.JobScheduler(workers=0)
+    magnet = 'magnet:?xt=urn:btih:' + 'c' * 40
+    job = bot.Job(None, magnet)
+    scheduler.submit(job, 'push')
+    added = []
+
+    def fake_cleanup(finishing):
+        # 清理期間同一磁力再次提交
+        added.append(scheduler.add(bot.Job(None, magnet)))
+        finishing.notify_subscribers('success', 'name', '')
+        return None
+
+    monkeypatch.setitem(scheduler.STAGE_HANDLERS, 'cleanup', fake_cleanup)
+    scheduler._run_stage(job, 'cleanup')
+
+    assert added[0] is not job
+    assert job.subscribers == []
+    assert scheduler.by_hash[job.info_hash] is added[0]
+
+
+def test_duplicate_added_while_monitor_mutates_gids(bot, monkeypatch, tmp_path):
+    store = bot.JobStore(str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(bot, 'job_store', store)
+    scheduler = bot.JobScheduler(workers=0)
+    magnet = 'magnet:?xt=urn:btih:' + 'b' * 40
+    job = bot.Job(None, magnet)
+    scheduler.add(job)
+    job.stage = 'aria2'
+
+    saved_by = set()
+    save_job = store.save_job
+    monkeypatch.setattr(store, 'save_job', lambda saving: saved_by.add(threading.get_ident()) or save_job(saving))
+    stop = threading.Event()
+    errors = []
+
+    def monitor():
+        # 模擬aria2監控線程：不斷有檔案完成、又有新的gid加入，並保存進度
+        i = 0
+        while not stop.is_set():
+            try:
+                job.gids.update({f'gid-{i}-{n}': [f'{n}.mkv', f'file-{n}', 'http://example'] for n in range(20)})
+                bot.check_aria2(job, {gid: {'status': 'complete'} for gid in list(job.gids)[:10]})
+                store.save_job(job)
+            except Exception as e:
+                errors.append(e)
+            i += 1
+
+    thread = threading.Thread(target=monitor)
+    thread.start()
+    for i in range(100):
+        assert scheduler.add(bot.Job(i, magnet)) is job
+    stop.set()
+    thread.join()
+
+    # 提交重複磁力的線程不保存任務本身，通知對象單獨記錄，恢復時一併讀出
+    assert not errors
+    assert saved_by == {thread.ident}
+    data = next(each for each in store.load_jobs() if each['id'] == job.id)
+    assert [chat_id for chat_id, batch_id in bot.Job.from_dict(data).subscribers] == list(range(100))
+
+    store.delete_job(job.id)
+    assert store.load_jobs() == []
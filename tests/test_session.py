@@ -0,0 +1,24 @@
+from time import time
+
+from test_token_manager import make_token
+
+
+def test_saved_session_is_restored_without_login(bot, tmp_path, monkeypatch):
+    store = bot.JobStore(str(tmp_path / 'jobs.db'))
+    refreshed = []
+    monkeypatch.setattr(bot, 'job_store', store)
+    monkeypatch.setattr(bot, 'USER', ['user', 'expired'])
+    monkeypatch.setattr(bot, 'PASSWORD', ['password', 'password'])
+    monkeypatch.setattr(bot, 'pikpak_clients', [None, None])
+    monkeypatch.setattr(bot, 'pikpak_headers', [None, None])
+    monkeypatch.setattr(bot, 'token_manager', bot.TokenManager(margin=300))
+    monkeypatch.setattr(bot, 'refresh_login', lambda account, stale_headers=None: refreshed.append(account))
+    store.save_session('user', {'access_token': make_token(time() + 3600), 'refresh_token': 'refresh'})
+    store.save_session('expired', {'access_token': make_token(time() + 10), 'refresh_token': 'refresh'})
+
+    assert bot.restore_session('user')
+    assert bot.pikpak_clients[0].refresh_token == 'refresh'
+    assert 'user' in bot.token_manager.expires
+    assert bot.restore_session('expired')
+    assert refreshed == ['expired']
+    assert not bot.restore_session('nobody-saved')
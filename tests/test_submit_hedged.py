@@ -0,0 +1,36 @@
+import threading
+from time import sleep
+
+
+def test_duplicates_finishing_together_are_cancelled(bot, monkeypatch):
+    release = threading.Event()
+    cancelled = []
+
+    def fake_submit(job, account):
+        # 兩個帳號都被卡住，然後同時接受
+        release.wait()
+        return f'task-{account}', 'name'
+
+    def wait_both(futures, timeout=None, return_when=None):
+        # 讓兩個提交在同一次 wait 中一起返回
+        done, not_done = real_wait(futures, timeout=timeout, return_when=return_when)
+        if done:
+            sleep(0.1)
+            done = {future for future in futures if future.done()}
+        return done, set(futures) - done
+
+    real_wait = bot.wait
+    monkeypatch.setattr(bot, 'wait', wait_both)
+    monkeypatch.setattr(bot, 'HEDGE_DELAY', 0.05)
+    monkeypatch.setattr(bot, 'submit_to_account', fake_submit)
+    monkeypatch.setattr(bot, 'cancel_duplicate_task',
+                        lambda job, accepted_account, account, task_id: cancelled.append((account, task_id)))
+
+    job = bot.Job(None, 'magnet:?xt=urn:btih:' + 'b' * 40)
+    threading.Timer(0.3, release.set).start()
+    accepted = bot.submit_hedged(job, ['a', 'b'])
+    sleep(0.2)
+
+    assert accepted is not None
+    other = 'b' if accepted[0] == 'a' else 'a'
+    assert cancelled == [(other, f'task-{other}')]
@@ -0,0 +1,29 @@
+import base64
+import json
+from time import time
+
+from helpers import wait_until
+
+
+def make_token(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+def test_token_expiry_reads_jwt_exp(bot):
+    assert bot.TokenManager.token_expiry(make_token(1234567890)) == 1234567890
+    # 無法解析時假定一小時有效
+    assert abs(bot.TokenManager.token_expiry('not-a-jwt') - (time() + 3600)) < 5
+
+
+def test_token_is_refreshed_before_expiry(bot, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(bot, 'USER', ['user'])
+    monkeypatch.setattr(bot, 'refresh_login', lambda account: refreshed.append(account))
+
+    manager = bot.TokenManager(margin=300)
+    manager.track('user', make_token(time() + 300.5))
+    assert refreshed == []
+    assert wait_until(lambda: refreshed == ['user'])
+    # 刷新失敗也不會馬上重試
+    assert manager.expires['user'] > time() + 300